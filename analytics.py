@@ -0,0 +1,356 @@
+"""
+Per-palm yield analytics
+โหลด (palm_id, date, bunch_count) ของ harvest_details ด้วย query เดียวเป็น NumPy array
+แล้วคำนวณทุกต้นพร้อมกันแบบ vectorized (ไม่มี loop ราย row ของข้อมูล):
+ยอดรวม, ค่าเฉลี่ยเคลื่อนที่, ระยะห่างระหว่างการตัด, ช่วงที่ไม่ได้ทะลายติดกัน และยอดรายแถว A-L
+
+"รอบ" คือวันที่ที่มีการบันทึกทะลายของต้นใดก็ได้ในสวน ต้นที่ไม่มีบันทึกในรอบนั้นนับเป็น 0 ทะลาย
+(บันทึก 0 ทะลายหรือไม่บันทึกเลยจึงให้ผลเหมือนกัน)
+"""
+
+import copy
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from datacache import DataCache
+from intents import HARVEST_INTERVAL_DAYS
+from models import db
+from palm_registry import PALMS, PalmInfo
+
+DEFAULT_WINDOW = 6          # ค่าเฉลี่ยเคลื่อนที่: จำนวนครั้งที่ตัดล่าสุด
+ZERO_STREAK_ALERT = 3       # ไม่ได้ทะลายติดกันตั้งแต่กี่รอบจึงนับว่าน่าเป็นห่วง
+INTERVAL_EDGES = (0, 8, 13, 18, 25, 35, 60)  # ช่องของ histogram ระยะห่าง (วัน); ช่องสุดท้ายคือ 60 วันขึ้นไป
+
+# วันที่เป็นจำนวนวันนับจาก 1970-01-01 ตั้งแต่ใน SQLite จึงได้จำนวนเต็มทั้ง 3 คอลัมน์ ไม่ต้อง parse ข้อความวันที่
+HARVESTS_SQL = (
+    "SELECT palm_id, CAST(julianday(date) - 2440587.5 AS INTEGER) AS day, COALESCE(bunch_count, 0) "
+    "FROM harvest_details"
+)
+
+# heatmap: ช่วงปัจจุบันและช่วงก่อนหน้าที่ยาวเท่ากันใน query เดียว (GROUP BY ต้น)
+HEATMAP_SQL = (
+    "SELECT palm_id, "
+    "COALESCE(SUM(CASE WHEN date >= :start THEN bunch_count END), 0) AS bunches, "
+    "COALESCE(SUM(CASE WHEN date < :start THEN bunch_count END), 0) AS previous "
+    "FROM harvest_details WHERE date >= :previous_start AND date <= :end GROUP BY palm_id"
+)
+HEATMAP_MODES = ("count", "delta")
+WEAKEST_LIMIT = 10
+# ช่วงที่ผ่านไปแล้วไม่เปลี่ยนจนกว่าจะมีการแก้ไข harvest_details (version ของตารางทำให้หมดอายุ)
+HEATMAP_CACHE = DataCache(maxsize=64, ttl=3600)
+HEATMAP_TABLES = {"harvest_details"}
+
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+@dataclass
+class HarvestArrays:
+    palms: List[PalmInfo]   # ลำดับตามธรรมชาติ A1..L26; index ของ array ต่อต้นตรงกับรายการนี้
+    idx: np.ndarray         # ตำแหน่งต้นใน palms ของแต่ละบันทึก
+    day: np.ndarray         # วันที่เป็นจำนวนวันนับจาก 1970-01-01
+    bunches: np.ndarray
+
+    def __len__(self):
+        return len(self.idx)
+
+
+@dataclass
+class YieldStats:
+    palms: List[PalmInfo]
+    rows: List[str]
+    round_days: np.ndarray      # วันของแต่ละรอบ (เรียงจากเก่าไปใหม่)
+    round_totals: np.ndarray    # ทะลายรวมทั้งสวนต่อรอบ
+    round_rolling: np.ndarray   # ค่าเฉลี่ยเคลื่อนที่ของ round_totals
+    totals: np.ndarray
+    harvests: np.ndarray        # จำนวนครั้งที่ได้ทะลาย (> 0)
+    average: np.ndarray         # ทะลายเฉลี่ยต่อครั้งที่ตัด
+    recent_average: np.ndarray  # ค่าเฉลี่ย window ครั้งล่าสุด (NaN = ยังไม่เคยได้ทะลาย)
+    mean_interval: np.ndarray   # วันเฉลี่ยระหว่างการตัด (NaN = ตัดไม่ถึง 2 ครั้ง)
+    last_harvest: np.ndarray    # วันที่ได้ทะลายล่าสุด (-1 = ไม่เคย)
+    current_zero_streak: np.ndarray
+    longest_zero_streak: np.ndarray
+    intervals: np.ndarray       # ระยะห่าง (วัน) ทุกคู่ของการตัดติดกันของต้นเดียวกัน
+    row_index: np.ndarray       # แถวของแต่ละต้น (index ใน rows)
+    window: int
+
+
+def _to_date(day) -> Optional[str]:
+    if day < 0:
+        return None
+    return str(_EPOCH + np.timedelta64(int(day), "D"))
+
+
+def _round(value, digits=2):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def palm_index(palms: List[PalmInfo], palm_ids: np.ndarray):
+    """palm_id -> ตำแหน่งใน palms แบบ vectorized; คืน (index ของรายการที่รู้จัก, mask ของรายการที่รู้จัก)"""
+    known_ids = np.asarray([p.id for p in palms], dtype=np.int64)
+    order = np.argsort(known_ids)
+    pos = np.searchsorted(known_ids[order], palm_ids)
+    known = pos < len(order)
+    known[known] = known_ids[order[pos[known]]] == palm_ids[known]
+    return order[pos[known]], known
+
+
+def _fetch_int_array(session, sql, params, columns) -> np.ndarray:
+    result = session.execute(db.text(sql), params)
+    try:
+        # อ่าน tuple จาก cursor ของ driver โดยตรง (แปลงเป็น array ได้ทันที ไม่ผ่าน Row ของ SQLAlchemy)
+        return np.array(result.cursor.fetchall(), dtype=np.int64).reshape(-1, columns)
+    finally:
+        result.close()
+
+
+def load_harvests(start: Optional[date] = None, end: Optional[date] = None, session=None) -> HarvestArrays:
+    """query เดียว แล้วเรียงตาม (ต้น, วันที่) ด้วย NumPy; บันทึกของรหัสที่ไม่มีใน palms ถูกข้าม"""
+    session = session or db.session
+    palms = PALMS.all(session)
+    sql, params = HARVESTS_SQL, {}
+    clauses = []
+    if start is not None:
+        clauses.append("date >= :start")
+        params["start"] = start.isoformat()
+    if end is not None:
+        clauses.append("date <= :end")
+        params["end"] = end.isoformat()
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    records = _fetch_int_array(session, sql, params, 3)
+    palm_ids, day, bunches = records[:, 0], records[:, 1], records[:, 2]
+
+    idx, known = palm_index(palms, palm_ids)
+    day, bunches = day[known], bunches[known]
+
+    sort = np.lexsort((day, idx))
+    return HarvestArrays(palms, idx[sort], day[sort], bunches[sort])
+
+
+def rolling_mean(values: np.ndarray, groups: np.ndarray, window: int) -> np.ndarray:
+    """ค่าเฉลี่ยของ window ค่าล่าสุดภายในกลุ่มเดียวกัน ณ แต่ละตำแหน่ง (values ต้องเรียงตามกลุ่มแล้ว)"""
+    n = len(values)
+    if n == 0:
+        return np.zeros(0)
+    i = np.arange(n)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = groups[1:] != groups[:-1]
+    group_start = np.maximum.accumulate(np.where(new_group, i, 0))
+    lo = np.maximum(i - window + 1, group_start)
+    cs = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    return (cs[i + 1] - cs[lo]) / (i + 1 - lo)
+
+
+def compute_yield_stats(data: HarvestArrays, window: int = DEFAULT_WINDOW) -> YieldStats:
+    n = len(data.palms)
+    rows = sorted({p.row for p in data.palms})
+    row_index = np.asarray([rows.index(p.row) for p in data.palms], dtype=np.int64)
+    idx, day, bunches = data.idx, data.day, data.bunches
+
+    # รอบของสวนและยอดรวมต่อรอบ
+    round_days, round_of = np.unique(day, return_inverse=True)
+    n_rounds = len(round_days)
+    round_totals = np.bincount(round_of, weights=bunches, minlength=n_rounds)
+    round_rolling = rolling_mean(round_totals, np.zeros(n_rounds, dtype=np.int64), window)
+
+    totals = np.bincount(idx, weights=bunches, minlength=n).astype(np.int64)
+
+    # เฉพาะบันทึกที่ได้ทะลาย
+    hit = bunches > 0
+    h_idx, h_day, h_bunches, h_round = idx[hit], day[hit], bunches[hit], round_of[hit]
+    harvests = np.bincount(h_idx, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = totals / harvests
+
+    recent_average = np.full(n, np.nan)
+    last_harvest = np.full(n, -1, dtype=np.int64)
+    last_round = np.full(n, -1, dtype=np.int64)
+    if len(h_idx):
+        rolling = rolling_mean(h_bunches, h_idx, window)
+        is_last = np.ones(len(h_idx), dtype=bool)
+        is_last[:-1] = h_idx[1:] != h_idx[:-1]
+        recent_average[h_idx[is_last]] = rolling[is_last]
+        last_harvest[h_idx[is_last]] = h_day[is_last]
+        last_round[h_idx[is_last]] = h_round[is_last]
+
+    # ระยะห่างระหว่างการตัดติดกันของต้นเดียวกัน
+    same = h_idx[1:] == h_idx[:-1]
+    gap_owner = h_idx[1:][same]
+    intervals = (h_day[1:] - h_day[:-1])[same]
+    gap_counts = np.bincount(gap_owner, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_interval = np.bincount(gap_owner, weights=intervals, minlength=n) / gap_counts
+
+    # ช่วงไม่ได้ทะลายติดกัน (นับเป็นรอบ) ตั้งแต่บันทึกแรกของต้นนั้น
+    first_round = np.full(n, n_rounds, dtype=np.int64)
+    np.minimum.at(first_round, idx, round_of)
+    first_hit = np.full(n, n_rounds, dtype=np.int64)
+    np.minimum.at(first_hit, h_idx, h_round)
+    never = last_round < 0
+    # ไม่เคยได้ทะลาย: นับตั้งแต่บันทึกแรก; ไม่มีบันทึกเลย: first_round = n_rounds -> นับทุกรอบ
+    current = np.where(never, n_rounds - first_round, n_rounds - 1 - last_round)
+    current = np.where(first_round >= n_rounds, n_rounds, current)
+    longest = current.copy()
+    np.maximum.at(longest, np.flatnonzero(~never), (first_hit - first_round)[~never])
+    np.maximum.at(longest, gap_owner, (h_round[1:] - h_round[:-1])[same] - 1)
+
+    return YieldStats(
+        palms=data.palms, rows=rows, round_days=round_days, round_totals=round_totals,
+        round_rolling=round_rolling, totals=totals, harvests=harvests, average=average,
+        recent_average=recent_average, mean_interval=mean_interval, last_harvest=last_harvest,
+        current_zero_streak=current, longest_zero_streak=longest, intervals=intervals,
+        row_index=row_index, window=window,
+    )
+
+
+def interval_distribution(intervals: np.ndarray) -> dict:
+    edges = np.asarray(INTERVAL_EDGES + (np.inf,), dtype=np.float64)
+    counts, _ = np.histogram(intervals, bins=edges)
+    labels = [f"{lo}-{hi - 1}" for lo, hi in zip(INTERVAL_EDGES, INTERVAL_EDGES[1:])] + [f"{INTERVAL_EDGES[-1]}+"]
+    result = {"histogram": [{"days": label, "count": int(c)} for label, c in zip(labels, counts)]}
+    if len(intervals):
+        p10, p50, p90 = np.percentile(intervals, (10, 50, 90))
+        result.update({"p10": float(p10), "median": float(p50), "p90": float(p90)})
+    else:
+        result.update({"p10": None, "median": None, "p90": None})
+    return result
+
+
+def row_summary(stats: YieldStats) -> List[dict]:
+    r, n_rows = stats.row_index, len(stats.rows)
+    palms = np.bincount(r, minlength=n_rows)
+    totals = np.bincount(r, weights=stats.totals, minlength=n_rows)
+    harvests = np.bincount(r, weights=stats.harvests, minlength=n_rows)
+    alert = np.bincount(r, weights=stats.current_zero_streak >= ZERO_STREAK_ALERT, minlength=n_rows)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        per_palm = totals / palms
+        per_harvest = totals / harvests
+    return [
+        {
+            "row": row,
+            "palms": int(palms[i]),
+            "total_bunches": int(totals[i]),
+            "average_per_palm": _round(per_palm[i]),
+            "average_per_harvest": _round(per_harvest[i]),
+            "zero_streak_palms": int(alert[i]),
+        }
+        for i, row in enumerate(stats.rows)
+    ]
+
+
+def yield_report(start: Optional[date] = None, end: Optional[date] = None,
+                 window: int = DEFAULT_WINDOW, session=None) -> dict:
+    """สรุปผลผลิตทุกต้น รายแถว ระยะห่างการตัด และแนวโน้มรายรอบ (ใช้กับ /api/reports/palms)"""
+    stats = compute_yield_stats(load_harvests(start, end, session), window)
+    palms = [
+        {
+            "code": p.code,
+            "row": p.row,
+            "total_bunches": int(stats.totals[i]),
+            "harvests": int(stats.harvests[i]),
+            "average": _round(stats.average[i]),
+            "recent_average": _round(stats.recent_average[i]),
+            "mean_interval_days": _round(stats.mean_interval[i], 1),
+            "last_harvest": _to_date(stats.last_harvest[i]),
+            "current_zero_streak": int(stats.current_zero_streak[i]),
+            "longest_zero_streak": int(stats.longest_zero_streak[i]),
+        }
+        for i, p in enumerate(stats.palms)
+    ]
+    rounds = [
+        {"date": _to_date(d), "bunches": int(t), "rolling": _round(m)}
+        for d, t, m in zip(stats.round_days, stats.round_totals, stats.round_rolling)
+    ]
+    return {
+        "window": window,
+        "rounds": rounds,
+        "palms": palms,
+        "rows": row_summary(stats),
+        "intervals": interval_distribution(stats.intervals),
+    }
+
+
+def heatmap_range(start: Optional[date] = None, end: Optional[date] = None, session=None) -> Tuple[date, date]:
+    """ค่าเริ่มต้น: รอบล่าสุด (HARVEST_INTERVAL_DAYS วันที่ลงท้ายด้วยวันที่มีบันทึกล่าสุด)"""
+    session = session or db.session
+    if end is None:
+        latest = session.execute(db.text("SELECT MAX(date) FROM harvest_details")).scalar()
+        end = date.fromisoformat(str(latest)[:10]) if latest else date.today()
+    if start is None:
+        start = end - timedelta(days=HARVEST_INTERVAL_DAYS - 1)
+    return start, end
+
+
+def yield_heatmap(start: date, end: date, mode: str = "count", session=None) -> dict:
+    """
+    ตาราง แถว (A-L) x หมายเลข (1-26) ของทะลายในช่วง start..end
+    mode="delta" คือผลต่างกับช่วงก่อนหน้าที่ยาวเท่ากัน (ช่วง 15 วัน = เทียบกับรอบก่อน)
+    ช่องที่ไม่มีต้นปาล์มเป็น None
+    """
+    if mode not in HEATMAP_MODES:
+        raise ValueError(mode)
+    if start > end:
+        # เช่น ?start= หลังวันที่มีบันทึกล่าสุดซึ่งเป็นค่าเริ่มต้นของ end
+        raise ValueError(f"{start} > {end}")
+    session = session or db.session
+    palms = [p for p in PALMS.all(session) if p.number > 0]
+    rows = sorted({p.row for p in palms})
+    n_cols = max((p.number for p in palms), default=0)
+    grid_row = np.asarray([rows.index(p.row) for p in palms], dtype=np.int64)
+    grid_col = np.asarray([p.number - 1 for p in palms], dtype=np.int64)
+
+    previous_start = start - (end - start + timedelta(days=1))
+    records = _fetch_int_array(session, HEATMAP_SQL, {
+        "start": start.isoformat(), "end": end.isoformat(), "previous_start": previous_start.isoformat(),
+    }, 3)
+    idx, known = palm_index(palms, records[:, 0])
+
+    # ค่าต่อต้น (ลำดับเดียวกับ palms) แล้ววางลงตารางที่จองไว้ด้วย index ของแถว/คอลัมน์
+    current = np.zeros(len(palms), dtype=np.int64)
+    previous = np.zeros(len(palms), dtype=np.int64)
+    current[idx] = records[known, 1]
+    previous[idx] = records[known, 2]
+    values = current if mode == "count" else current - previous
+
+    grid = np.zeros((len(rows), n_cols), dtype=np.int64)
+    present = np.zeros((len(rows), n_cols), dtype=bool)
+    grid[grid_row, grid_col] = values
+    present[grid_row, grid_col] = True
+
+    weakest = np.argsort(values, kind="stable")[:WEAKEST_LIMIT]
+    return {
+        "mode": mode,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "previous_start": previous_start.isoformat(),
+        "previous_end": (start - timedelta(days=1)).isoformat(),
+        "rows": rows,
+        "columns": n_cols,
+        "values": [
+            [int(v) if ok else None for v, ok in zip(grid_line, mask_line)]
+            for grid_line, mask_line in zip(grid.tolist(), present.tolist())
+        ],
+        "total": int(current.sum()),
+        "previous_total": int(previous.sum()),
+        "min": int(values.min()) if len(values) else 0,
+        "max": int(values.max()) if len(values) else 0,
+        "weakest": [{"code": palms[i].code, "value": int(values[i])} for i in weakest],
+    }
+
+
+def cached_heatmap(start: Optional[date] = None, end: Optional[date] = None, mode: str = "count",
+                   session=None) -> dict:
+    """
+    heatmap จาก cache (คืนสำเนาทั้งก้อนรวม values/weakest ผู้เรียกแก้ไขได้โดยไม่กระทบค่าที่เก็บไว้)
+    ช่วงที่ start หลัง end (หลังเติมค่าเริ่มต้นแล้ว) หรือ mode ไม่รู้จักยก ValueError
+    """
+    # ช่วงค่าเริ่มต้นขึ้นกับวันนี้เมื่อยังไม่มีบันทึก จึงผูกกับวันที่ด้วย
+    key = ("heatmap", start, end, mode, date.today() if end is None else None)
+    payload = HEATMAP_CACHE.get(key)
+    if payload is None:
+        payload = yield_heatmap(*heatmap_range(start, end, session), mode=mode, session=session)
+        HEATMAP_CACHE.put(key, payload, HEATMAP_TABLES)
+    return copy.deepcopy(payload)
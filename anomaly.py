@@ -0,0 +1,332 @@
+"""
+Anomaly detection
+ตรวจค่าที่น่าจะพิมพ์ผิด (เช่น 80 ทะลายแทน 8, ราคาต่อกก. ผิดไป 10 เท่า) ตอนบันทึกจากฟอร์ม บันทึกทั้งรอบ และนำเข้า CSV
+เทียบกับค่าเฉลี่ย/ความแปรปรวนที่ปรับทีละค่าแบบ Welford ในตาราง anomaly_stats (O(1) ต่อรายการ ไม่อ่านข้อมูลเดิมซ้ำ)
+
+- จำนวนทะลายเทียบกับต้นเดียวกัน (ไม่นับ 0 ทะลาย ซึ่งเป็นรอบพักปกติ)
+- ราคาต่อกก. และน้ำหนักรวมเทียบกับเดือนเดียวกันของปี บนสเกล log (ผิด 10 เท่าไม่ว่าทางไหนก็ห่างเท่ากัน)
+ค่าที่ถูก flag ไม่ถูกนำไปรวมในสถิติจนกว่าจะยืนยันในหน้าตรวจสอบ ค่าพิมพ์ผิดจึงไม่ทำให้เกณฑ์กว้างขึ้น
+การลบ/แก้ไขไม่ถอดค่าเดิมออกจากสถิติ (เป็นเกณฑ์อ้างอิง ไม่ใช่ยอดบัญชี) คำนวณใหม่ได้ด้วย `flask rebuild-totals`
+"""
+
+import math
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for
+from flask_login import login_required
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, Anomaly, AnomalyStat, HarvestDetail, HarvestIncome
+from pagination import paginate_request
+from palm_registry import PALMS
+
+anomaly_bp = Blueprint("anomalies", __name__)
+
+DEFAULT_THRESHOLD = 4.0  # |z-score| ที่ถือว่าผิดปกติ
+DEFAULT_MIN_SAMPLES = 5  # จำนวนค่าขั้นต่ำในกลุ่มก่อนเริ่มตรวจ
+
+PENDING, ACCEPTED, DISMISSED = "pending", "accepted", "dismissed"
+STATUSES = (PENDING, ACCEPTED, DISMISSED)
+
+FIELD_LABELS = {
+    "bunch_count": "จำนวนทะลาย",
+    "price_per_kg": "ราคาต่อกก.",
+    "total_weight_kg": "น้ำหนักรวม (กก.)",
+}
+EDIT_ENDPOINTS = {"harvest": "harvest_edit", "income": "income_edit"}
+LIST_ENDPOINTS = {"harvest": "harvest_list", "income": "income_list"}
+LEDGERS = {"harvest": HarvestDetail, "income": HarvestIncome}
+
+
+@dataclass
+class RunningStats:
+    """mean/variance แบบ Welford: เพิ่มค่าทีละตัวโดยไม่ต้องเก็บค่าเดิม"""
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+@dataclass(frozen=True)
+class Check:
+    series: str
+    field: str
+    group: Callable  # values -> group_key
+    min_std: float  # ส่วนเบี่ยงเบนขั้นต่ำ กันกลุ่มที่ค่าแทบไม่เปลี่ยนทำให้ z-score สูงเกินจริง
+    log: bool = False
+    skip_zero: bool = False
+
+    def sample(self, values) -> Optional[float]:
+        value = values.get(self.field)
+        if value is None or (self.skip_zero and value == 0) or (self.log and value <= 0):
+            return None
+        return math.log(value) if self.log else float(value)
+
+    def restore(self, x: float) -> float:
+        return math.exp(x) if self.log else max(x, 0.0)
+
+
+CHECKS: Dict[str, Tuple[Check, ...]] = {
+    "harvest": (
+        Check("bunches", "bunch_count", lambda v: v["palm_id"], min_std=1.0, skip_zero=True),
+    ),
+    "income": (
+        Check("price", "price_per_kg", lambda v: v["date"].month, min_std=0.05, log=True),
+        Check("weight", "total_weight_kg", lambda v: v["date"].month, min_std=0.1, log=True),
+    ),
+}
+
+
+def record_values(kind, row) -> dict:
+    values = {"date": row.date, "palm_id": getattr(row, "palm_id", None)}
+    values.update((check.field, getattr(row, check.field)) for check in CHECKS[kind])
+    return values
+
+
+def _save_stats(session, stats: Dict[tuple, RunningStats]):
+    """เขียนสถิติที่เปลี่ยนด้วย upsert เดียว (executemany)"""
+    if not stats:
+        return
+    stmt = insert(AnomalyStat.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["series", "group_key"],
+        set_={col: getattr(stmt.excluded, col) for col in ("count", "mean", "m2")},
+    )
+    session.execute(stmt, [
+        {"series": series, "group_key": key, "count": s.count, "mean": s.mean, "m2": s.m2}
+        for (series, key), s in stats.items()
+    ])
+
+
+class AnomalyDetector:
+    """
+    ตรวจทีละรายการกับสถิติในหน่วยความจำ แล้วเขียนสถิติที่เปลี่ยนและค่าผิดปกติใน apply() ครั้งเดียว
+    ไม่ commit เอง: ผู้เรียก commit พร้อมรายการที่บันทึก
+    """
+
+    def __init__(self, kind, source="form", session=None):
+        self.kind = kind
+        self.checks = CHECKS[kind]
+        self.source = source
+        self.session = session or db.session
+        self.threshold = current_app.config.get("ANOMALY_Z_THRESHOLD", DEFAULT_THRESHOLD)
+        self.min_samples = current_app.config.get("ANOMALY_MIN_SAMPLES", DEFAULT_MIN_SAMPLES)
+        self.flagged: List[dict] = []
+        self._stats: Dict[tuple, RunningStats] = {}
+        self._dirty = set()
+        self._saved = 0
+        self._preloaded = False
+
+    def preload(self):
+        """โหลดสถิติทุกกลุ่มของ kind นี้ด้วย SELECT เดียว (ใช้ก่อนตรวจหลายรายการ)"""
+        self._load(AnomalyStat.series.in_([check.series for check in self.checks]))
+        self._preloaded = True
+        return self
+
+    def _load(self, condition):
+        stmt = db.select(AnomalyStat.series, AnomalyStat.group_key, AnomalyStat.count,
+                         AnomalyStat.mean, AnomalyStat.m2).where(condition)
+        for series, key, count, mean, m2 in self.session.execute(stmt):
+            self._stats.setdefault((series, key), RunningStats(count, mean, m2))
+
+    def _stats_for(self, keys) -> List[RunningStats]:
+        missing = [k for k in keys if k not in self._stats]
+        if missing and not self._preloaded:
+            self._load(or_(*(and_(AnomalyStat.series == s, AnomalyStat.group_key == g) for s, g in missing)))
+        return [self._stats.setdefault(k, RunningStats()) for k in keys]
+
+    def _samples(self, values):
+        samples = [(check, check.sample(values)) for check in self.checks]
+        samples = [(check, x) for check, x in samples if x is not None]
+        keys = [(check.series, check.group(values)) for check, _ in samples]
+        return zip(samples, keys, self._stats_for(keys))
+
+    def check(self, values, record_id=None, learn=True) -> List[dict]:
+        """
+        ตรวจค่าของรายการเดียว คืนค่าที่ผิดปกติ (ถูกเก็บรอเขียนใน apply ด้วย)
+        ค่าปกติถูกรวมเข้าสถิติตาม learn: True ทุกช่อง, False ไม่รวม หรือ set ของชื่อช่อง
+        (การแก้ไขรายการส่งเฉพาะช่องที่ค่าเดิมยังไม่เคยถูกรวม)
+        """
+        if learn is True:
+            learn = {check.field for check in self.checks}
+        learn = learn or set()
+        found = []
+        for (check, x), key, stats in self._samples(values):
+            std = max(stats.std, check.min_std)
+            z = (x - stats.mean) / std
+            if stats.count >= self.min_samples and abs(z) > self.threshold:
+                found.append({
+                    "kind": self.kind,
+                    "record_id": record_id,
+                    "date": values["date"],
+                    "palm_id": values.get("palm_id"),
+                    "field": check.field,
+                    "value": float(values[check.field]),
+                    "expected": check.restore(stats.mean),
+                    "low": check.restore(stats.mean - self.threshold * std),
+                    "high": check.restore(stats.mean + self.threshold * std),
+                    "score": round(z, 2),
+                    "source": self.source,
+                })
+            elif check.field in learn:
+                stats.add(x)
+                self._dirty.add(key)
+        self.flagged.extend(found)
+        return found
+
+    def learn(self, values):
+        """รวมค่าที่ผู้ใช้ยืนยันแล้วเข้าสถิติโดยไม่ตรวจ"""
+        for (_, x), key, stats in self._samples(values):
+            stats.add(x)
+            self._dirty.add(key)
+
+    def apply(self):
+        _save_stats(self.session, {key: self._stats[key] for key in self._dirty})
+        self._dirty.clear()
+        unsaved = self.flagged[self._saved:]
+        if unsaved:
+            self.session.execute(db.insert(Anomaly.__table__), unsaved)
+            self._saved = len(self.flagged)
+
+
+def check_record(kind, row, learn=True, session=None) -> List[dict]:
+    """ตรวจรายการเดียวจากฟอร์ม (flush ก่อนเพื่อให้มี id ผูกกับค่าผิดปกติ)"""
+    session = session or db.session
+    if row.id is None:
+        session.flush()
+    detector = AnomalyDetector(kind, "form", session)
+    found = detector.check(record_values(kind, row), row.id, learn)
+    detector.apply()
+    return found
+
+
+def clear_pending(kind, row, session=None) -> Set[str]:
+    """
+    ลบค่าผิดปกติที่ยังไม่ตรวจของรายการนี้ เรียกก่อนแก้ไข/ลบ
+    แถวที่บันทึกทั้งรอบหรือนำเข้าไม่มี record_id: จับคู่ด้วยวันที่/ต้น/ช่อง/ค่าเดิม (แบบเดียวกับ rebuild_anomaly_stats)
+    คืนชื่อช่องที่ลบ: ค่าเดิมของช่องเหล่านี้ยังไม่เคยถูกรวมในสถิติ
+    """
+    session = session or db.session
+    same_value = or_(*(
+        and_(Anomaly.field == check.field, Anomaly.value == float(getattr(row, check.field)))
+        for check in CHECKS[kind]
+    ))
+    unlinked = and_(Anomaly.record_id.is_(None), Anomaly.date == row.date, same_value)
+    if kind == "harvest":
+        unlinked = and_(unlinked, Anomaly.palm_id == row.palm_id)
+    result = session.execute(db.delete(Anomaly).where(
+        Anomaly.kind == kind, Anomaly.status == PENDING, or_(Anomaly.record_id == row.id, unlinked),
+    ).returning(Anomaly.field))
+    return set(result.scalars())
+
+
+def skipped_fields(kind, row) -> Set[str]:
+    """ช่องที่ค่าเดิมไม่ได้ถูกตรวจ/รวมในสถิติ (เช่น 0 ทะลาย) เรียกก่อนแก้ไขคู่กับ clear_pending"""
+    values = record_values(kind, row)
+    return {check.field for check in CHECKS[kind] if check.sample(values) is None}
+
+
+def anomaly_message(found: dict) -> str:
+    subject = PALMS.code_of(found["palm_id"]) if found["palm_id"] else found["date"].strftime("%d/%m/%Y")
+    return (
+        f"⚠️ {subject}: {FIELD_LABELS[found['field']]} {found['value']:,.6g} ผิดปกติ "
+        f"(ปกติประมาณ {found['low']:,.4g} - {found['high']:,.4g}) รอตรวจสอบในหน้าค่าผิดปกติ"
+    )
+
+
+def flash_anomalies(found: List[dict], limit: int = 3):
+    for item in found[:limit]:
+        flash(anomaly_message(item), "warning")
+    if len(found) > limit:
+        flash(f"⚠️ พบค่าผิดปกติอีก {len(found) - limit} รายการ รอตรวจสอบในหน้าค่าผิดปกติ", "warning")
+
+
+def rebuild_anomaly_stats(session=None) -> int:
+    """คำนวณ anomaly_stats ใหม่จาก ledger (ไม่นับค่าที่ยังรอตรวจ) คืนจำนวนกลุ่ม"""
+    session = session or db.session
+    session.execute(db.delete(AnomalyStat))
+    pending = set(session.execute(
+        db.select(Anomaly.kind, Anomaly.date, Anomaly.palm_id, Anomaly.field, Anomaly.value)
+        .where(Anomaly.status == PENDING)
+    ).tuples())
+    stats: Dict[tuple, RunningStats] = {}
+    for kind, model in LEDGERS.items():
+        for row in session.execute(db.select(model.__table__)).mappings():
+            for check in CHECKS[kind]:
+                x = check.sample(row)
+                if x is None or (kind, row["date"], row.get("palm_id"), check.field, float(row[check.field])) in pending:
+                    continue
+                stats.setdefault((check.series, check.group(row)), RunningStats()).add(x)
+    _save_stats(session, stats)
+    session.commit()
+    return len(stats)
+
+
+def ensure_anomaly_stats(session=None):
+    """สร้าง anomaly_stats ครั้งแรกสำหรับฐานข้อมูลเดิมที่มีบันทึกแล้ว"""
+    session = session or db.session
+    missing = session.execute(db.text(
+        "SELECT (EXISTS (SELECT 1 FROM harvest_details) OR EXISTS (SELECT 1 FROM harvest_income)) "
+        "AND NOT EXISTS (SELECT 1 FROM anomaly_stats)"
+    )).scalar()
+    if missing:
+        rebuild_anomaly_stats(session)
+
+
+@anomaly_bp.route("/anomalies")
+@login_required
+def review_queue():
+    status = request.args.get("status", PENDING)
+    if status not in STATUSES:
+        status = PENDING
+    page = paginate_request(db.select(Anomaly).where(Anomaly.status == status), Anomaly.date, Anomaly.id)
+    if status != PENDING:
+        page.link_args["status"] = status
+    return render_template(
+        "anomalies.html", rows=page.rows, page=page, status=status, labels=FIELD_LABELS,
+        code_of=PALMS.code_of, edit_endpoints=EDIT_ENDPOINTS, list_endpoints=LIST_ENDPOINTS,
+    )
+
+
+def _review(anomaly_id, status):
+    anomaly = db.get_or_404(Anomaly, anomaly_id)
+    if anomaly.status != PENDING:
+        flash("รายการนี้ตรวจแล้ว", "info")
+        return None
+    if status == ACCEPTED:
+        # ค่าถูกต้อง: รวมเข้าสถิติของกลุ่ม เกณฑ์จึงปรับตามค่าจริงที่เปลี่ยนไป (เช่น ราคาขึ้น)
+        detector = AnomalyDetector(anomaly.kind)
+        detector.learn({"date": anomaly.date, "palm_id": anomaly.palm_id, anomaly.field: anomaly.value})
+        detector.apply()
+    anomaly.status = status
+    anomaly.reviewed_at = datetime.utcnow()
+    db.session.commit()
+    return anomaly
+
+
+@anomaly_bp.route("/anomalies/<int:anomaly_id>/accept", methods=["POST"])
+@login_required
+def accept(anomaly_id):
+    if _review(anomaly_id, ACCEPTED):
+        flash("ยืนยันว่าค่าถูกต้องแล้ว", "success")
+    return redirect(url_for("anomalies.review_queue"))
+
+
+@anomaly_bp.route("/anomalies/<int:anomaly_id>/dismiss", methods=["POST"])
+@login_required
+def dismiss(anomaly_id):
+    if _review(anomaly_id, DISMISSED):
+        flash("ปิดรายการแล้ว", "success")
+    return redirect(url_for("anomalies.review_queue"))
@@ -1,10 +1,27 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file
+from flask import Flask, Response, render_template, request, redirect, url_for, flash
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, HarvestIncome, FertilizerRecord, HarvestDetail, Note, Palm
-from forms import LoginForm, RegisterForm, HarvestIncomeForm, FertilizerForm, HarvestDetailForm, NoteForm
+from models import db, User, HarvestIncome, FertilizerRecord, HarvestDetail, Note
+from forms import LoginForm, RegisterForm, HarvestIncomeForm, FertilizerForm, HarvestDetailForm, HarvestBatchForm, NoteForm
 from auth import auth_bp
-from ai import ai_bp
-from datetime import date, datetime
+from ai import ai_bp, bump_data_version, ANSWER_CACHE
+from dashboard import load_dashboard_summary
+from schema import ensure_indexes, ensure_schema, init_database
+from pagination import paginate_request
+from exports import stream_csv
+from rollups import (
+    rebuild_farm_totals, rebuild_palm_stats, track_income, track_fertilizer, track_harvest,
+    PalmStatsBatch, TotalsBatch,
+)
+from palm_registry import PALMS
+from prediction import cached_farm_forecast
+from jobs import fail_stale_jobs, jobs_bp, submit_import
+from reports import reports_bp
+from anomaly import (
+    anomaly_bp, check_record, clear_pending, flash_anomalies, rebuild_anomaly_stats, skipped_fields, AnomalyDetector,
+)
+from metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE, init_metrics
+from querylog import init_query_log
+from datetime import date
 import os
 from dotenv import load_dotenv
 
@@ -14,7 +31,7 @@ load_dotenv()
 # Initialize extensions
 login_manager = LoginManager()
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     
     # Configuration
@@ -35,37 +52,71 @@ def create_app():
     
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['GOOGLE_API_KEY'] = os.environ.get('GOOGLE_API_KEY', 'your-google-api-key-here')
+    # client ของ Gemini (สร้างครั้งเดียวต่อ process): โมเดล, อัตราการเรียกต่อนาที, จำนวน retry
+    app.config['GEMINI_MODEL'] = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
+    app.config['GEMINI_RATE_PER_MINUTE'] = int(os.environ.get('GEMINI_RATE_PER_MINUTE', 15))
+    app.config['GEMINI_MAX_RETRIES'] = int(os.environ.get('GEMINI_MAX_RETRIES', 2))
+    app.config['GEMINI_API_ENDPOINT'] = os.environ.get('GEMINI_API_ENDPOINT') or None
+    app.config['GEMINI_TRANSPORT'] = os.environ.get('GEMINI_TRANSPORT') or None
+    
+    # จำนวนแถวต่อหน้าของหน้ารายการ (เปลี่ยนได้ด้วย ?per_page=)
+    app.config['LIST_PAGE_SIZE'] = int(os.environ.get('LIST_PAGE_SIZE', 50))
     
     # File upload configuration
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))  # แถวต่อ INSERT
+    app.config['IMPORT_WORKERS'] = int(os.environ.get('IMPORT_WORKERS', 1))  # thread สำหรับ import job
+    # job ที่ไม่ส่ง heartbeat นานเกินนี้ (วินาที) ถือว่า process เจ้าของหยุดไปแล้ว
+    app.config['JOB_HEARTBEAT_TIMEOUT'] = int(os.environ.get('JOB_HEARTBEAT_TIMEOUT', 300))
     app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     
+    # ขอบเขตการรัน SQL ที่ AI สร้าง (จำนวนแถวที่ส่งกลับ, เวลาสูงสุด, แถวตัวอย่างในคำขอสรุป)
+    app.config['AI_SQL_MAX_ROWS'] = int(os.environ.get('AI_SQL_MAX_ROWS', 200))
+    app.config['AI_SQL_TIMEOUT_MS'] = int(os.environ.get('AI_SQL_TIMEOUT_MS', 2000))
+    app.config['AI_PROMPT_ROWS'] = int(os.environ.get('AI_PROMPT_ROWS', 3))
+    
+    # cache คำตอบ AI chat (จำนวนคำถาม, อายุเป็นวินาที)
+    app.config['CHAT_CACHE_SIZE'] = int(os.environ.get('CHAT_CACHE_SIZE', 256))
+    app.config['CHAT_CACHE_TTL'] = int(os.environ.get('CHAT_CACHE_TTL', 600))
+    
+    # บันทึก SQL ต่อ request เพื่อหา N+1 และ query ช้า (ใช้ตอนพัฒนา)
+    app.config['QUERY_LOG'] = os.environ.get('QUERY_LOG', '').lower() in ('1', 'true', 'yes')
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+    app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+    
+    # ตรวจค่าผิดปกติตอนบันทึก/นำเข้า (|z-score| ที่ถือว่าผิดปกติ, จำนวนค่าขั้นต่ำในกลุ่มก่อนเริ่มตรวจ)
+    app.config['ANOMALY_Z_THRESHOLD'] = float(os.environ.get('ANOMALY_Z_THRESHOLD', 4.0))
+    app.config['ANOMALY_MIN_SAMPLES'] = int(os.environ.get('ANOMALY_MIN_SAMPLES', 5))
+    
+    # เตรียมฐานข้อมูลอัตโนมัติตอนเริ่มแอป (ปิดได้เมื่อรัน init-db ตอน deploy แล้ว)
+    app.config['AUTO_INIT_DB'] = os.environ.get('AUTO_INIT_DB', '1').lower() in ('1', 'true', 'yes')
+    
+    # ค่าที่ส่งเข้ามา (เช่นจากชุดทดสอบ) มีผลเหนือค่าจาก environment
+    if config:
+        app.config.update(config)
+    
+    ANSWER_CACHE.configure(maxsize=app.config['CHAT_CACHE_SIZE'], ttl=app.config['CHAT_CACHE_TTL'])
+    
     # Create upload folder if it doesn't exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     # Initialize database
     db.init_app(app)
     
-    # Create tables if they don't exist
-    with app.app_context():
-        db.create_all()
-        
-        # Create palm trees if they don't exist
-        if db.session.query(Palm).count() == 0:
-            # สร้างต้นปาล์ม A1-L26
-            rows = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L']
-            for row in rows:
-                for col in range(1, 27):  # 1-26
-                    code = f"{row}{col}"
-                    palm = Palm(code=code)
-                    db.session.add(palm)
-            
-            try:
-                db.session.commit()
-                print(f"Created {len(rows) * 26} palm trees")
-            except Exception as e:
-                db.session.rollback()
-                print(f"Error creating palm trees: {e}")
+    # ตรวจ schema ด้วย SELECT เดียว; สร้างตาราง/index/ต้นปาล์มเฉพาะเมื่อ version ไม่ตรง
+    # ตั้ง AUTO_INIT_DB=0 แล้วรัน `flask --app app:create_app init-db` ตอน deploy เพื่อข้ามขั้นนี้ทั้งหมด
+    if app.config['AUTO_INIT_DB']:
+        with app.app_context():
+            ensure_schema()
+
+    @app.cli.command("init-db")
+    def init_db_command():
+        """สร้างตาราง, index, ต้นปาล์ม, farm_totals, palm_stats และ anomaly_stats แล้วบันทึก schema version"""
+        result = init_database()
+        print(f"schema {result['version']}: ตรวจ {result['indexes']} index, สร้างต้นปาล์ม {result['palms_created']} ต้น")
+        stale = fail_stale_jobs()
+        if stale:
+            print(f"ปิด job นำเข้าที่ไม่มี heartbeat {stale} งาน")
     
     # Initialize Flask-Login
     login_manager.init_app(app)
@@ -83,9 +134,42 @@ def create_app():
         db.session.rollback()
         return f"<h1>Internal Server Error</h1><p>กรุณาลองใหม่อีกครั้ง หรือติดต่อผู้ดูแลระบบ</p><p>Error: {str(error)}</p>", 500
     
+    @app.cli.command("upgrade-db")
+    def upgrade_db_command():
+        """เพิ่ม index ที่ยังไม่มีในฐานข้อมูล (รันซ้ำได้)"""
+        for name in ensure_indexes():
+            print(f"✅ {name}")
+    
+    @app.cli.command("rebuild-totals")
+    def rebuild_totals_command():
+        """คำนวณตาราง farm_totals, palm_stats และ anomaly_stats ใหม่ทั้งหมดจาก ledger"""
+        months = rebuild_farm_totals()
+        print(f"Rebuilt farm_totals for {months} months")
+        palms = rebuild_palm_stats()
+        print(f"Rebuilt palm_stats for {palms} palms")
+        groups = rebuild_anomaly_stats()
+        print(f"Rebuilt anomaly_stats for {groups} groups")
+    
+    # วัดเวลาต่อ request (Server-Timing header และ /metrics)
+    init_metrics(app)
+    init_query_log(app)
+    
     # Register blueprints
     app.register_blueprint(auth_bp)
     app.register_blueprint(ai_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(reports_bp)
+    app.register_blueprint(anomaly_bp)
+    
+    def handle_import(kind, endpoint):
+        """รับไฟล์ CSV แล้วส่งเข้า import job เบื้องหลัง จากนั้นไปหน้าติดตามความคืบหน้า"""
+        f = request.files.get("file")
+        if not f:
+            flash("ไม่พบไฟล์", "warning")
+            return redirect(url_for(endpoint))
+        
+        job = submit_import(kind, f)
+        return redirect(url_for("jobs.job_page", job_id=job.id))
     
     # Basic routes
     @app.route('/')
@@ -94,27 +178,11 @@ def create_app():
             if not current_user.is_authenticated:
                 return redirect(url_for('auth.login'))
             
-            # Get summary statistics
-            total_income = db.session.query(db.func.sum(HarvestIncome.net_amount)).scalar() or 0
-            total_fertilizer_cost = db.session.query(db.func.sum(FertilizerRecord.total_amount)).scalar() or 0
-            total_harvest_count = db.session.query(db.func.sum(HarvestDetail.bunch_count)).scalar() or 0
-            total_palms = db.session.query(Palm).count()
-            
-            # Get recent activities (limit to prevent timeout)
-            recent_income = db.session.query(HarvestIncome).order_by(HarvestIncome.date.desc()).limit(3).all()
-            recent_fertilizer = db.session.query(FertilizerRecord).order_by(FertilizerRecord.date.desc()).limit(3).all()
-            recent_harvest = db.session.query(HarvestDetail).join(Palm).order_by(HarvestDetail.date.desc()).limit(3).all()
-            recent_notes = db.session.query(Note).order_by(Note.date.desc()).limit(3).all()
-            
-            return render_template('index.html',
-                                 total_income=total_income,
-                                 total_fertilizer_cost=total_fertilizer_cost,
-                                 total_harvest_count=total_harvest_count,
-                                 total_palms=total_palms,
-                                 recent_income=recent_income,
-                                 recent_fertilizer=recent_fertilizer,
-                                 recent_harvest=recent_harvest,
-                                 recent_notes=recent_notes)
+            # ยอดรวมและกิจกรรมล่าสุดทั้งหมดใน query เดียว
+            summary = load_dashboard_summary()
+            # ผลทำนายของวันนี้ถูก cache ไว้จนกว่าจะมีการบันทึกการตัด/การขายใหม่
+            forecast = cached_farm_forecast()
+            return render_template('index.html', summary=summary, forecast=forecast)
         except Exception as e:
             return f"<h1>Database Error</h1><p>ปัญหา: {str(e)}</p><p>กรุณารอสักครู่แล้วลองใหม่</p>", 500
     
@@ -122,6 +190,10 @@ def create_app():
     def health_check():
         return {'status': 'ok', 'message': 'Palm Oil Management System is running!'}
     
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), mimetype=PROMETHEUS_CONTENT_TYPE)
+    
     # Delete routes
     @app.route("/income/delete/<int:id>", methods=["POST"])
     @login_required
@@ -130,8 +202,11 @@ def create_app():
         if not row:
             flash("ไม่พบรายการที่ต้องการลบ", "danger")
             return redirect(url_for("income_list"))
+        track_income(row, -1)
+        clear_pending("income", row)
         db.session.delete(row)
         db.session.commit()
+        bump_data_version("harvest_income")
         flash("ลบรายการสำเร็จ", "success")
         return redirect(url_for("income_list"))
 
@@ -142,8 +217,10 @@ def create_app():
         if not row:
             flash("ไม่พบรายการที่ต้องการลบ", "danger")
             return redirect(url_for("fertilizer_list"))
+        track_fertilizer(row, -1)
         db.session.delete(row)
         db.session.commit()
+        bump_data_version("fertilizer_records")
         flash("ลบรายการสำเร็จ", "success")
         return redirect(url_for("fertilizer_list"))
 
@@ -154,8 +231,11 @@ def create_app():
         if not row:
             flash("ไม่พบรายการที่ต้องการลบ", "danger")
             return redirect(url_for("harvest_list"))
+        track_harvest(row, -1)
+        clear_pending("harvest", row)
         db.session.delete(row)
         db.session.commit()
+        bump_data_version("harvest_details")
         flash("ลบรายการสำเร็จ", "success")
         return redirect(url_for("harvest_list"))
 
@@ -168,6 +248,7 @@ def create_app():
             return redirect(url_for("notes"))
         db.session.delete(row)
         db.session.commit()
+        bump_data_version("notes")
         flash("ลบรายการสำเร็จ", "success")
         return redirect(url_for("notes"))
 
@@ -192,8 +273,12 @@ def create_app():
                 note=form.note.data or None
             )
             db.session.add(row)
+            track_income(row)
+            anomalies = check_record("income", row)
             db.session.commit()
+            bump_data_version("harvest_income")
             flash("บันทึกรายได้สำเร็จ", "success")
+            flash_anomalies(anomalies)
             return redirect(url_for("income_list"))
         return render_template("income_form.html", form=form)
 
@@ -209,6 +294,9 @@ def create_app():
             # Calculate net amount automatically
             net = form.gross_amount.data - form.harvesting_wage.data
             
+            # รวมค่าใหม่ที่ปกติเข้าสถิติเฉพาะช่องที่ค่าเดิมไม่เคยถูกรวม (รอตรวจอยู่ หรือไม่ถูกตรวจ)
+            unlearned = clear_pending("income", row) | skipped_fields("income", row)
+            track_income(row, -1)
             row.date = form.date.data
             row.total_weight_kg = form.total_weight_kg.data
             row.price_per_kg = form.price_per_kg.data
@@ -216,36 +304,41 @@ def create_app():
             row.harvesting_wage = form.harvesting_wage.data
             row.net_amount = net
             row.note = form.note.data or None
+            track_income(row)
+            anomalies = check_record("income", row, learn=unlearned)
             db.session.commit()
+            bump_data_version("harvest_income")
             flash("แก้ไขรายการสำเร็จ", "success")
+            flash_anomalies(anomalies)
             return redirect(url_for("income_list"))
         return render_template("income_form.html", form=form)
 
     @app.route("/income")
     @login_required
     def income_list():
-        rows = HarvestIncome.query.order_by(HarvestIncome.date.desc(), HarvestIncome.id.desc()).all()
-        return render_template("income_list.html", rows=rows)
+        page = paginate_request(db.select(HarvestIncome), HarvestIncome.date, HarvestIncome.id)
+        return render_template("income_list.html", rows=page.rows, page=page)
 
     @app.route("/income/export")
     @login_required
     def income_export():
-        import csv
-        from io import StringIO
-        
-        # ดึงข้อมูลรายได้จากฐานข้อมูล
-        rows = HarvestIncome.query.order_by(HarvestIncome.date.desc()).all()
-        
-        # สร้าง CSV ในหน่วยความจำ
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow(['ID', 'Date', 'Total Weight (kg)', 'Price per kg', 'Gross Amount', 'Harvesting Wage', 'Net Amount', 'Note'])
-        
-        # Data rows
-        for row in rows:
-            writer.writerow([
+        # เลือกเป็นคอลัมน์ (ไม่โหลดเป็น ORM object) เพื่อไม่ให้ identity map โตตามจำนวนแถว
+        stmt = db.select(
+            HarvestIncome.id,
+            HarvestIncome.date,
+            HarvestIncome.total_weight_kg,
+            HarvestIncome.price_per_kg,
+            HarvestIncome.gross_amount,
+            HarvestIncome.harvesting_wage,
+            HarvestIncome.net_amount,
+            HarvestIncome.note
+        ).order_by(HarvestIncome.date.desc(), HarvestIncome.id.desc())
+        
+        return stream_csv(
+            'harvest_income.csv',
+            ['ID', 'Date', 'Total Weight (kg)', 'Price per kg', 'Gross Amount', 'Harvesting Wage', 'Net Amount', 'Note'],
+            stmt,
+            lambda row: [
                 row.id,
                 row.date.strftime('%Y-%m-%d'),
                 row.total_weight_kg,
@@ -254,113 +347,13 @@ def create_app():
                 row.harvesting_wage,
                 row.net_amount,
                 row.note or ''
-            ])
-        
-        # แปลงเป็น bytes สำหรับ send_file
-        from io import BytesIO
-        output_bytes = BytesIO()
-        output_bytes.write(output.getvalue().encode('utf-8-sig'))
-        output_bytes.seek(0)
-        
-        return send_file(
-            output_bytes,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='harvest_income.csv'
+            ]
         )
 
     @app.route("/income/import", methods=["POST"])
     @login_required
     def income_import():
-        import csv
-        from io import StringIO
-        
-        f = request.files.get("file")
-        if not f:
-            flash("ไม่พบไฟล์", "warning")
-            return redirect(url_for("income_list"))
-        
-        try:
-            # อ่านไฟล์ CSV และรองรับ encoding หลายแบบ
-            content = None
-            encodings = ['utf-8-sig', 'utf-8', 'tis-620', 'cp874']
-            
-            for encoding in encodings:
-                try:
-                    f.stream.seek(0)
-                    content = f.stream.read().decode(encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if content is None:
-                flash("ไม่สามารถอ่านไฟล์ได้ กรุณาตรวจสอบรูปแบบไฟล์", "danger")
-                return redirect(url_for("income_list"))
-            
-            stream = StringIO(content)
-            reader = csv.DictReader(stream)
-            
-            count = 0
-            errors = []
-            
-            for i, row in enumerate(reader, 1):
-                try:
-                    # ข้ามแถวที่ไม่มีข้อมูลสำคัญ
-                    date_val = row.get("date") or row.get("Date") or row.get("วันที่")
-                    weight_val = row.get("total_weight_kg") or row.get("Total Weight (kg)") or row.get("น้ำหนักรวม")
-                    
-                    if not date_val or not weight_val:
-                        continue
-                        
-                    # แปลงวันที่ให้รองรับรูปแบบต่างๆ
-                    parsed_date = None
-                    date_formats = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d']
-                    
-                    for fmt in date_formats:
-                        try:
-                            parsed_date = datetime.strptime(str(date_val).strip(), fmt).date()
-                            break
-                        except:
-                            continue
-                    
-                    if not parsed_date:
-                        errors.append(f"แถว {i}: รูปแบบวันที่ไม่ถูกต้อง ({date_val})")
-                        continue
-                    
-                    # ดึงข้อมูลอื่นๆ
-                    price_per_kg = float(row.get("price_per_kg", 0) or row.get("Price per kg", 0) or row.get("ราคาต่อกก", 0))
-                    gross_amount = float(row.get("gross_amount", 0) or row.get("Gross Amount", 0) or row.get("รวมเป็นเงิน", 0))
-                    harvesting_wage = float(row.get("harvesting_wage", 0) or row.get("Harvesting Wage", 0) or row.get("ค่าจ้าง", 0))
-                    net_amount = float(row.get("net_amount", 0) or row.get("Net Amount", 0) or row.get("ยอดคงเหลือ", 0))
-                    note = row.get("note") or row.get("Note") or row.get("หมายเหตุ") or ""
-                    
-                    income_row = HarvestIncome(
-                        date=parsed_date,
-                        total_weight_kg=float(weight_val),
-                        price_per_kg=price_per_kg,
-                        gross_amount=gross_amount,
-                        harvesting_wage=harvesting_wage,
-                        net_amount=net_amount,
-                        note=note.strip() if note else None
-                    )
-                    db.session.add(income_row)
-                    count += 1
-                    
-                except Exception as e:
-                    errors.append(f"แถว {i}: {str(e)}")
-                    continue
-            
-            db.session.commit()
-            
-            if count > 0:
-                flash(f"นำเข้าข้อมูลสำเร็จ {count} รายการ", "success")
-            if errors:
-                flash(f"ข้อผิดพลาด: {'; '.join(errors[:3])}", "warning")
-                
-        except Exception as e:
-            flash(f"เกิดข้อผิดพลาดในการนำเข้าไฟล์: {str(e)}", "danger")
-            
-        return redirect(url_for("income_list"))
+        return handle_import("income", "income_list")
 
     # ------- Fertilizer -------
     @app.route("/fertilizer/new", methods=["GET","POST"])
@@ -380,7 +373,9 @@ def create_app():
                 note=form.note.data or None
             )
             db.session.add(row)
+            track_fertilizer(row)
             db.session.commit()
+            bump_data_version("fertilizer_records")
             flash("บันทึกรายการปุ๋ยสำเร็จ", "success")
             return redirect(url_for("fertilizer_list"))
         return render_template("fertilizer_form.html", form=form)
@@ -396,6 +391,7 @@ def create_app():
         if form.validate_on_submit():
             spreading_wage = form.spreading_wage.data or 0
             total = form.sacks.data * form.unit_price.data + spreading_wage
+            track_fertilizer(row, -1)
             row.date = form.date.data
             row.item = form.item.data.strip()
             row.sacks = form.sacks.data
@@ -403,7 +399,9 @@ def create_app():
             row.spreading_wage = spreading_wage
             row.total_amount = total
             row.note = form.note.data or None
+            track_fertilizer(row)
             db.session.commit()
+            bump_data_version("fertilizer_records")
             flash("แก้ไขรายการปุ๋ยสำเร็จ", "success")
             return redirect(url_for("fertilizer_list"))
         return render_template("fertilizer_form.html", form=form)
@@ -411,197 +409,51 @@ def create_app():
     @app.route("/fertilizer")
     @login_required
     def fertilizer_list():
-        rows = FertilizerRecord.query.order_by(FertilizerRecord.date.desc(), FertilizerRecord.id.desc()).all()
-        return render_template("fertilizer_list.html", rows=rows)
+        page = paginate_request(db.select(FertilizerRecord), FertilizerRecord.date, FertilizerRecord.id)
+        return render_template("fertilizer_list.html", rows=page.rows, page=page)
 
     @app.route("/fertilizer/export")
     @login_required
     def fertilizer_export():
-        import csv
-        from io import StringIO
-        
-        # ดึงข้อมูลจากฐานข้อมูล
-        rows = FertilizerRecord.query.order_by(FertilizerRecord.date.desc()).all()
-        
-        # สร้าง CSV ใน memory
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # เขียน header
-        writer.writerow(['ID', 'Date', 'Type', 'Amount', 'Cost', 'Notes'])
-        
-        # เขียนข้อมูล
-        for row in rows:
-            writer.writerow([
+        stmt = db.select(
+            FertilizerRecord.id,
+            FertilizerRecord.date,
+            FertilizerRecord.item,
+            FertilizerRecord.sacks,
+            FertilizerRecord.unit_price,
+            FertilizerRecord.note
+        ).order_by(FertilizerRecord.date.desc(), FertilizerRecord.id.desc())
+        
+        return stream_csv(
+            'fertilizer_records.csv',
+            ['ID', 'Date', 'Type', 'Amount', 'Cost', 'Notes'],
+            stmt,
+            lambda row: [
                 row.id,
                 row.date.strftime('%Y-%m-%d'),
                 row.item,
                 row.sacks,
                 row.unit_price,
                 row.note or ''
-            ])
-        
-        # แปลงเป็น bytes สำหรับ send_file
-        from io import BytesIO
-        output_bytes = BytesIO()
-        output_bytes.write(output.getvalue().encode('utf-8-sig'))
-        output_bytes.seek(0)
-        
-        return send_file(
-            output_bytes,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='fertilizer_records.csv'
+            ]
         )
 
     @app.route("/fertilizer/import", methods=["POST"])
     @login_required
     def fertilizer_import():
-        import csv
-        from io import StringIO
-        
-        f = request.files.get("file")
-        if not f:
-            flash("ไม่พบไฟล์", "warning")
-            return redirect(url_for("fertilizer_list"))
-        
-        print(f"[DEBUG] File received: {f.filename}")  # Debug log
-        
-        try:
-            # อ่านไฟล์ CSV และรองรับ encoding หลายแบบ
-            content = None
-            encodings = ['utf-8-sig', 'utf-8', 'tis-620', 'cp874']
-            
-            for encoding in encodings:
-                try:
-                    f.stream.seek(0)
-                    content = f.stream.read().decode(encoding)
-                    print(f"[DEBUG] Successfully decoded with {encoding}")  # Debug log
-                    break
-                except UnicodeDecodeError:
-                    print(f"[DEBUG] Failed to decode with {encoding}")  # Debug log
-                    continue
-            
-            if content is None:
-                flash("ไม่สามารถอ่านไฟล์ได้ กรุณาตรวจสอบรูปแบบไฟล์", "danger")
-                return redirect(url_for("fertilizer_list"))
-            
-            print(f"[DEBUG] CSV Content:\n{content}")  # Debug log
-            
-            stream = StringIO(content)
-            reader = csv.DictReader(stream)
-            
-            print(f"[DEBUG] CSV Headers: {reader.fieldnames}")  # Debug log
-            
-            count = 0
-            errors = []
-            
-            for i, row in enumerate(reader, 1):
-                try:
-                    print(f"[DEBUG] Processing row {i}: {row}")  # Debug log
-                    
-                    # ข้ามแถวที่ไม่มีข้อมูลสำคัญ - รองรับ headers หลายแบบ
-                    date_val = (row.get("date") or row.get("Date") or row.get("วันที่") or 
-                               row.get("DATE") or row.get("Date"))
-                    
-                    # รองรับ item/Type fields
-                    item_val = (row.get("item") or row.get("Item") or row.get("รายการ") or 
-                               row.get("Type") or row.get("TYPE") or row.get("type"))
-                    
-                    if not date_val or not item_val:
-                        print(f"[DEBUG] Row {i} skipped - missing required fields (date: {date_val}, item: {item_val})")  # Debug log
-                        continue
-                        
-                    # แปลงวันที่ให้รองรับรูปแบบต่างๆ
-                    parsed_date = None
-                    date_formats = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d']
-                    
-                    for fmt in date_formats:
-                        try:
-                            parsed_date = datetime.strptime(str(date_val).strip(), fmt).date()
-                            print(f"[DEBUG] Date parsed successfully: {parsed_date}")  # Debug log
-                            break
-                        except:
-                            continue
-                    
-                    if not parsed_date:
-                        errors.append(f"แถว {i}: รูปแบบวันที่ไม่ถูกต้อง ({date_val})")
-                        print(f"[DEBUG] Date parsing failed for row {i}")  # Debug log
-                        continue
-                    
-                    # ดึงข้อมูลอื่นๆ - รองรับ field names หลายแบบ
-                    # สำหรับ sacks/Amount
-                    sacks = float(row.get("sacks", 0) or row.get("Sacks", 0) or row.get("ถุง", 0) or 
-                                 row.get("Amount", 0) or row.get("amount", 0) or 0)
-                    
-                    # สำหรับ unit_price - ถ้าไม่มีให้ใช้ Cost/Total เป็น unit_price และ spreading_wage = 0
-                    unit_price = float(row.get("unit_price", 0) or row.get("Unit Price", 0) or row.get("ราคาต่อหน่วย", 0) or 0)
-                    spreading_wage = float(row.get("spreading_wage", 0) or row.get("Spreading Wage", 0) or row.get("ค่าแรง", 0) or 0)
-                    
-                    # ถ้าไม่มี unit_price แต่มี Cost ให้ใช้ Cost เป็น total cost แทน
-                    cost_val = float(row.get("Cost", 0) or row.get("cost", 0) or row.get("ค่าใช้จ่าย", 0) or 0)
-                    
-                    if unit_price == 0 and cost_val > 0:
-                        # กรณีมี Cost แต่ไม่มี unit_price - คำนวณ unit_price จาก cost/sacks
-                        if sacks > 0:
-                            unit_price = cost_val / sacks
-                            spreading_wage = 0
-                        else:
-                            # ถ้าไม่มี sacks ให้ตั้งเป็น 1 unit และ unit_price = cost
-                            sacks = 1
-                            unit_price = cost_val
-                            spreading_wage = 0
-                    
-                    note = (row.get("note") or row.get("Note") or row.get("หมายเหตุ") or 
-                           row.get("Notes") or row.get("notes") or "")
-                    
-                    total_amount = sacks * unit_price + spreading_wage
-                    
-                    print(f"[DEBUG] Creating FertilizerRecord with: date={parsed_date}, item={item_val}, sacks={sacks}, unit_price={unit_price}, spreading_wage={spreading_wage}, total_amount={total_amount}")  # Debug log
-                    
-                    fertilizer = FertilizerRecord(
-                        date=parsed_date,
-                        item=str(item_val).strip(),
-                        sacks=sacks,
-                        unit_price=unit_price,
-                        spreading_wage=spreading_wage,
-                        total_amount=total_amount,
-                        note=note.strip() if note else None
-                    )
-                    db.session.add(fertilizer)
-                    count += 1
-                    
-                except Exception as e:
-                    errors.append(f"แถว {i}: {str(e)}")
-                    print(f"[DEBUG] Error processing row {i}: {str(e)}")  # Debug log
-                    continue
-            
-            db.session.commit()
-            print(f"[DEBUG] Transaction committed. Imported {count} records")  # Debug log
-            
-            if count > 0:
-                flash(f"นำเข้าข้อมูลสำเร็จ {count} รายการ", "success")
-            if errors:
-                flash(f"ข้อผิดพลาด: {'; '.join(errors[:3])}", "warning")
-                
-        except Exception as e:
-            db.session.rollback()
-            flash(f"เกิดข้อผิดพลาดในการนำเข้าไฟล์: {str(e)}", "danger")
-            print(f"[DEBUG] Import failed with error: {str(e)}")  # Debug log
-            
-        return redirect(url_for("fertilizer_list"))
+        return handle_import("fertilizer", "fertilizer_list")
 
     # ------- Harvest Detail (per tree) -------
     @app.route("/harvest/new", methods=["GET","POST"])
     @login_required
     def harvest_new():
         form = HarvestDetailForm()
-        # ดึงข้อมูลต้นปาล์มทั้งหมดเรียงตามรหัส
-        palms = Palm.query.order_by(Palm.code).all()
+        # ต้นปาล์มทั้งหมดเรียง A1..L26 จาก palm registry (ไม่ query ทุก request)
+        palms = PALMS.all()
         
         if form.validate_on_submit():
             # Find the palm by code
-            palm = Palm.query.filter_by(code=form.palm_code.data).first()
+            palm = PALMS.get(form.palm_code.data)
             if not palm:
                 flash(f"ไม่พบต้นปาล์มรหัส {form.palm_code.data}", "danger")
                 return render_template("harvest_form.html", form=form, palms=palms)
@@ -613,11 +465,70 @@ def create_app():
                 remarks=form.remarks.data or None
             )
             db.session.add(row)
+            track_harvest(row)
+            anomalies = check_record("harvest", row)
             db.session.commit()
+            bump_data_version("harvest_details")
             flash("บันทึกการเก็บเกี่ยวสำเร็จ", "success")
+            flash_anomalies(anomalies)
             return redirect(url_for("harvest_list"))
         return render_template("harvest_form.html", form=form, palms=palms)
 
+    @app.route("/harvest/batch", methods=["GET", "POST"])
+    @login_required
+    def harvest_batch():
+        """บันทึกจำนวนทะลายของทุกต้นในรอบเดียว: request เดียว, INSERT เดียว, commit เดียว"""
+        form = HarvestBatchForm()
+        palm_ids = PALMS.ids()
+        counts = {}  # รหัสต้น -> จำนวนทะลาย (เฉพาะช่องที่กรอก)
+        errors = []
+        if request.method == "POST":
+            for key, value in request.form.items():
+                if not key.startswith("bunch_") or not value.strip():
+                    continue
+                code = key[len("bunch_"):]
+                if code not in palm_ids:
+                    errors.append(f"ไม่พบต้นปาล์มรหัส {code}")
+                    continue
+                try:
+                    count = int(value)
+                except ValueError:
+                    count = -1
+                if count < 0:
+                    errors.append(f"{code}: จำนวนทะลายต้องเป็นจำนวนเต็มไม่ติดลบ")
+                    continue
+                counts[code] = count
+
+        if form.validate_on_submit():
+            if not errors and not counts:
+                errors.append("ยังไม่ได้กรอกจำนวนทะลายของต้นใด")
+            if not errors:
+                remarks = form.remarks.data or None
+                rows = [
+                    {"date": form.date.data, "palm_id": palm_ids[code], "bunch_count": count, "remarks": remarks}
+                    for code, count in counts.items()
+                ]
+                totals = TotalsBatch()
+                palm_stats = PalmStatsBatch()
+                detector = AnomalyDetector("harvest", "batch").preload()
+                for row in rows:
+                    totals.add(row["date"], {"bunch_count": row["bunch_count"]})
+                    palm_stats.add(row["palm_id"], row["date"], row["bunch_count"])
+                    detector.check(row)
+                # INSERT ... VALUES (...), (...), ... คำสั่งเดียว แทน 1 request ต่อต้น
+                db.session.execute(db.insert(HarvestDetail.__table__).values(rows))
+                totals.apply()
+                palm_stats.apply()
+                detector.apply()
+                db.session.commit()
+                bump_data_version("harvest_details")
+                flash(f"บันทึกการเก็บเกี่ยว {len(rows)} ต้นสำเร็จ", "success")
+                flash_anomalies(detector.flagged)
+                return redirect(url_for("harvest_list"))
+        for message in errors:
+            flash(message, "danger")
+        return render_template("harvest_form_icons.html", form=form, batch=True)
+
     @app.route("/harvest/edit/<int:id>", methods=["GET", "POST"])
     @login_required
     def harvest_edit(id):
@@ -626,188 +537,78 @@ def create_app():
             flash("ไม่พบรายการที่ต้องการแก้ไข", "danger")
             return redirect(url_for("harvest_list"))
         form = HarvestDetailForm(obj=row)
-        # ดึงข้อมูลต้นปาล์มทั้งหมดเรียงตามรหัส
-        palms = Palm.query.order_by(Palm.code).all()
-        # Set the palm_code field from the related palm
-        form.palm_code.data = row.palm.code
+        palms = PALMS.all()
+        # Set the palm_code field from the related palm (เฉพาะตอนเปิดฟอร์ม ไม่ทับค่าที่ผู้ใช้ส่งมา)
+        if request.method == "GET":
+            form.palm_code.data = PALMS.code_of(row.palm_id)
         
         if form.validate_on_submit():
             # Find the palm by code
-            palm = Palm.query.filter_by(code=form.palm_code.data).first()
+            palm = PALMS.get(form.palm_code.data)
             if not palm:
                 flash(f"ไม่พบต้นปาล์มรหัส {form.palm_code.data}", "danger")
                 return render_template("harvest_form.html", form=form, palms=palms)
             
+            unlearned = clear_pending("harvest", row) | skipped_fields("harvest", row)
+            track_harvest(row, -1)
             row.date = form.date.data
             row.palm_id = palm.id
             row.bunch_count = form.bunch_count.data
             row.remarks = form.remarks.data or None
+            track_harvest(row)
+            anomalies = check_record("harvest", row, learn=unlearned)
             db.session.commit()
+            bump_data_version("harvest_details")
             flash("แก้ไขการเก็บเกี่ยวสำเร็จ", "success")
+            flash_anomalies(anomalies)
             return redirect(url_for("harvest_list"))
         return render_template("harvest_form.html", form=form, palms=palms)
 
     @app.route("/harvest")
     @login_required
     def harvest_list():
-        # Join with Palm to get palm code และแยกข้อมูลให้ตรงกับ template
-        rows = []
-        results = db.session.execute(
-            db.select(HarvestDetail, Palm.code).join(Palm).order_by(HarvestDetail.date.desc(), HarvestDetail.id.desc())
-        ).all()
-        
-        for harvest_detail, palm_code in results:
-            rows.append((
-                harvest_detail.id,
-                harvest_detail.date,
-                palm_code,
-                harvest_detail.bunch_count,
-                harvest_detail.remarks
-            ))
-        
-        return render_template("harvest_list.html", rows=rows)
+        # เลือกคอลัมน์ให้ตรงกับ template (id, date, code, count, remarks); รหัสต้นมาจาก palm registry ไม่ต้อง JOIN
+        stmt = db.select(
+            HarvestDetail.id,
+            HarvestDetail.date,
+            HarvestDetail.palm_id,
+            HarvestDetail.bunch_count,
+            HarvestDetail.remarks
+        )
+        page = paginate_request(stmt, HarvestDetail.date, HarvestDetail.id)
+        rows = [(id, d, PALMS.code_of(palm_id), count, remarks) for id, d, palm_id, count, remarks in page.rows]
+        return render_template("harvest_list.html", rows=rows, page=page)
 
     @app.route("/harvest/export")
     @login_required
     def harvest_export():
-        import csv
-        from io import StringIO
-        
-        # ดึงข้อมูลจากฐานข้อมูล พร้อม JOIN เพื่อได้รหัสต้นปาล์ม
-        query = db.session.query(
+        # เรียงตาม index (date, id) จึงไม่ต้อง sort ทั้งตารางก่อนส่งแถวแรก; รหัสต้นแปลงจาก palm registry
+        stmt = db.select(
             HarvestDetail.id,
             HarvestDetail.date,
-            Palm.code.label('palm_code'),
+            HarvestDetail.palm_id,
             HarvestDetail.bunch_count,
             HarvestDetail.remarks
-        ).join(Palm, HarvestDetail.palm_id == Palm.id)\
-         .order_by(HarvestDetail.date.desc(), Palm.code)
-        
-        rows = query.all()
-        
-        # สร้าง CSV ใน memory
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # เขียน header
-        writer.writerow(['ID', 'date', 'palm_code', 'bunch_count', 'remarks'])
-        
-        # เขียนข้อมูล
-        for row in rows:
-            writer.writerow([
+        ).order_by(HarvestDetail.date.desc(), HarvestDetail.id.desc())
+        palm_codes = {p.id: p.code for p in PALMS.all()}
+        
+        return stream_csv(
+            'harvest_details.csv',
+            ['ID', 'date', 'palm_code', 'bunch_count', 'remarks'],
+            stmt,
+            lambda row: [
                 row.id,
                 row.date.strftime('%Y-%m-%d'),
-                row.palm_code,
+                palm_codes.get(row.palm_id, ''),
                 row.bunch_count,
                 row.remarks or ''
-            ])
-        
-        # แปลงเป็น bytes สำหรับ send_file
-        from io import BytesIO
-        output_bytes = BytesIO()
-        output_bytes.write(output.getvalue().encode('utf-8-sig'))
-        output_bytes.seek(0)
-        
-        return send_file(
-            output_bytes,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='harvest_details.csv'
+            ]
         )
 
     @app.route("/harvest/import", methods=["POST"])
     @login_required
     def harvest_import():
-        import csv
-        from io import StringIO
-        
-        f = request.files.get("file")
-        if not f:
-            flash("ไม่พบไฟล์", "warning")
-            return redirect(url_for("harvest_list"))
-        
-        try:
-            # อ่านไฟล์ CSV และรองรับ encoding หลายแบบ
-            content = None
-            encodings = ['utf-8-sig', 'utf-8', 'tis-620', 'cp874']
-            
-            for encoding in encodings:
-                try:
-                    f.stream.seek(0)
-                    content = f.stream.read().decode(encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if content is None:
-                flash("ไม่สามารถอ่านไฟล์ได้ กรุณาตรวจสอบรูปแบบไฟล์", "danger")
-                return redirect(url_for("harvest_list"))
-            
-            stream = StringIO(content)
-            reader = csv.DictReader(stream)
-            
-            count = 0
-            errors = []
-            
-            for i, row in enumerate(reader, 1):
-                try:
-                    # ข้ามแถวที่ไม่มีข้อมูลสำคัญ
-                    date_val = row.get("date") or row.get("Date") or row.get("วันที่")
-                    palm_code_val = row.get("palm_code") or row.get("Palm Code") or row.get("รหัสต้นปาล์ม")
-                    
-                    if not date_val or not palm_code_val:
-                        continue
-                        
-                    # แปลงวันที่ให้รองรับรูปแบบต่างๆ
-                    parsed_date = None
-                    date_formats = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d']
-                    
-                    for fmt in date_formats:
-                        try:
-                            parsed_date = datetime.strptime(str(date_val).strip(), fmt).date()
-                            break
-                        except:
-                            continue
-                    
-                    if not parsed_date:
-                        errors.append(f"แถว {i}: รูปแบบวันที่ไม่ถูกต้อง ({date_val})")
-                        continue
-                    
-                    # ค้นหาต้นปาล์มจากรหัส
-                    palm = Palm.query.filter_by(code=str(palm_code_val).strip()).first()
-                    if not palm:
-                        errors.append(f"แถว {i}: ไม่พบต้นปาล์มรหัส {palm_code_val}")
-                        continue
-                    
-                    # ดึงข้อมูลอื่นๆ
-                    bunch_count = int(row.get("bunch_count", 0) or row.get("Bunch Count", 0) or row.get("จำนวนทะลาย", 0))
-                    remarks = row.get("remarks") or row.get("Remarks") or row.get("หมายเหตุ") or ""
-                    
-                    harvest = HarvestDetail(
-                        date=parsed_date,
-                        palm_id=palm.id,
-                        bunch_count=bunch_count,
-                        remarks=remarks.strip() if remarks else None
-                    )
-                    db.session.add(harvest)
-                    count += 1
-                    
-                except Exception as e:
-                    errors.append(f"แถว {i}: {str(e)}")
-                    continue
-            
-            db.session.commit()
-            
-            if count > 0:
-                flash(f"นำเข้าข้อมูลสำเร็จ {count} รายการ", "success")
-            if errors:
-                flash(f"ข้อผิดพลาด: {'; '.join(errors[:3])}", "warning")
-                
-        except Exception as e:
-            db.session.rollback()
-            flash(f"เกิดข้อผิดพลาดในการนำเข้าไฟล์: {str(e)}", "danger")
-            
-        return redirect(url_for("harvest_list"))
+        return handle_import("harvest", "harvest_list")
 
     # ------- Notes -------
     @app.route("/notes", methods=["GET","POST"])
@@ -822,10 +623,11 @@ def create_app():
             )
             db.session.add(row)
             db.session.commit()
+            bump_data_version("notes")
             flash("บันทึกโน้ตสำเร็จ", "success")
             return redirect(url_for("notes"))
-        rows = Note.query.order_by(Note.date.desc(), Note.id.desc()).all()
-        return render_template("notes.html", form=form, rows=rows)
+        page = paginate_request(db.select(Note), Note.date, Note.id)
+        return render_template("notes.html", form=form, rows=page.rows, page=page)
 
     @app.route("/notes/edit/<int:id>", methods=["GET", "POST"])
     @login_required
@@ -840,143 +642,52 @@ def create_app():
             row.title = form.title.data.strip()
             row.content = form.content.data.strip()
             db.session.commit()
+            bump_data_version("notes")
             flash("แก้ไขโน้ตสำเร็จ", "success")
             return redirect(url_for("notes"))
         # แสดงฟอร์มแก้ไขแยกจากฟอร์มเพิ่ม
-        rows = Note.query.order_by(Note.date.desc(), Note.id.desc()).all()
-        return render_template("notes.html", form=form, rows=rows)
+        page = paginate_request(db.select(Note), Note.date, Note.id)
+        return render_template("notes.html", form=form, rows=page.rows, page=page)
 
     @app.route("/notes/export")
     @login_required
     def notes_export():
-        import csv
-        from io import StringIO
-        
-        # ดึงข้อมูลจากฐานข้อมูล
-        rows = Note.query.order_by(Note.date.desc()).all()
-        
-        # สร้าง CSV ใน memory
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # เขียน header
-        writer.writerow(['ID', 'Date', 'Title', 'Content'])
-        
-        # เขียนข้อมูล
-        for row in rows:
-            writer.writerow([
+        stmt = db.select(Note.id, Note.date, Note.title, Note.content)\
+            .order_by(Note.date.desc(), Note.id.desc())
+        
+        return stream_csv(
+            'notes.csv',
+            ['ID', 'Date', 'Title', 'Content'],
+            stmt,
+            lambda row: [
                 row.id,
                 row.date.strftime('%Y-%m-%d'),
                 row.title,
                 row.content or ''
-            ])
-        
-        # แปลงเป็น bytes สำหรับ send_file
-        from io import BytesIO
-        output_bytes = BytesIO()
-        output_bytes.write(output.getvalue().encode('utf-8-sig'))
-        output_bytes.seek(0)
-        
-        return send_file(
-            output_bytes,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='notes.csv'
+            ]
         )
 
     @app.route("/notes/import", methods=["POST"])
     @login_required
     def notes_import():
-        import csv
-        from io import StringIO
-        
-        f = request.files.get("file")
-        if not f:
-            flash("ไม่พบไฟล์", "warning")
-            return redirect(url_for("notes"))
-        
-        try:
-            # อ่านไฟล์ CSV และรองรับ encoding หลายแบบ
-            content = None
-            encodings = ['utf-8-sig', 'utf-8', 'tis-620', 'cp874']
-            
-            for encoding in encodings:
-                try:
-                    f.stream.seek(0)
-                    content = f.stream.read().decode(encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if content is None:
-                flash("ไม่สามารถอ่านไฟล์ได้ กรุณาตรวจสอบรูปแบบไฟล์", "danger")
-                return redirect(url_for("notes"))
-            
-            stream = StringIO(content)
-            reader = csv.DictReader(stream)
-            
-            count = 0
-            errors = []
-            
-            for i, row in enumerate(reader, 1):
-                try:
-                    # ข้ามแถวที่ไม่มีข้อมูลสำคัญ
-                    date_val = row.get("date") or row.get("Date") or row.get("วันที่")
-                    title_val = row.get("title") or row.get("Title") or row.get("หัวข้อ")
-                    
-                    if not date_val or not title_val:
-                        continue
-                        
-                    # แปลงวันที่ให้รองรับรูปแบบต่างๆ
-                    parsed_date = None
-                    date_formats = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d']
-                    
-                    for fmt in date_formats:
-                        try:
-                            parsed_date = datetime.strptime(str(date_val).strip(), fmt).date()
-                            break
-                        except:
-                            continue
-                    
-                    if not parsed_date:
-                        errors.append(f"แถว {i}: รูปแบบวันที่ไม่ถูกต้อง ({date_val})")
-                        continue
-                    
-                    # ดึงข้อมูลอื่นๆ
-                    content_val = row.get("content") or row.get("Content") or row.get("รายละเอียด") or ""
-                    
-                    note = Note(
-                        date=parsed_date,
-                        title=str(title_val).strip(),
-                        content=str(content_val).strip() if content_val else ""
-                    )
-                    db.session.add(note)
-                    count += 1
-                    
-                except Exception as e:
-                    errors.append(f"แถว {i}: {str(e)}")
-                    continue
-            
-            db.session.commit()
-            
-            if count > 0:
-                flash(f"นำเข้าข้อมูลสำเร็จ {count} รายการ", "success")
-            if errors:
-                flash(f"ข้อผิดพลาด: {'; '.join(errors[:3])}", "warning")
-                
-        except Exception as e:
-            flash(f"เกิดข้อผิดพลาดในการนำเข้าไฟล์: {str(e)}", "danger")
-            
-        return redirect(url_for("notes"))
+        return handle_import("notes", "notes")
 
     return app
 
-# Create application instance for production deployment
-app = create_app()
+def __getattr__(name):
+    """
+    `app` ถูกสร้างเมื่อมีคนขอครั้งแรกเท่านั้น (เช่น gunicorn app:app)
+    การ import create_app จาก server.py หรือชุดทดสอบจึงไม่สร้างแอปเกินมาอีกตัว
+    """
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
+    app = create_app()
     # For production deployment (Render, Heroku, etc.)
     port = int(os.environ.get("PORT", 8000))
     debug = os.environ.get("FLASK_ENV") != "production"
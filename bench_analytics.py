@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark analytics ผลผลิตรายต้น: ข้อมูลจำลอง 10 ปี (ตัดทุก 15 วัน ครบ 312 ต้น)
+เทียบแบบ vectorized (NumPy) กับ loop Python รายต้น แล้วตรวจว่าผลตรงกัน
+
+Usage: python bench_analytics.py [years] [iterations]
+"""
+
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from analytics import DEFAULT_WINDOW, compute_yield_stats, load_harvests
+from app import create_app
+from models import db, HarvestDetail
+from palm_registry import PALMS
+
+
+def seed(years):
+    """ทุกต้นทุก 15 วัน; ราว 15% ของบันทึกเป็น 0 ทะลาย และบางต้นหยุดให้ผลช่วงหนึ่ง"""
+    rng = random.Random(42)
+    palm_ids = [p.id for p in PALMS.all()]
+    start = date(2015, 1, 1)
+    rounds = years * 365 // 15
+    rows = []
+    for r in range(rounds):
+        d = start + timedelta(days=15 * r)
+        for pid in palm_ids:
+            resting = (pid * 7 + r) % 40 < 3
+            count = 0 if resting or rng.random() < 0.15 else rng.randint(1, 6)
+            rows.append({"date": d, "palm_id": pid, "bunch_count": count})
+    for i in range(0, len(rows), 20000):
+        db.session.execute(db.insert(HarvestDetail), rows[i:i + 20000])
+    db.session.commit()
+    return len(rows)
+
+
+def python_stats(window=DEFAULT_WINDOW):
+    """แบบเดิม: loop รายต้นรายบันทึกใน Python (ใช้เป็น baseline และตรวจผล)"""
+    rows = db.session.execute(db.text("SELECT palm_id, date, bunch_count FROM harvest_details")).fetchall()
+    rounds = sorted({str(d) for _, d, _ in rows})
+    round_no = {d: i for i, d in enumerate(rounds)}
+    by_palm = defaultdict(list)
+    for palm_id, d, count in rows:
+        by_palm[palm_id].append((str(d), count))
+
+    result = {}
+    for palm in PALMS.all():
+        records = sorted(by_palm.get(palm.id, []))
+        hits = [(d, c) for d, c in records if c > 0]
+        recent = [c for _, c in hits[-window:]]
+        streak = longest = 0
+        prev = round_no[records[0][0]] - 1 if records else -1
+        for d, _ in hits:
+            longest = max(longest, round_no[d] - prev - 1)
+            prev = round_no[d]
+        streak = len(rounds) - 1 - prev if records else len(rounds)
+        longest = max(longest, streak)
+        result[palm.code] = (
+            sum(c for _, c in records),
+            round(sum(recent) / len(recent), 6) if recent else None,
+            streak,
+            longest,
+        )
+    return result
+
+
+def numpy_stats(window=DEFAULT_WINDOW):
+    stats = compute_yield_stats(load_harvests(), window)
+    return {
+        p.code: (
+            int(stats.totals[i]),
+            None if stats.recent_average[i] != stats.recent_average[i] else round(float(stats.recent_average[i]), 6),
+            int(stats.current_zero_streak[i]),
+            int(stats.longest_zero_streak[i]),
+        )
+        for i, p in enumerate(stats.palms)
+    }
+
+
+def measure(fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings), min(timings)
+
+
+def main():
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    tmp = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/bench.db"})
+    with app.app_context():
+        records = seed(years)
+        print(f"📊 harvest_details: {records:,} แถว ({years} ปี, {len(PALMS)} ต้น)")
+
+        assert numpy_stats() == python_stats(), "ผลของสองแบบไม่ตรงกัน"
+
+        t0 = time.perf_counter()
+        data = load_harvests()
+        load_ms = (time.perf_counter() - t0) * 1000
+        compute_ms, _ = measure(lambda: compute_yield_stats(data), iterations)
+        print(f"  query + แปลงเป็น array   {load_ms:8.1f} ms")
+        print(f"  คำนวณ vectorized         {compute_ms:8.1f} ms")
+
+        for name, fn in (("loop Python รายต้น", python_stats), ("NumPy (รวม query)", numpy_stats)):
+            p50, best = measure(fn, iterations)
+            print(f"  {name:<22} p50={p50:8.1f} ms  min={best:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark หน้าแดชบอร์ด: แบบเดิม (8 queries) เทียบกับ dashboard summary (1 query)
+นับจำนวน round trip และวัด p50/p95 ทั้งบน SQLite ในเครื่อง และแบบจำลอง latency ของเครือข่าย (แทน Turso)
+
+Usage: python bench_dashboard.py [latency_ms] [iterations]
+"""
+
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from sqlalchemy import event
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app import create_app
+from dashboard import load_dashboard_summary
+from models import db, HarvestIncome, FertilizerRecord, HarvestDetail, Note, Palm
+from rollups import rebuild_farm_totals
+
+
+def legacy_summary():
+    """query แบบเดิมของ index() ก่อนมี dashboard summary"""
+    s = db.session
+    s.query(db.func.sum(HarvestIncome.net_amount)).scalar()
+    s.query(db.func.sum(FertilizerRecord.total_amount)).scalar()
+    s.query(db.func.sum(HarvestDetail.bunch_count)).scalar()
+    s.query(Palm).count()
+    s.query(HarvestIncome).order_by(HarvestIncome.date.desc()).limit(3).all()
+    s.query(FertilizerRecord).order_by(FertilizerRecord.date.desc()).limit(3).all()
+    s.query(HarvestDetail).join(Palm).order_by(HarvestDetail.date.desc()).limit(3).all()
+    s.query(Note).order_by(Note.date.desc()).limit(3).all()
+
+
+def seed(rounds=100):
+    """ข้อมูลจำลอง: เก็บเกี่ยวทุก 15 วันครบ 312 ต้น"""
+    palm_ids = [p.id for p in Palm.query.all()]
+    start = date(2020, 1, 1)
+    details = []
+    for r in range(rounds):
+        d = start + timedelta(days=15 * r)
+        db.session.add(HarvestIncome(date=d, total_weight_kg=1500, price_per_kg=6.5, gross_amount=9750,
+                                     harvesting_wage=1500, net_amount=8250))
+        db.session.add(FertilizerRecord(date=d, item="ปุ๋ย 15-15-15", sacks=10, unit_price=900,
+                                        spreading_wage=500, total_amount=9500))
+        db.session.add(Note(date=d, title=f"รอบที่ {r + 1}", content="-"))
+        details.extend({"date": d, "palm_id": pid, "bunch_count": (pid + r) % 4} for pid in palm_ids)
+    db.session.execute(db.insert(HarvestDetail), details)
+    db.session.commit()
+    rebuild_farm_totals()
+
+
+def measure(fn, iterations):
+    counter = {"n": 0}
+
+    def _count(*args):
+        counter["n"] += 1
+
+    event.listen(db.engine, "before_cursor_execute", _count)
+    timings = []
+    for _ in range(iterations):
+        db.session.expire_all()
+        db.session.rollback()
+        counter["n"] = 0
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+        round_trips = counter["n"]
+    event.remove(db.engine, "before_cursor_execute", _count)
+
+    q = statistics.quantiles(timings, n=100)
+    return round_trips, q[49], q[94]
+
+
+def main():
+    latency_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    tmp = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/bench.db"})
+    with app.app_context():
+        seed()
+        print(f"📊 harvest_details: {HarvestDetail.query.count():,} แถว")
+
+        def _network_delay(*args):
+            time.sleep(latency_ms / 1000)
+
+        for label, delayed in (("SQLite ในเครื่อง", False), (f"จำลอง latency {latency_ms:g} ms", True)):
+            if delayed:
+                event.listen(db.engine, "before_cursor_execute", _network_delay)
+            print(f"\n🔌 {label}")
+            for name, fn in (("legacy (8 queries)", legacy_summary), ("dashboard summary", load_dashboard_summary)):
+                trips, p50, p95 = measure(fn, iterations)
+                print(f"  {name:<20} round trips={trips}  p50={p50:8.2f} ms  p95={p95:8.2f} ms")
+            if delayed:
+                event.remove(db.engine, "before_cursor_execute", _network_delay)
+
+
+if __name__ == "__main__":
+    main()
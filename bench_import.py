@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark การนำเข้า CSV เก็บเกี่ยว: แบบเดิม (ORM ทีละแถว + ค้นหาต้นปาล์มทุกแถว)
+เทียบกับ import pipeline แบบ set-based รายงานผลเป็นแถว/วินาที
+
+Usage: python bench_import.py [rows] [chunk_size]
+"""
+
+import csv
+import io
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app import create_app
+from imports import HARVEST_IMPORT, run_import
+from models import db, HarvestDetail, Palm
+
+
+def make_csv(rows):
+    """CSV จำลอง: เก็บเกี่ยวครบ 312 ต้นทุก 15 วัน"""
+    codes = [f"{r}{c}" for r in "ABCDEFGHIJKL" for c in range(1, 27)]
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["date", "palm_code", "bunch_count", "remarks"])
+    start = date(2015, 1, 1)
+    for i in range(rows):
+        d = start + timedelta(days=15 * (i // len(codes)))
+        writer.writerow([d.isoformat(), codes[i % len(codes)], i % 5, ""])
+    return out.getvalue()
+
+
+def legacy_import(text):
+    """ลอกแบบลูปเดิมของ harvest_import ก่อนมี import pipeline"""
+    count = 0
+    for row in csv.DictReader(io.StringIO(text)):
+        parsed_date = None
+        for fmt in ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d']:
+            try:
+                parsed_date = datetime.strptime(row["date"].strip(), fmt).date()
+                break
+            except ValueError:
+                continue
+        palm = Palm.query.filter_by(code=row["palm_code"].strip()).first()
+        db.session.add(HarvestDetail(date=parsed_date, palm_id=palm.id,
+                                     bunch_count=int(row["bunch_count"] or 0), remarks=row["remarks"] or None))
+        count += 1
+    db.session.commit()
+    return count
+
+
+def pipeline_import(text, chunk_size):
+    result = run_import(HARVEST_IMPORT, csv.DictReader(io.StringIO(text)), chunk_size=chunk_size)
+    db.session.commit()
+    return result.count
+
+
+def timed(label, fn, *args):
+    db.session.execute(db.delete(HarvestDetail))
+    db.session.commit()
+    t0 = time.perf_counter()
+    count = fn(*args)
+    elapsed = time.perf_counter() - t0
+    print(f"  {label:<28} {count:>8,} แถว  {elapsed:8.2f} s  {count / elapsed:>10,.0f} แถว/วินาที")
+    return elapsed
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    text = make_csv(rows)
+
+    tmp = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/bench.db"})
+    with app.app_context():
+        print(f"\n📥 นำเข้า harvest_details {rows:,} แถว")
+        before = timed("แบบเดิม (ORM ทีละแถว)", legacy_import, text)
+        after = timed(f"pipeline (chunk={chunk_size})", pipeline_import, text, chunk_size)
+        print(f"\n🚀 เร็วขึ้น {before / after:.1f} เท่า")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark cold start: เวลา import แอป, สร้างแอป และ response แรก (/health) ใน process ใหม่ทุกครั้ง
+แบบเดียวกับ cold start ของ serverless (Vercel) เทียบ 3 กรณี
+- first boot: ฐานข้อมูลว่าง ต้องสร้างตารางและต้นปาล์ม
+- warm db: schema version ตรงแล้ว เหลือ SELECT เดียว
+- no auto init: AUTO_INIT_DB=0 (รัน init-db ตอน deploy แล้ว)
+และวัดเวลาที่ chat ครั้งแรกต้อง import google.generativeai
+
+Usage: python bench_startup.py [runs]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+from app import create_app
+t_import = time.perf_counter()
+app = create_app({"SQLALCHEMY_DATABASE_URI": sys.argv[1], "AUTO_INIT_DB": sys.argv[2] == "1"})
+t_app = time.perf_counter()
+resp = app.test_client().get("/health")
+assert resp.status_code == 200
+t_first = time.perf_counter()
+sdk_loaded = "google.generativeai" in sys.modules
+import gemini_client
+gemini_client.GeminiClient("bench-key")
+t_sdk = time.perf_counter()
+print(json.dumps({
+    "import": t_import - t0,
+    "create_app": t_app - t_import,
+    "first_response": t_first - t0,
+    "sdk_at_startup": sdk_loaded,
+    "sdk_first_use": t_sdk - t_first,
+}))
+"""
+
+
+def run_child(db_uri, auto_init=True):
+    env = dict(os.environ, TURSO_DATABASE_URL="", TURSO_AUTH_TOKEN="")
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, db_uri, "1" if auto_init else "0"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def report(name, samples):
+    def ms(key):
+        return statistics.median(s[key] for s in samples) * 1000
+
+    if samples[0]["sdk_at_startup"]:
+        sdk = "gemini sdk loaded at startup"
+    else:
+        sdk = f"gemini sdk on first chat +{ms('sdk_first_use'):.0f} ms"
+    print(
+        f"{name:<14} import {ms('import'):7.1f} ms | create_app {ms('create_app'):7.1f} ms | "
+        f"first response {ms('first_response'):7.1f} ms | {sdk}"
+    )
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        first_boot = []
+        for i in range(runs):
+            first_boot.append(run_child(f"sqlite:///{Path(tmp) / f'fresh{i}.db'}"))
+        warm_uri = f"sqlite:///{Path(tmp) / 'fresh0.db'}"
+        warm = [run_child(warm_uri) for _ in range(runs)]
+        no_init = [run_child(warm_uri, auto_init=False) for _ in range(runs)]
+
+    print(f"median of {runs} fresh processes")
+    report("first boot", first_boot)
+    report("warm db", warm)
+    report("no auto init", no_init)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+pytest fixtures ที่ใช้ร่วมกัน: แอปที่ชี้ไปยังฐานข้อมูล SQLite ชั่วคราว
+"""
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from gemini_client import reset_client
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "UPLOAD_FOLDER": str(tmp_path / "uploads"),
+    })
+    with app.app_context():
+        yield app
+        db.session.remove()
+    # client ของ Gemini เป็นของทั้ง process: ไม่ให้ค้างข้าม test
+    reset_client()
+
+
+@pytest.fixture
+def statements(app):
+    """เก็บ SQL ทุกคำสั่งที่ส่งไปยังฐานข้อมูล (ใช้นับ round trip)"""
+    captured = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        captured.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", _record)
+    yield captured
+    event.remove(db.engine, "before_cursor_execute", _record)
+
+
+@pytest.fixture
+def client(app):
+    """test client ที่ล็อกอินแล้ว"""
+    from models import User
+
+    user = User(username="tester")
+    user.set_password("secret123")
+    db.session.add(user)
+    db.session.commit()
+
+    client = app.test_client()
+    client.post("/login", data={"username": "tester", "password": "secret123"})
+    return client
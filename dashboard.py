@@ -0,0 +1,110 @@
+"""
+Dashboard summary service
+ดึงยอดรวมและกิจกรรมล่าสุดของหน้าแดชบอร์ดด้วย query เดียว (1 round trip ไปยัง Turso)
+"""
+
+from dataclasses import dataclass, field
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import Date, Float, Integer, String
+
+from models import db
+
+RECENT_LIMIT = 3
+
+# ทุกแถวมีคอลัมน์เหมือนกัน (kind, id, date, label, amount) เพื่อรวมด้วย UNION ALL ได้
+# แถว total_* เก็บยอดรวมไว้ที่ amount (อ่านจาก rollup farm_totals จึงไม่ต้อง scan ledger)
+# ส่วนแถวอื่นเป็นกิจกรรมล่าสุดของแต่ละตาราง
+DASHBOARD_SQL = f"""
+SELECT 'total_income' AS kind, NULL AS id, NULL AS date, NULL AS label,
+       (SELECT COALESCE(SUM(net_amount), 0) FROM farm_totals WHERE period = 'all') AS amount
+UNION ALL
+SELECT 'total_fertilizer', NULL, NULL, NULL,
+       (SELECT COALESCE(SUM(fertilizer_cost), 0) FROM farm_totals WHERE period = 'all')
+UNION ALL
+SELECT 'total_bunches', NULL, NULL, NULL,
+       (SELECT COALESCE(SUM(bunch_count), 0) FROM farm_totals WHERE period = 'all')
+UNION ALL
+SELECT 'total_palms', NULL, NULL, NULL, (SELECT COUNT(*) FROM palms)
+UNION ALL
+SELECT * FROM (
+    SELECT 'income', id, date, note, net_amount FROM harvest_income
+    ORDER BY date DESC, id DESC LIMIT {RECENT_LIMIT}
+)
+UNION ALL
+SELECT * FROM (
+    SELECT 'fertilizer', id, date, item, total_amount FROM fertilizer_records
+    ORDER BY date DESC, id DESC LIMIT {RECENT_LIMIT}
+)
+UNION ALL
+SELECT * FROM (
+    SELECT 'harvest', hd.id, hd.date, p.code, hd.bunch_count
+    FROM (
+        SELECT id, date, palm_id, bunch_count FROM harvest_details
+        ORDER BY date DESC, id DESC LIMIT {RECENT_LIMIT}
+    ) hd JOIN palms p ON hd.palm_id = p.id
+    ORDER BY hd.date DESC, hd.id DESC
+)
+UNION ALL
+SELECT * FROM (
+    SELECT 'note', id, date, title, NULL FROM notes
+    ORDER BY date DESC, id DESC LIMIT {RECENT_LIMIT}
+)
+"""
+
+
+@dataclass
+class RecentActivity:
+    """กิจกรรมล่าสุด 1 รายการ (label/amount มีความหมายตามประเภท)"""
+    kind: str
+    id: int
+    date: date
+    label: Optional[str]
+    amount: Optional[float]
+
+
+@dataclass
+class DashboardSummary:
+    total_income: float = 0.0
+    total_fertilizer_cost: float = 0.0
+    total_harvest_count: int = 0
+    total_palms: int = 0
+    recent_income: List[RecentActivity] = field(default_factory=list)
+    recent_fertilizer: List[RecentActivity] = field(default_factory=list)
+    recent_harvest: List[RecentActivity] = field(default_factory=list)
+    recent_notes: List[RecentActivity] = field(default_factory=list)
+
+
+_TOTAL_FIELDS = {
+    "total_income": ("total_income", float),
+    "total_fertilizer": ("total_fertilizer_cost", float),
+    "total_bunches": ("total_harvest_count", int),
+    "total_palms": ("total_palms", int),
+}
+
+_RECENT_FIELDS = {
+    "income": "recent_income",
+    "fertilizer": "recent_fertilizer",
+    "harvest": "recent_harvest",
+    "note": "recent_notes",
+}
+
+
+def load_dashboard_summary(session=None) -> DashboardSummary:
+    """โหลดข้อมูลแดชบอร์ดทั้งหมดด้วย statement เดียว"""
+    session = session or db.session
+    stmt = db.text(DASHBOARD_SQL).columns(
+        kind=String, id=Integer, date=Date, label=String, amount=Float
+    )
+
+    summary = DashboardSummary()
+    for row in session.execute(stmt):
+        if row.kind in _TOTAL_FIELDS:
+            attr, cast = _TOTAL_FIELDS[row.kind]
+            setattr(summary, attr, cast(row.amount or 0))
+        else:
+            getattr(summary, _RECENT_FIELDS[row.kind]).append(
+                RecentActivity(row.kind, row.id, row.date, row.label, row.amount)
+            )
+    return summary
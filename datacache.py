@@ -0,0 +1,91 @@
+"""
+Data-versioned cache
+version ของแต่ละตาราง (เพิ่มทุกครั้งที่ commit การเขียน) และ cache แบบ LRU + TTL
+ที่แต่ละรายการจำ version ของตารางที่มันขึ้นกับไว้ตอนเก็บ: ข้อมูลเปลี่ยนเมื่อไรรายการนั้นหมดอายุทันที
+ใช้ร่วมกันทั้งคำตอบของแชต (ai.AnswerCache), heatmap และผลทำนายการตัด
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DATA_TABLES = ("harvest_income", "fertilizer_records", "harvest_details", "notes", "palms", "farm_totals", "palm_stats")
+# ตารางที่คำนวณจาก ledger ต้องถือว่าเปลี่ยนไปด้วย
+DERIVED_TABLES = {
+    "harvest_income": ("farm_totals",),
+    "fertilizer_records": ("farm_totals",),
+    "harvest_details": ("farm_totals", "palm_stats"),
+}
+
+_data_versions = {table: 0 for table in DATA_TABLES}
+_versions_lock = threading.Lock()
+
+
+def bump_data_version(*tables):
+    """เรียกหลัง commit การเขียนทุกครั้ง เพื่อให้รายการใน cache ที่อ่านตารางเหล่านี้หมดอายุ"""
+    with _versions_lock:
+        for table in tables:
+            for name in (table,) + DERIVED_TABLES.get(table, ()):
+                _data_versions[name] = _data_versions.get(name, 0) + 1
+
+
+def data_versions(tables):
+    with _versions_lock:
+        return tuple((t, _data_versions.get(t, 0)) for t in tables)
+
+
+class DataCache:
+    """LRU + TTL; put() ระบุตารางที่ค่านั้นขึ้นกับ แล้ว get() ไม่คืนค่าที่ตารางเหล่านั้นเปลี่ยนไปแล้ว"""
+
+    def __init__(self, maxsize=256, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def get(self, key, allow_stale=False):
+        """
+        allow_stale=True คืนรายการที่หมด TTL แล้วด้วย (ใช้ตอน Gemini ถูกจำกัดการเรียก)
+        แต่ไม่คืนรายการที่ข้อมูลในตารางเปลี่ยนไปแล้ว
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, versions, value = entry
+                if versions != data_versions(t for t, _ in versions):
+                    del self._entries[key]
+                elif allow_stale or now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                # รายการที่หมด TTL เก็บไว้ก่อน เผื่อใช้ตอบแทนเมื่อ Gemini ไม่ว่าง (LRU จะไล่ออกเอง)
+            self.misses += 1
+            return None
+
+    def put(self, key, value, tables):
+        versions = data_versions(sorted(tables))
+        with self._lock:
+            self._entries[key] = (time.monotonic(), versions, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
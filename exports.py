@@ -0,0 +1,70 @@
+"""
+Streaming CSV export
+ส่งไฟล์ CSV ทีละส่วนจาก cursor ของฐานข้อมูล (yield_per) แทนการสร้างทั้งไฟล์ในหน่วยความจำ
+ไบต์แรกถูกส่งทันที และหน่วยความจำคงที่ไม่ว่าจะมีกี่แถว
+"""
+
+import codecs
+import csv
+import io
+import unicodedata
+from urllib.parse import quote
+
+from flask import Response, stream_with_context
+
+from models import db
+
+# จำนวนแถวที่ดึงจาก cursor ต่อครั้ง และขนาด buffer (ตัวอักษร) ก่อนส่งออกไปหนึ่งก้อน
+YIELD_PER = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_csv(header, rows, to_row, chunk_size=CHUNK_SIZE):
+    """แปลงแถวเป็นก้อน bytes แบบ UTF-8 (มี BOM หนึ่งครั้งที่ต้นไฟล์ให้ Excel อ่านภาษาไทยได้)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    yield codecs.BOM_UTF8
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(to_row(row))
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def content_disposition(filename) -> str:
+    """
+    header Content-Disposition ของไฟล์แนบ: filename อยู่ในเครื่องหมายคำพูดเสมอ
+    ชื่อที่มีอักษรนอก ASCII (เช่นภาษาไทย) ใส่ filename* แบบ UTF-8 และ filename ที่ตัดเหลือ ASCII ไว้สำรอง
+    """
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii").strip()
+        encoded = f"; filename*=UTF-8''{quote(filename, safe='')}"
+    else:
+        simple, encoded = filename, ""
+    simple = (simple or "export.csv").replace("\\", "\\\\").replace('"', '\\"')
+    return f'attachment; filename="{simple}"{encoded}'
+
+
+def stream_csv(filename, header, stmt, to_row, session=None) -> Response:
+    """สร้าง Response แบบ streaming จาก select statement"""
+    session = session or db.session
+
+    def generate():
+        result = session.execute(stmt.execution_options(yield_per=YIELD_PER))
+        try:
+            yield from iter_csv(header, result, to_row)
+        finally:
+            result.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": content_disposition(filename)},
+    )
@@ -41,6 +41,12 @@ class HarvestDetailForm(FlaskForm):
     remarks = TextAreaField("หมายเหตุ", validators=[Optional(), Length(max=1000)])
     submit = SubmitField("บันทึก")
 
+class HarvestBatchForm(FlaskForm):
+    """บันทึกทั้งรอบ: จำนวนทะลายรายต้นส่งมาเป็นช่อง bunch_<รหัสต้น> (ไม่ได้ประกาศเป็น field)"""
+    date = DateField("วัน/เดือน/ปี", validators=[DataRequired()], default=date.today)
+    remarks = TextAreaField("หมายเหตุ (ใช้กับทุกต้นในรอบนี้)", validators=[Optional(), Length(max=1000)])
+    submit = SubmitField("บันทึกทั้งรอบ")
+
 class NoteForm(FlaskForm):
     date = DateField("วัน/เดือน/ปี", validators=[DataRequired()], default=date.today)
     title = StringField("หัวข้อ", validators=[DataRequired(), Length(max=255)])
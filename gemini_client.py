@@ -0,0 +1,272 @@
+"""
+Gemini client ที่ใช้ร่วมกันทั้ง process
+- configure() และสร้าง GenerativeModel ครั้งเดียว (connection ของ client ถูกใช้ซ้ำ)
+- token bucket จำกัดอัตราให้ตรงกับ free tier (15 requests/นาที)
+- retry แบบ exponential backoff เมื่อ error ชั่วคราว (จำนวนครั้งจำกัด)
+- circuit breaker: เมื่อ API ติดโควต้าหรือล้มต่อเนื่อง จะปฏิเสธทันทีช่วงหนึ่ง แทนที่จะรอ timeout ทุก request
+google.generativeai ใช้เวลา import ราวครึ่งวินาที จึง import เมื่อสร้าง client ครั้งแรกเท่านั้น (ไม่ใช่ตอนเริ่มแอป)
+"""
+
+import random
+import threading
+import time
+from functools import lru_cache
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+DEFAULT_RATE_PER_MINUTE = 15
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 4.0
+DEFAULT_TIMEOUT = 30.0
+# รอคิวของ token bucket ได้ไม่เกินนี้ (วินาที) ถ้านานกว่านั้นถือว่าติดโควต้า
+DEFAULT_MAX_WAIT = 2.0
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_COOLDOWN = 60.0
+
+
+class GeminiError(RuntimeError):
+    """เรียก Gemini ไม่สำเร็จ"""
+
+
+class GeminiAuthError(GeminiError):
+    """API key ไม่ถูกต้องหรือหมดอายุ (retry ไม่ช่วย)"""
+
+
+class GeminiThrottled(GeminiError):
+    """ติดโควต้า, เกินอัตราที่กำหนด หรือ circuit breaker เปิดอยู่"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@lru_cache(maxsize=None)
+def _error_types():
+    """(auth, quota, transient) ของ google.api_core"""
+    from google.api_core import exceptions as google_exceptions
+
+    return (
+        (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied),
+        (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests),
+        (
+            google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded, google_exceptions.BadGateway, google_exceptions.GatewayTimeout,
+            ConnectionError, TimeoutError,
+        ),
+    )
+
+
+def classify(error):
+    """แยกชนิด error: 'auth', 'quota', 'transient' หรือ None (ไม่ต้อง retry)"""
+    auth_errors, quota_errors, transient_errors = _error_types()
+    if isinstance(error, auth_errors):
+        return "auth"
+    if isinstance(error, quota_errors):
+        return "quota"
+    if isinstance(error, transient_errors):
+        return "transient"
+    message = str(error)
+    # InvalidArgument ของ key ที่ผิดรูปแบบไม่มีชนิดเฉพาะ
+    if "API_KEY_INVALID" in message or "API key not valid" in message:
+        return "auth"
+    return None
+
+
+class TokenBucket:
+    """ได้ rate token ต่อนาที สะสมได้สูงสุด capacity"""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.clock = clock
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """จองหนึ่ง token คืนเวลาที่ต้องรอ (0 ถ้าใช้ได้ทันที)"""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def cancel(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class CircuitBreaker:
+    """
+    closed -> open หลังล้มต่อเนื่อง threshold ครั้ง (หรือทันทีเมื่อติดโควต้า) -> half-open เมื่อครบ cooldown
+    ช่วง half-open ให้ผ่านได้ทีละหนึ่งคำขอ (probe): สำเร็จแล้วปิด ล้มแล้วเปิดใหม่อีก cooldown
+    """
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, cooldown=DEFAULT_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_until = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_until == 0.0:
+            return "closed"
+        return "open" if self.clock() < self.opened_until else "half-open"
+
+    def check(self) -> bool:
+        """raise GeminiThrottled ถ้ายังเปิดอยู่ คืน True ถ้าผู้เรียกเป็น probe ของช่วง half-open"""
+        with self._lock:
+            if self.opened_until == 0.0:
+                return False
+            now = self.clock()
+            remaining = self.opened_until - now
+            if remaining <= 0:
+                # probe ที่ค้างนานเกิน cooldown (เช่น stream ที่ไม่ถูกอ่านต่อ) ไม่กันคำขออื่นตลอดไป
+                if self._probe_started is None or now - self._probe_started >= self.cooldown:
+                    self._probe_started = now
+                    return True
+                remaining = self._probe_started + self.cooldown - now
+        raise GeminiThrottled("Gemini ถูกพักการเรียกชั่วคราว", retry_after=remaining)
+
+    def release(self):
+        """probe จบโดยไม่ได้บอกผลว่า API ใช้ได้หรือไม่ (เช่น error อื่น) ให้คำขอถัดไปเป็น probe แทน"""
+        with self._lock:
+            self._probe_started = None
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_until = 0.0
+            self._probe_started = None
+
+    def failure(self, open_now=False, cooldown=None):
+        with self._lock:
+            self.failures += 1
+            half_open = self.opened_until != 0.0
+            if open_now or half_open or self.failures >= self.threshold:
+                self.opened_until = self.clock() + (cooldown or self.cooldown)
+            self._probe_started = None
+
+
+class GeminiClient:
+    def __init__(self, api_key, model_name=DEFAULT_MODEL, rate_per_minute=DEFAULT_RATE_PER_MINUTE,
+                 max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 max_wait=DEFAULT_MAX_WAIT, timeout=DEFAULT_TIMEOUT, breaker=None, api_endpoint=None, transport=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        import google.generativeai as genai
+
+        client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+        genai.configure(api_key=api_key, transport=transport, client_options=client_options)
+        self.model = genai.GenerativeModel(model_name)
+        self.bucket = TokenBucket(rate_per_minute, clock=clock)
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        # ปิด retry ในตัวของไลบรารี (backoff นานถึง 60 วินาที) ให้ retry ที่นี่ที่เดียว
+        self.request_options = {"retry": None, "timeout": timeout}
+        self.sleep = sleep
+
+    def _acquire(self):
+        wait = self.bucket.reserve()
+        if wait > self.max_wait:
+            self.bucket.cancel()
+            raise GeminiThrottled("เกินอัตราการเรียก Gemini ที่กำหนด", retry_after=wait)
+        if wait:
+            self.sleep(wait)
+
+    def generate(self, prompt, stream=False):
+        """
+        เรียก generate_content พร้อม rate limit, retry และ circuit breaker
+        stream=True คืน iterator ของข้อความทีละส่วน (retry เฉพาะก่อนได้ส่วนแรก)
+        """
+        probe = self.breaker.check()
+        try:
+            return self._generate(prompt, stream)
+        finally:
+            if probe:
+                self.breaker.release()
+
+    def _generate(self, prompt, stream):
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                response = self.model.generate_content(prompt, stream=stream, request_options=self.request_options)
+                if stream:
+                    chunks = iter(response)
+                    first = next(chunks, None)
+                    self.breaker.success()
+                    return self._iter_text(first, chunks)
+                text = response.text
+                self.breaker.success()
+                return text
+            except Exception as e:
+                kind = classify(e)
+                if kind == "auth":
+                    raise GeminiAuthError(str(e)) from e
+                if kind == "quota":
+                    # ติดโควต้า: เปิด breaker ทันที ไม่ต้องลองซ้ำให้เสียโควต้าเพิ่ม
+                    self.breaker.failure(open_now=True)
+                    raise GeminiThrottled(str(e), retry_after=self.breaker.cooldown) from e
+                if kind != "transient":
+                    raise GeminiError(str(e)) from e
+                self.breaker.failure()
+                if attempt >= self.max_retries or self.breaker.state == "open":
+                    raise GeminiError(str(e)) from e
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                self.sleep(delay * random.uniform(0.5, 1.0))
+                attempt += 1
+
+    def _iter_text(self, first, chunks):
+        try:
+            if first is not None:
+                yield first.text or ""
+            for chunk in chunks:
+                yield chunk.text or ""
+        except Exception as e:
+            # ขาดกลาง stream หลังส่วนแรก: นับเป็นความล้มเหลวของ API เหมือนตอนเรียก
+            kind = classify(e)
+            if kind in ("quota", "transient"):
+                self.breaker.failure(open_now=kind == "quota")
+            raise
+
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+
+def get_client(config) -> GeminiClient:
+    """client เดียวของ process สร้างใหม่เฉพาะเมื่อ key/model/endpoint เปลี่ยน"""
+    global _client, _client_key
+    key = (
+        config.get("GOOGLE_API_KEY"),
+        config.get("GEMINI_MODEL", DEFAULT_MODEL),
+        config.get("GEMINI_API_ENDPOINT"),
+        config.get("GEMINI_TRANSPORT"),
+        config.get("GEMINI_RATE_PER_MINUTE", DEFAULT_RATE_PER_MINUTE),
+    )
+    with _client_lock:
+        if _client is None or _client_key != key:
+            api_key, model_name, endpoint, transport, rate = key
+            _client = GeminiClient(
+                api_key, model_name=model_name, rate_per_minute=rate,
+                max_retries=config.get("GEMINI_MAX_RETRIES", DEFAULT_MAX_RETRIES),
+                api_endpoint=endpoint, transport=transport,
+            )
+            _client_key = key
+        return _client
+
+
+def reset_client():
+    global _client, _client_key
+    with _client_lock:
+        _client = None
+        _client_key = None
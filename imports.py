@@ -0,0 +1,333 @@
+"""
+CSV import pipeline
+นำเข้า CSV แบบ set-based: จับคู่ header ครั้งเดียวต่อไฟล์, โหลดรหัสต้นปาล์มครั้งเดียว,
+ตรวจสอบแถวเป็นชุด แล้วเขียนด้วย multi-row INSERT ทีละ chunk ใน transaction เดียว
+"""
+
+import codecs
+import csv
+import io
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import db, HarvestIncome, FertilizerRecord, HarvestDetail, Note
+from palm_registry import PALMS, normalize_code
+from anomaly import AnomalyDetector
+from rollups import PalmStatsBatch, TotalsBatch
+
+DEFAULT_CHUNK_SIZE = 1000
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d']
+# ไฟล์ไทยจาก Excel รุ่นเก่ามักเป็น TIS-620/CP874 (BOM ของ UTF-8 ถูกตรวจแยกก่อน)
+ENCODINGS = ['utf-8', 'tis-620', 'cp874']
+SNIFF_BYTES = 64 * 1024
+
+
+class RowError(ValueError):
+    """ข้อมูลในแถวไม่ถูกต้อง (ข้อความแสดงให้ผู้ใช้เห็น)"""
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value: str):
+    """แปลงวันที่หลายรูปแบบ ไฟล์เก็บเกี่ยวมีวันที่ซ้ำกันมากจึง cache ผลไว้"""
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise RowError(f"รูปแบบวันที่ไม่ถูกต้อง ({value})")
+
+
+class HeaderMap:
+    """จับคู่ชื่อ field กับคอลัมน์ที่มีอยู่จริงในไฟล์ ทำครั้งเดียวต่อไฟล์"""
+
+    def __init__(self, fieldnames, aliases: Dict[str, Tuple[str, ...]]):
+        present = set(fieldnames or [])
+        self.columns = {name: [h for h in names if h in present] for name, names in aliases.items()}
+
+    def get(self, row, name, default=None):
+        for header in self.columns[name]:
+            value = row.get(header)
+            if value:
+                return value
+        return default
+
+
+@dataclass
+class ImportSpec:
+    model: type
+    aliases: Dict[str, Tuple[str, ...]]
+    build: Callable  # (get, context) -> dict ของคอลัมน์ หรือ None ถ้าข้ามแถว
+    amounts: Optional[Callable] = None  # dict ของคอลัมน์ -> delta สำหรับ farm_totals
+    needs_palms: bool = False
+    palm_stats: bool = False  # ปรับ palm_stats ด้วย (บันทึกการตัดรายต้น)
+    anomalies: Optional[str] = None  # ชุดการตรวจค่าผิดปกติใน anomaly.CHECKS
+
+
+@dataclass
+class ImportResult:
+    count: int = 0
+    processed: int = 0
+    rejected: int = 0
+    errors: List[str] = field(default_factory=list)
+    flagged: int = 0  # ค่าผิดปกติที่รอตรวจ
+
+
+def _build_income(get, ctx):
+    date_val = get("date")
+    weight_val = get("total_weight_kg")
+    if not date_val or not weight_val:
+        return None
+    note = get("note", "")
+    return {
+        "date": parse_date(date_val),
+        "total_weight_kg": float(weight_val),
+        "price_per_kg": float(get("price_per_kg", 0)),
+        "gross_amount": float(get("gross_amount", 0)),
+        "harvesting_wage": float(get("harvesting_wage", 0)),
+        "net_amount": float(get("net_amount", 0)),
+        "note": note.strip() or None,
+    }
+
+
+def _build_fertilizer(get, ctx):
+    date_val = get("date")
+    item_val = get("item")
+    if not date_val or not item_val:
+        return None
+    parsed_date = parse_date(date_val)
+
+    sacks = float(get("sacks", 0))
+    unit_price = float(get("unit_price", 0))
+    spreading_wage = float(get("spreading_wage", 0))
+    cost_val = float(get("cost", 0))
+
+    # ไฟล์ที่ export จากระบบมีแค่ Cost: คำนวณ unit_price จาก cost/sacks
+    if unit_price == 0 and cost_val > 0:
+        spreading_wage = 0
+        if sacks > 0:
+            unit_price = cost_val / sacks
+        else:
+            sacks = 1
+            unit_price = cost_val
+
+    note = get("note", "")
+    return {
+        "date": parsed_date,
+        "item": str(item_val).strip(),
+        "sacks": sacks,
+        "unit_price": unit_price,
+        "spreading_wage": spreading_wage,
+        "total_amount": sacks * unit_price + spreading_wage,
+        "note": note.strip() or None,
+    }
+
+
+def _build_harvest(get, ctx):
+    date_val = get("date")
+    palm_code_val = get("palm_code")
+    if not date_val or not palm_code_val:
+        return None
+    parsed_date = parse_date(date_val)
+
+    palm_id = ctx["palms"].get(normalize_code(str(palm_code_val)))
+    if palm_id is None:
+        raise RowError(f"ไม่พบต้นปาล์มรหัส {palm_code_val}")
+
+    remarks = get("remarks", "")
+    return {
+        "date": parsed_date,
+        "palm_id": palm_id,
+        "bunch_count": int(get("bunch_count", 0)),
+        "remarks": remarks.strip() or None,
+    }
+
+
+def _build_note(get, ctx):
+    date_val = get("date")
+    title_val = get("title")
+    if not date_val or not title_val:
+        return None
+    content_val = get("content", "")
+    return {
+        "date": parse_date(date_val),
+        "title": str(title_val).strip(),
+        "content": str(content_val).strip(),
+    }
+
+
+INCOME_IMPORT = ImportSpec(
+    model=HarvestIncome,
+    aliases={
+        "date": ("date", "Date", "วันที่"),
+        "total_weight_kg": ("total_weight_kg", "Total Weight (kg)", "น้ำหนักรวม"),
+        "price_per_kg": ("price_per_kg", "Price per kg", "ราคาต่อกก"),
+        "gross_amount": ("gross_amount", "Gross Amount", "รวมเป็นเงิน"),
+        "harvesting_wage": ("harvesting_wage", "Harvesting Wage", "ค่าจ้าง"),
+        "net_amount": ("net_amount", "Net Amount", "ยอดคงเหลือ"),
+        "note": ("note", "Note", "หมายเหตุ"),
+    },
+    build=_build_income,
+    amounts=lambda v: {
+        "total_weight_kg": v["total_weight_kg"],
+        "gross_amount": v["gross_amount"],
+        "harvesting_wage": v["harvesting_wage"],
+        "net_amount": v["net_amount"],
+    },
+    anomalies="income",
+)
+
+FERTILIZER_IMPORT = ImportSpec(
+    model=FertilizerRecord,
+    aliases={
+        "date": ("date", "Date", "วันที่", "DATE"),
+        "item": ("item", "Item", "รายการ", "Type", "TYPE", "type"),
+        "sacks": ("sacks", "Sacks", "ถุง", "Amount", "amount"),
+        "unit_price": ("unit_price", "Unit Price", "ราคาต่อหน่วย"),
+        "spreading_wage": ("spreading_wage", "Spreading Wage", "ค่าแรง"),
+        "cost": ("Cost", "cost", "ค่าใช้จ่าย"),
+        "note": ("note", "Note", "หมายเหตุ", "Notes", "notes"),
+    },
+    build=_build_fertilizer,
+    amounts=lambda v: {"fertilizer_cost": v["total_amount"]},
+)
+
+HARVEST_IMPORT = ImportSpec(
+    model=HarvestDetail,
+    aliases={
+        "date": ("date", "Date", "วันที่"),
+        "palm_code": ("palm_code", "Palm Code", "รหัสต้นปาล์ม"),
+        "bunch_count": ("bunch_count", "Bunch Count", "จำนวนทะลาย"),
+        "remarks": ("remarks", "Remarks", "หมายเหตุ"),
+    },
+    build=_build_harvest,
+    amounts=lambda v: {"bunch_count": v["bunch_count"]},
+    needs_palms=True,
+    palm_stats=True,
+    anomalies="harvest",
+)
+
+NOTES_IMPORT = ImportSpec(
+    model=Note,
+    aliases={
+        "date": ("date", "Date", "วันที่"),
+        "title": ("title", "Title", "หัวข้อ"),
+        "content": ("content", "Content", "รายละเอียด"),
+    },
+    build=_build_note,
+)
+
+IMPORT_SPECS = {
+    "income": INCOME_IMPORT,
+    "fertilizer": FERTILIZER_IMPORT,
+    "harvest": HARVEST_IMPORT,
+    "notes": NOTES_IMPORT,
+}
+
+
+def load_palm_map(session=None) -> Dict[str, int]:
+    """รหัสต้นปาล์ม -> id ทั้ง 312 ต้น (จาก palm registry ไม่ query ซ้ำทุกไฟล์)"""
+    return PALMS.ids(session)
+
+
+def sniff_encoding(stream, prefix_size=SNIFF_BYTES):
+    """เดา encoding จากส่วนต้นของไฟล์ครั้งเดียว แล้วคืนตำแหน่ง stream กลับไปที่เดิม"""
+    start = stream.tell()
+    prefix = stream.read(prefix_size)
+    stream.seek(start)
+
+    if prefix.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    for encoding in ENCODINGS:
+        # final=False: ตัวอักษรหลาย byte ที่ถูกตัดตรงท้าย prefix ไม่นับเป็น error
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            decoder.decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+@contextmanager
+def open_csv(stream):
+    """
+    เปิด binary stream เป็น csv.DictReader ที่ decode ทีละบรรทัด (ใช้ buffer ขนาดคงที่)
+    ให้ None ถ้าเดา encoding ไม่ได้
+    """
+    encoding = sniff_encoding(stream)
+    if encoding is None:
+        yield None
+        return
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        yield csv.DictReader(text)
+    finally:
+        # ไม่ให้ TextIOWrapper ปิด stream ของไฟล์อัปโหลดไปด้วย
+        text.detach()
+
+
+def run_import(spec: ImportSpec, reader, chunk_size=DEFAULT_CHUNK_SIZE, session=None,
+               progress=None, max_errors=None) -> ImportResult:
+    """
+    ตรวจสอบและเขียนทุกแถวใน reader ลงตารางของ spec
+    ไม่ commit เอง: ผู้เรียกเป็นคน commit (หรือ rollback) ทั้งไฟล์ใน transaction เดียว
+    progress(result) ถูกเรียกหลังเขียนแต่ละ chunk พร้อม rollup ของ chunk นั้นแล้ว
+    (ผู้เรียก commit ทีละ chunk ใน progress ได้โดยยอดรวมไม่คลาดกับแถวที่บันทึก), max_errors จำกัดจำนวนข้อความที่เก็บ
+    """
+    session = session or db.session
+    table = spec.model.__table__
+    insert_stmt = db.insert(table)
+    header = HeaderMap(reader.fieldnames, spec.aliases)
+    ctx = {"palms": load_palm_map(session) if spec.needs_palms else {}}
+    totals = TotalsBatch()
+    palm_stats = PalmStatsBatch()
+    # สถิติทุกกลุ่มโหลดครั้งเดียว แล้วตรวจ/ปรับในหน่วยความจำทีละแถว
+    detector = AnomalyDetector(spec.anomalies, "import", session).preload() if spec.anomalies else None
+    result = ImportResult()
+    pending = []
+
+    def flush():
+        if pending:
+            session.execute(insert_stmt, pending)
+            pending.clear()
+        totals.apply(session)
+        palm_stats.apply(session)
+        if detector:
+            detector.apply()
+            result.flagged = len(detector.flagged)
+        if progress:
+            progress(result)
+
+    def handle(i, row):
+        try:
+            values = spec.build(lambda name, default=None: header.get(row, name, default), ctx)
+        except Exception as e:
+            result.rejected += 1
+            if max_errors is None or len(result.errors) < max_errors:
+                result.errors.append(f"แถว {i}: {e}")
+            return
+        if values is None:
+            return
+
+        pending.append(values)
+        if spec.amounts:
+            totals.add(values["date"], spec.amounts(values))
+        if spec.palm_stats:
+            palm_stats.add(values["palm_id"], values["date"], values["bunch_count"])
+        if detector:
+            detector.check(values)
+        result.count += 1
+
+    for i, row in enumerate(reader, 1):
+        result.processed = i
+        handle(i, row)
+        # นับตามแถวที่อ่าน (รวมแถวที่ถูกปฏิเสธ): ไฟล์ที่ผิดเกือบทั้งไฟล์ก็ยังรายงานความคืบหน้าสม่ำเสมอ
+        if i % chunk_size == 0:
+            flush()
+
+    flush()
+    return result
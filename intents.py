@@ -0,0 +1,344 @@
+"""
+Local intent router
+แยกคำถามภาษาไทยที่พบบ่อย (ทะลายรวม, รายได้, ค่าปุ๋ย, กำไร, วันตัดครั้งต่อไปรายต้น/ทั้งสวน) แล้วตอบด้วย SQL แบบมี parameter
+และข้อความสำเร็จรูปโดยไม่ต้องเรียก Gemini คำถามที่ไม่รู้จักคืน None ให้ผู้เรียกส่งต่อไปยังโมเดล
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import db
+from palm_registry import PALMS
+from rollups import ALL_PERIOD
+
+THAI_MONTHS = [
+    "มกราคม", "กุมภาพันธ์", "มีนาคม", "เมษายน", "พฤษภาคม", "มิถุนายน",
+    "กรกฎาคม", "สิงหาคม", "กันยายน", "ตุลาคม", "พฤศจิกายน", "ธันวาคม",
+]
+THAI_MONTH_ABBR = [
+    "ม.ค.", "ก.พ.", "มี.ค.", "เม.ย.", "พ.ค.", "มิ.ย.",
+    "ก.ค.", "ส.ค.", "ก.ย.", "ต.ค.", "พ.ย.", "ธ.ค.",
+]
+# ชื่อยาวก่อนชื่อย่อ และคำที่ยาวกว่าก่อน (เช่น "มิถุนายน" ก่อน "มิ.ย.")
+_MONTH_PATTERNS = sorted(
+    [(name, i + 1) for i, name in enumerate(THAI_MONTHS)]
+    + [(abbr, i + 1) for i, abbr in enumerate(THAI_MONTH_ABBR)],
+    key=lambda item: -len(item[0]),
+)
+
+BUDDHIST_OFFSET = 543
+HARVEST_INTERVAL_DAYS = 15
+
+# คำที่บอกว่าเป็นการวิเคราะห์ซับซ้อน ให้โมเดลตอบแทน
+_ANALYTIC_WORDS = (
+    "เทียบ", "เฉลี่ย", "แนวโน้ม", "มากที่สุด", "น้อยที่สุด", "ดีที่สุด", "ต้นไหน", "ต่อต้น",
+    "เปอร์เซ็นต์", "%", "ทำไม", "แนะนำ", "วิเคราะห์", "ราคา", "แต่ละ", "รายเดือน", "รายวัน",
+)
+
+_NUMERIC_DATE = re.compile(r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})")
+_ISO_DATE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+_YEAR = re.compile(r"(?<!\d)(\d{4})(?!\d)")
+_PALM_CODE = re.compile(r"(?<![A-Za-z0-9])([A-La-l])\s?(\d{1,2})(?!\d)")
+
+
+def to_gregorian(year: int) -> int:
+    """ปี พ.ศ. -> ค.ศ. (ปีที่น้อยกว่า 2400 ถือว่าเป็น ค.ศ. อยู่แล้ว)"""
+    return year - BUDDHIST_OFFSET if year > 2400 else year
+
+
+def thai_date(d: date) -> str:
+    return f"{d.day} {THAI_MONTHS[d.month - 1]} {d.year + BUDDHIST_OFFSET}"
+
+
+@dataclass
+class Period:
+    """ช่วงเวลาที่ถาม ค่าที่เป็น None คือไม่ได้ระบุ (เช่นระบุแค่เดือน = เดือนนั้นทุกปี)"""
+    year: Optional[int] = None
+    month: Optional[int] = None
+    day: Optional[int] = None
+
+    @property
+    def empty(self):
+        return self.year is None and self.month is None and self.day is None
+
+    def where(self, column="date") -> Tuple[str, Dict[str, object]]:
+        """เงื่อนไข SQL; ถ้าระบุปีใช้ช่วงวันที่ (ใช้ index ได้) นอกนั้นใช้ strftime"""
+        if self.year is not None and not (self.month is None and self.day is not None):
+            if self.month is None:
+                start, end = date(self.year, 1, 1), date(self.year + 1, 1, 1)
+            elif self.day is None:
+                start = date(self.year, self.month, 1)
+                end = date(self.year + (self.month == 12), self.month % 12 + 1, 1)
+            else:
+                start = date(self.year, self.month, self.day)
+                end = start + timedelta(days=1)
+            return f"{column} >= :start AND {column} < :end", {"start": start.isoformat(), "end": end.isoformat()}
+
+        clauses, params = [], {}
+        if self.year is not None:
+            clauses.append(f"strftime('%Y', {column}) = :year")
+            params["year"] = str(self.year)
+        if self.month is not None:
+            clauses.append(f"strftime('%m', {column}) = :month")
+            params["month"] = f"{self.month:02d}"
+        if self.day is not None:
+            clauses.append(f"strftime('%d', {column}) = :day")
+            params["day"] = f"{self.day:02d}"
+        return (" AND ".join(clauses) or "1 = 1"), params
+
+    def describe(self) -> str:
+        if self.empty:
+            return "ทั้งหมด"
+        parts = []
+        if self.day is not None:
+            parts.append(f"วันที่ {self.day}")
+        if self.month is not None:
+            parts.append(f"เดือน{THAI_MONTHS[self.month - 1]}")
+        if self.year is not None:
+            parts.append(f"ปี {self.year + BUDDHIST_OFFSET}")
+        elif self.month is not None or self.day is not None:
+            parts.append("(ทุกปี)")
+        return " ".join(parts)
+
+
+def parse_period(text: str, today: Optional[date] = None) -> Optional[Period]:
+    """
+    แยกวัน/เดือน/ปีจากข้อความ: ชื่อเดือนไทย, ปี พ.ศ./ค.ศ., 15/9/2568, 2025-09-15,
+    และคำสัมพัทธ์ (วันนี้, เดือนนี้, เดือนที่แล้ว, ปีนี้, ปีที่แล้ว)
+    คืน None ถ้าพบวันที่ที่ไม่มีจริง
+    """
+    today = today or date.today()
+    try:
+        m = _ISO_DATE.search(text)
+        if m:
+            d = date(to_gregorian(int(m.group(1))), int(m.group(2)), int(m.group(3)))
+            return Period(d.year, d.month, d.day)
+        m = _NUMERIC_DATE.search(text)
+        if m:
+            d = date(to_gregorian(int(m.group(3))), int(m.group(2)), int(m.group(1)))
+            return Period(d.year, d.month, d.day)
+    except ValueError:
+        return None
+
+    if "วันนี้" in text:
+        return Period(today.year, today.month, today.day)
+    if "เมื่อวาน" in text:
+        d = today - timedelta(days=1)
+        return Period(d.year, d.month, d.day)
+    if "เดือนนี้" in text:
+        return Period(today.year, today.month)
+    if "เดือนที่แล้ว" in text or "เดือนก่อน" in text:
+        d = today.replace(day=1) - timedelta(days=1)
+        return Period(d.year, d.month)
+
+    period = Period()
+    rest = text
+    for name, number in _MONTH_PATTERNS:
+        pos = rest.find(name)
+        if pos >= 0:
+            period.month = number
+            # วันที่ต้องอยู่ติดหน้าชื่อเดือน เช่น "15 กันยายน"
+            day = re.search(r"(?<!\d)(\d{1,2})\s*$", rest[:pos])
+            if day:
+                period.day = int(day.group(1))
+            rest = rest[:pos] + " " + rest[pos + len(name):]
+            break
+
+    if "ปีนี้" in rest:
+        period.year = today.year
+    elif "ปีที่แล้ว" in rest or "ปีก่อน" in rest or "ปีที่ผ่านมา" in rest:
+        period.year = today.year - 1
+    else:
+        for year in _YEAR.findall(rest):
+            year = to_gregorian(int(year))
+            if 1900 <= year <= 2200:
+                period.year = year
+                break
+
+    if period.day is not None:
+        try:
+            date(period.year or 2024, period.month, period.day)  # 2024 เป็นปีอธิกสุรทิน รับ 29 ก.พ.
+        except ValueError:
+            return None
+    elif period.month is None and "วันที่" in rest:
+        day = re.search(r"วันที่\s*(\d{1,2})(?!\d)", rest)
+        if day and 1 <= int(day.group(1)) <= 31:
+            period.day = int(day.group(1))
+    return period
+
+
+@dataclass
+class Intent:
+    name: str
+    sql: str
+    params: Dict[str, object]
+    render: Callable[[List[str], list], str]
+
+
+def _money(value) -> str:
+    return f"{value or 0:,.2f} บาท"
+
+
+def _bunches_intent(text, period):
+    where, params = period.where("hd.date")
+    match = _PALM_CODE.search(text)
+    label = ""
+    if match:
+        # รหัสต้นแปลงเป็น id จาก palm registry จึงไม่ต้อง JOIN palms
+        code = f"{match.group(1).upper()}{int(match.group(2))}"
+        palm = PALMS.get(code)
+        where += " AND hd.palm_id = :palm_id"
+        params["palm_id"] = palm.id if palm else None
+        label = f" ของต้น {code}"
+    sql = (
+        "SELECT COALESCE(SUM(hd.bunch_count), 0) AS total_bunches, COUNT(DISTINCT hd.date) AS harvest_days "
+        f"FROM harvest_details hd WHERE {where}"
+    )
+
+    def render(columns, rows):
+        total, days = rows[0]
+        if not total:
+            return f"ไม่พบข้อมูลการตัดทะลาย{label} {period.describe()} (0 ทะลาย)"
+        return f"ทะลายที่ตัดได้{label} {period.describe()}: {total:,} ทะลาย จากการตัด {days} วัน"
+
+    return Intent("total_bunches", sql, params, render)
+
+
+def _income_intent(text, period):
+    where, params = period.where()
+    sql = (
+        "SELECT COALESCE(SUM(net_amount), 0) AS net_amount, COALESCE(SUM(gross_amount), 0) AS gross_amount, "
+        "COALESCE(SUM(total_weight_kg), 0) AS total_weight_kg, COUNT(*) AS sales "
+        f"FROM harvest_income WHERE {where}"
+    )
+
+    def render(columns, rows):
+        net, gross, weight, sales = rows[0]
+        if not sales:
+            return f"ไม่พบข้อมูลรายได้ {period.describe()} (0 บาท)"
+        return (
+            f"รายได้ {period.describe()}: สุทธิ {_money(net)} "
+            f"(รวม {_money(gross)}, น้ำหนัก {weight:,.0f} กก., ขาย {sales} ครั้ง)"
+        )
+
+    return Intent("income", sql, params, render)
+
+
+def _fertilizer_intent(text, period):
+    where, params = period.where()
+    sql = (
+        "SELECT COALESCE(SUM(total_amount), 0) AS total_amount, COALESCE(SUM(sacks), 0) AS sacks, COUNT(*) AS records "
+        f"FROM fertilizer_records WHERE {where}"
+    )
+
+    def render(columns, rows):
+        total, sacks, records = rows[0]
+        if not records:
+            return f"ไม่พบข้อมูลค่าปุ๋ย {period.describe()} (0 บาท)"
+        return f"ค่าปุ๋ย {period.describe()}: {_money(total)} ({sacks:,.0f} กระสอบ, {records} รายการ)"
+
+    return Intent("fertilizer_cost", sql, params, render)
+
+
+def _profit_intent(text, period):
+    # farm_totals เก็บเป็นรายเดือน ตอบได้เฉพาะเดือนของปีที่ระบุหรือทั้งปี
+    if period.year is None or period.day is not None:
+        return None
+    # reports ใช้ to_gregorian จากโมดูลนี้ จึง import ตอนเรียกใช้
+    from reports import SUM_SQL, PnlLine, period_bounds
+
+    start, end = period_bounds(period.year, period.month)
+
+    def render(columns, rows):
+        line = PnlLine(period.describe(), *rows[0])
+        if line.empty:
+            return f"ไม่พบข้อมูลรายได้และค่าปุ๋ย {period.describe()} (กำไร 0 บาท)"
+        margin = f", อัตรากำไร {line.margin:.1%}" if line.margin is not None else ""
+        return (
+            f"กำไร {period.describe()}: {_money(line.profit)} "
+            f"(รายได้สุทธิ {_money(line.net_amount)} หักค่าปุ๋ย {_money(line.fertilizer_cost)}{margin})"
+        )
+
+    return Intent("profit", SUM_SQL, {"all": ALL_PERIOD, "start": start, "end": end}, render)
+
+
+def _next_harvest_intent(text, today=None):
+    # prediction import HARVEST_INTERVAL_DAYS จากโมดูลนี้ จึง import ตอนเรียกใช้
+    from prediction import FORECAST_SQL, forecast_from_rows
+
+    match = _PALM_CODE.search(text)
+    code = f"{match.group(1).upper()}{int(match.group(2))}" if match else None
+
+    def render(columns, rows):
+        forecast = forecast_from_rows(rows, today)
+        if code:
+            palm = forecast.palm(code)
+            if palm is None:
+                return f"ต้น {code} ยังไม่มีบันทึกการได้ทะลาย จึงทำนายวันตัดครั้งต่อไปไม่ได้"
+            return (
+                f"ต้น {palm.code} ตัดล่าสุดวันที่ {thai_date(palm.last_harvest)} (ตัดทุกประมาณ {palm.interval_days:.0f} วัน)\n"
+                f"ตัดครั้งต่อไป: {thai_date(palm.next_due)} คาดว่าได้ประมาณ {palm.expected_bunches:.1f} ทะลาย"
+            )
+        if forecast.basis == "palms":
+            answer = (
+                f"ตัดปาล์มครั้งต่อไป: {thai_date(forecast.next_date)} (คาดการณ์จากระยะการตัดของแต่ละต้น)\n"
+                f"ต้นที่ถึงรอบ {forecast.due_palms} ต้น คาดว่าได้ประมาณ {forecast.expected_bunches:,.0f} ทะลาย"
+            )
+            if forecast.overdue:
+                answer += f"\nมี {len(forecast.overdue)} ต้นที่เลยกำหนดตัดแล้ว"
+            return answer
+        if forecast.basis == "sale":
+            return (
+                f"ขายล่าสุดวันที่ {thai_date(forecast.last_sale)}\n"
+                f"ตัดปาล์มครั้งต่อไป: {thai_date(forecast.next_date)} (อีก {HARVEST_INTERVAL_DAYS} วันหลังการขาย)"
+            )
+        return "ยังไม่มีข้อมูลการเก็บเกี่ยวหรือการขาย จึงคำนวณวันตัดครั้งต่อไปไม่ได้"
+
+    return Intent("next_harvest", FORECAST_SQL, {}, render)
+
+
+def match_intent(message: str, today: Optional[date] = None) -> Optional[Intent]:
+    """จับคู่ข้อความกับ intent ที่รู้จัก คืน None ถ้าไม่มั่นใจ"""
+    text = " ".join(message.split())
+    if not text or any(word in text for word in _ANALYTIC_WORDS):
+        return None
+
+    if "ตัด" in text and any(w in text for w in ("ครั้งต่อไป", "ครั้งหน้า", "รอบหน้า", "รอบต่อไป")):
+        return _next_harvest_intent(text, today)
+
+    period = parse_period(text, today)
+    if period is None:
+        return None
+    asks_amount = any(w in text for w in ("เท่าไหร่", "เท่าไร", "กี่", "รวม", "ทั้งหมด", "ยอด", "จำนวน"))
+    if not asks_amount:
+        return None
+
+    if "กำไร" in text:
+        return _profit_intent(text, period)
+    if "ปุ๋ย" in text:
+        return _fertilizer_intent(text, period)
+    if "ทะลาย" in text:
+        return _bunches_intent(text, period)
+    if "รายได้" in text or "ขายได้" in text:
+        return _income_intent(text, period)
+    return None
+
+
+def answer_locally(message: str, session=None, today: Optional[date] = None) -> Optional[dict]:
+    """ตอบคำถามที่รู้จักด้วย query เดียว คืน dict รูปแบบเดียวกับ /api/chat หรือ None"""
+    intent = match_intent(message, today)
+    if intent is None:
+        return None
+    session = session or db.session
+    result = session.execute(db.text(intent.sql), intent.params)
+    columns = list(result.keys())
+    rows = [list(r) for r in result.fetchall()]
+    return {
+        "sql": intent.sql,
+        "columns": columns,
+        "rows": rows,
+        "answer": intent.render(columns, rows),
+        "intent": intent.name,
+    }
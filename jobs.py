@@ -0,0 +1,249 @@
+"""
+Background import jobs
+รับไฟล์ CSV แล้วคืน job id ทันที ตัวนำเข้าจริงรันใน thread pool ของ process นี้ (ไม่ต้องมี queue ภายนอก)
+แต่ละ chunk ถูก commit พร้อม rollup, ความคืบหน้า และ heartbeat ของ job ใน transaction สั้นๆ
+worker/instance ไหนก็อ่านความคืบหน้าจากตาราง jobs ได้ และ job ที่ heartbeat ขาดนานเกิน
+JOB_HEARTBEAT_TIMEOUT (process เจ้าของหยุดไปแล้ว) ถูกปิดเป็น failed ตอนมีคนเปิดดูหรือตอน init-db
+"""
+
+import json
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import Blueprint, current_app, jsonify, render_template, url_for
+from flask_login import login_required
+from sqlalchemy import and_, or_
+
+from ai import bump_data_version
+from imports import IMPORT_SPECS, open_csv, run_import
+from models import db, ImportJob
+
+jobs_bp = Blueprint("jobs", __name__)
+
+# เก็บข้อความผิดพลาดรายแถวได้สูงสุดเท่านี้ (จำนวนแถวที่ถูกปฏิเสธยังนับครบ)
+MAX_STORED_ERRORS = 1000
+DEFAULT_HEARTBEAT_TIMEOUT = 300  # วินาที
+ACTIVE_STATUSES = ("queued", "running")
+UNREADABLE_MESSAGE = "ไม่สามารถอ่านไฟล์ได้ กรุณาตรวจสอบรูปแบบไฟล์"
+INTERRUPTED_MESSAGE = "การนำเข้าถูกหยุดเพราะเซิร์ฟเวอร์เริ่มทำงานใหม่ กรุณานำเข้าไฟล์อีกครั้ง"
+
+LIST_ENDPOINTS = {
+    "income": "income_list",
+    "fertilizer": "fertilizer_list",
+    "harvest": "harvest_list",
+    "notes": "notes",
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_futures = {}
+
+
+class JobInterrupted(Exception):
+    """job ถูก process อื่นปิดเป็น failed ไปแล้ว (heartbeat ขาดนานเกิน) จึงหยุดนำเข้าต่อ"""
+
+
+def worker_id() -> str:
+    """ชื่อ process ที่เป็นเจ้าของ job (เรียกทุกครั้ง: worker ที่ fork จาก process เดียวกันได้ pid ต่างกัน)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get("IMPORT_WORKERS", 1),
+                thread_name_prefix="import-job",
+            )
+    return _executor
+
+
+def submit_import(kind, file_storage) -> ImportJob:
+    """บันทึกไฟล์ที่อัปโหลด สร้าง job แล้วส่งเข้า thread pool"""
+    app = current_app._get_current_object()
+    path = os.path.join(app.config["UPLOAD_FOLDER"], f"import-{uuid.uuid4().hex}.csv")
+    file_storage.save(path)
+
+    job = ImportJob(kind=kind, filename=file_storage.filename, path=path, status="queued",
+                    owner=worker_id(), heartbeat_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+
+    job_id = job.id
+    future = _get_executor(app).submit(_run_job, app, job_id)
+    _futures[job_id] = future
+    future.add_done_callback(lambda _: _futures.pop(job_id, None))
+    return job
+
+
+def wait_for(job_id, timeout=None):
+    """รอให้ job ใน process นี้ทำงานเสร็จ (ใช้ในชุดทดสอบ)"""
+    future = _futures.get(job_id)
+    if future is not None:
+        future.result(timeout=timeout)
+
+
+def _owned(job_id, owner, status="running"):
+    """UPDATE เฉพาะเมื่อ job ยังเป็นของ process นี้ (process อื่นอาจปิด job ไปแล้ว)"""
+    return db.update(ImportJob).where(
+        ImportJob.id == job_id, ImportJob.owner == owner, ImportJob.status == status,
+    )
+
+
+def _stale(cutoff):
+    return and_(
+        ImportJob.status.in_(ACTIVE_STATUSES),
+        or_(ImportJob.heartbeat_at.is_(None), ImportJob.heartbeat_at < cutoff),
+    )
+
+
+def fail_stale_jobs(timeout=None, job_ids=None) -> int:
+    """
+    ปิด job ที่ยัง queued/running แต่ heartbeat ขาดนานเกิน timeout (process เจ้าของหยุดไปแล้ว)
+    เป็น failed พร้อมข้อความ แล้วลบไฟล์ที่อัปโหลดไว้; job ที่ process อื่นยังรันอยู่ไม่ถูกแตะ
+    """
+    if timeout is None:
+        timeout = current_app.config.get("JOB_HEARTBEAT_TIMEOUT", DEFAULT_HEARTBEAT_TIMEOUT)
+    now = datetime.utcnow()
+    stale = _stale(now - timedelta(seconds=timeout))
+    query = db.select(ImportJob.id, ImportJob.path).where(stale)
+    if job_ids is not None:
+        query = query.where(ImportJob.id.in_(job_ids))
+    failed = 0
+    for job_id, path in db.session.execute(query).all():
+        # เงื่อนไขเดิมอีกรอบใน UPDATE: ถ้าเจ้าของเพิ่งส่ง heartbeat มา job นี้ไม่ถูกปิด
+        result = db.session.execute(
+            db.update(ImportJob).where(ImportJob.id == job_id, stale)
+            .values(status="failed", message=INTERRUPTED_MESSAGE, finished_at=now)
+        )
+        db.session.commit()
+        if result.rowcount:
+            failed += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return failed
+
+
+def _run_job(app, job_id):
+    with app.app_context():
+        owner = worker_id()
+        started = db.session.execute(
+            _owned(job_id, owner, status="queued").values(status="running", heartbeat_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if not started:
+            # ถูกปิดไปแล้วระหว่างรอคิว
+            db.session.remove()
+            return
+        job = db.session.get(ImportJob, job_id)
+        path, spec = job.path, IMPORT_SPECS[job.kind]
+        table = spec.model.__tablename__
+        saved = {"rows_processed": 0, "rows_imported": 0, "rows_rejected": 0}
+
+        def report(result):
+            # ความคืบหน้าและ heartbeat ถูก commit พร้อมแถวของ chunk นี้
+            progress = {"rows_processed": result.processed, "rows_imported": result.count,
+                        "rows_rejected": result.rejected}
+            now = datetime.utcnow()
+            if not db.session.execute(_owned(job_id, owner).values(heartbeat_at=now, **progress)).rowcount:
+                raise JobInterrupted()
+            # job ที่รอคิวอยู่หลัง job นี้ใน process เดียวกันยังมีเจ้าของอยู่
+            db.session.execute(
+                db.update(ImportJob).where(ImportJob.owner == owner, ImportJob.status == "queued")
+                .values(heartbeat_at=now)
+            )
+            db.session.commit()
+            saved.update(progress)
+            if result.count:
+                bump_data_version(table)
+
+        try:
+            with open(path, "rb") as fh, open_csv(fh) as reader:
+                if reader is None:
+                    raise UnicodeError(UNREADABLE_MESSAGE)
+                result = run_import(
+                    spec, reader,
+                    chunk_size=app.config.get("IMPORT_CHUNK_SIZE", 1000),
+                    progress=report,
+                    max_errors=MAX_STORED_ERRORS,
+                )
+            message = None
+            if result.flagged:
+                message = f"พบค่าผิดปกติ {result.flagged} รายการ รอตรวจสอบในหน้าค่าผิดปกติ"
+            db.session.execute(_owned(job_id, owner).values(
+                status="done",
+                errors=json.dumps(result.errors, ensure_ascii=False),
+                message=message,
+                finished_at=datetime.utcnow(),
+            ))
+            db.session.commit()
+        except JobInterrupted:
+            db.session.rollback()
+        except Exception as e:
+            db.session.rollback()
+            if isinstance(e, UnicodeError):
+                # เดา encoding ไม่ได้ หรือมี byte ผิด encoding อยู่กลางไฟล์
+                message = UNREADABLE_MESSAGE
+            else:
+                message = f"เกิดข้อผิดพลาดในการนำเข้าไฟล์: {str(e)}"
+            if saved["rows_imported"]:
+                # chunk ก่อนหน้าถูก commit ไปแล้ว
+                message += f" (บันทึกแล้ว {saved['rows_imported']} แถว)"
+            db.session.execute(_owned(job_id, owner).values(
+                status="failed", message=message, finished_at=datetime.utcnow(), **saved,
+            ))
+            db.session.commit()
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            db.session.remove()
+
+
+def refresh_if_stale(job: ImportJob) -> ImportJob:
+    """ตอนเปิดดู job: ถ้า heartbeat ขาดนานเกินให้ปิดเป็น failed ก่อน (ไม่เพิ่ม query ถ้า job ยังปกติ)"""
+    if job.status not in ACTIVE_STATUSES:
+        return job
+    timeout = current_app.config.get("JOB_HEARTBEAT_TIMEOUT", DEFAULT_HEARTBEAT_TIMEOUT)
+    if job.heartbeat_at is None or job.heartbeat_at < datetime.utcnow() - timedelta(seconds=timeout):
+        job_id = job.id
+        fail_stale_jobs(timeout, job_ids=[job_id])
+        job = db.session.get(ImportJob, job_id)
+    return job
+
+
+def job_state(job: ImportJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "filename": job.filename,
+        "status": job.status,
+        "rows_processed": job.rows_processed,
+        "rows_imported": job.rows_imported,
+        "rows_rejected": job.rows_rejected,
+        "errors": json.loads(job.errors) if job.errors else [],
+        "message": job.message,
+        "list_url": url_for(LIST_ENDPOINTS[job.kind]),
+    }
+
+
+@jobs_bp.route("/jobs/<int:job_id>")
+@login_required
+def job_page(job_id):
+    job = refresh_if_stale(db.get_or_404(ImportJob, job_id))
+    return render_template("job.html", job=job_state(job))
+
+
+@jobs_bp.route("/api/jobs/<int:job_id>")
+@login_required
+def job_api(job_id):
+    job = refresh_if_stale(db.get_or_404(ImportJob, job_id))
+    return jsonify(job_state(job))
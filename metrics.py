@@ -0,0 +1,225 @@
+"""
+Per-request instrumentation
+วัดเวลาต่อ request: เวลารวม, จำนวนและเวลาของ SQL, เวลา render template และเวลาเรียก Gemini
+ส่งกลับเป็น header Server-Timing และสะสมเป็นตัวเลขแบบ Prometheus text ที่ /metrics
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from flask import g, has_app_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# ขอบบนของ histogram เวลา request (วินาที)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@dataclass
+class RequestStats:
+    started: float
+    sql_count: int = 0
+    sql_seconds: float = 0.0
+    template_seconds: float = 0.0
+    gemini_calls: int = 0
+    gemini_seconds: float = 0.0
+    gemini_prompt_tokens: int = 0
+
+
+def current_stats():
+    """สถิติของ request ปัจจุบัน หรือ None (เช่นใน import job หรือ CLI)"""
+    if has_app_context():
+        return g.get("request_stats")
+    return None
+
+
+class MetricsRegistry:
+    """ตัวนับสะสมทั้ง process แยกตาม endpoint (label มีจำนวนจำกัดตาม route ที่มีอยู่)"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}    # (method, endpoint, status) -> count
+            self.durations = {}   # endpoint -> [bucket counts..., sum, count]
+            self.sums = {}        # (name, endpoint) -> value
+
+    def observe(self, method, endpoint, status, elapsed, stats: RequestStats):
+        with self._lock:
+            key = (method, endpoint, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            hist = self.durations.setdefault(endpoint, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    hist[i] += 1
+            hist[-2] += elapsed
+            hist[-1] += 1
+
+            for name, value in (
+                ("sql_statements_total", stats.sql_count),
+                ("sql_duration_seconds_total", stats.sql_seconds),
+                ("template_render_seconds_total", stats.template_seconds),
+                ("gemini_calls_total", stats.gemini_calls),
+                ("gemini_duration_seconds_total", stats.gemini_seconds),
+                ("gemini_prompt_tokens_total", stats.gemini_prompt_tokens),
+            ):
+                self.sums[(name, endpoint)] = self.sums.get((name, endpoint), 0) + value
+
+    def render(self) -> str:
+        """ข้อความรูปแบบ Prometheus exposition"""
+        lines = []
+        with self._lock:
+            lines.append("# HELP palm_http_requests_total HTTP requests by endpoint and status.")
+            lines.append("# TYPE palm_http_requests_total counter")
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'palm_http_requests_total{{method="{method}",endpoint="{endpoint}",status="{status}"}} {count}'
+                )
+
+            lines.append("# HELP palm_http_request_duration_seconds Request wall time.")
+            lines.append("# TYPE palm_http_request_duration_seconds histogram")
+            for endpoint, hist in sorted(self.durations.items()):
+                for bound, count in zip(self.buckets, hist):
+                    lines.append(
+                        f'palm_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}'
+                    )
+                lines.append(f'palm_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {hist[-1]}')
+                lines.append(f'palm_http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {hist[-2]:.6f}')
+                lines.append(f'palm_http_request_duration_seconds_count{{endpoint="{endpoint}"}} {hist[-1]}')
+
+            for name in sorted({name for name, _ in self.sums}):
+                lines.append(f"# TYPE palm_{name} counter")
+                for (metric, endpoint), value in sorted(self.sums.items()):
+                    if metric == name:
+                        formatted = f"{value:.6f}" if isinstance(value, float) else str(value)
+                        lines.append(f'palm_{name}{{endpoint="{endpoint}"}} {formatted}')
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+@contextmanager
+def measure_gemini(prompt_tokens=0):
+    """ครอบการเรียก Gemini เพื่อนับเวลา (และขนาด prompt โดยประมาณ) เข้ากับ request ปัจจุบัน"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.gemini_calls += 1
+            stats.gemini_seconds += time.perf_counter() - t0
+            stats.gemini_prompt_tokens += prompt_tokens
+
+
+def server_timing(stats: RequestStats, elapsed, streamed=False) -> str:
+    # response แบบ streaming ส่ง header ก่อนสร้าง body: ตัวเลขใน header จึงนับถึงตอนส่ง header เท่านั้น
+    parts = [
+        f'app;dur={elapsed * 1000:.1f};desc="headers only, body streamed"' if streamed else f"app;dur={elapsed * 1000:.1f}",
+        f'sql;dur={stats.sql_seconds * 1000:.1f};desc="{stats.sql_count} queries"',
+        f"tpl;dur={stats.template_seconds * 1000:.1f}",
+    ]
+    if stats.gemini_calls:
+        parts.append(f'gemini;dur={stats.gemini_seconds * 1000:.1f};desc="{stats.gemini_calls} calls"')
+    return ", ".join(parts)
+
+
+# ตัวจับเวลา SQL ตัวเดียวของทั้งแอป: ผูกกับคลาส Engine ครั้งเดียว ครอบคลุม engine ทุกตัวที่สร้างทีหลัง
+# ผู้ใช้อื่น (เช่น querylog) ลงทะเบียนผ่าน add_query_listener แทนการผูก event ซ้ำ
+_query_listeners = []
+
+
+def add_query_listener(listener):
+    """listener(conn, statement, parameters, executemany, seconds) ถูกเรียกหลัง SQL ทุกคำสั่งที่สำเร็จ"""
+    if listener not in _query_listeners:
+        _query_listeners.append(listener)
+
+
+def _record_request_query(conn, statement, parameters, executemany, seconds):
+    stats = current_stats()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_seconds += seconds
+
+
+add_query_listener(_record_request_query)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    for listener in _query_listeners:
+        listener(conn, statement, parameters, executemany, seconds)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # statement ที่ล้มเหลวไม่มี after_cursor_execute: เอาเวลาเริ่มออก ไม่ให้ค้างบน connection ใน pool
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None:
+        started = conn.info.get("query_started")
+        if started:
+            started.pop()
+
+
+def _before_render(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None:
+        g.template_started = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    stats = current_stats()
+    started = g.pop("template_started", None)
+    if stats is not None and started is not None:
+        stats.template_seconds += time.perf_counter() - started
+
+
+def init_metrics(app, registry=REGISTRY):
+    """ติดตั้ง hook วัดเวลาให้แอป"""
+
+    @app.before_request
+    def _start_request_stats():
+        g.request_stats = RequestStats(started=time.perf_counter())
+
+    @app.after_request
+    def _finish_request_stats(response):
+        stats = g.get("request_stats")
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.started
+        method, endpoint, status = request.method, request.endpoint or "unknown", response.status_code
+        response.headers["Server-Timing"] = server_timing(stats, elapsed, streamed=response.is_streamed)
+        if not response.is_streamed:
+            g.pop("request_stats", None)
+            if endpoint != "metrics":
+                registry.observe(method, endpoint, status, elapsed, stats)
+            return response
+
+        # CSV export / SSE: body (และ SQL/Gemini ที่เกิดระหว่างสร้าง body ผ่าน stream_with_context)
+        # ทำงานหลัง after_request จึงบันทึกเวลารวมตอนส่ง body ครบแล้ว
+        def _observe_streamed():
+            registry.observe(method, endpoint, status, time.perf_counter() - stats.started, stats)
+
+        if endpoint != "metrics":
+            response.call_on_close(_observe_streamed)
+        return response
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
@@ -3,16 +3,277 @@
 """
 Database Migration Script
 สำหรับ migrate ข้อมูลจาก SQLite ไป Turso
+
+อ่านแต่ละตารางแบบ stream (fetchmany ตาม rowid) แล้วเขียนเป็น batch ใน transaction
+ขนาด batch ปรับตามเวลาที่ใช้จริง ตารางที่ไม่ขึ้นต่อกันถูก migrate พร้อมกัน
+rowid ล่าสุดของแต่ละตารางถูกบันทึกไว้ในตาราง _migration_state ฝั่งปลายทางใน transaction เดียวกับข้อมูล
+รันซ้ำจึงทำต่อจากจุดที่ค้างไว้ และตรวจผลด้วยจำนวนแถวกับ checksum ต่อตาราง
 """
 
+import hashlib
 import os
-import sys
 import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
 # Add current directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
+STATE_TABLE = "_migration_state"
+DEFAULT_WORKERS = 4
+# batch เริ่มต้น/ต่ำสุด/สูงสุด และเวลาเป้าหมายต่อ transaction (วินาที)
+INITIAL_BATCH = 500
+MIN_BATCH = 1
+MAX_BATCH = 5000
+TARGET_SECONDS = 0.5
+VERIFY_FETCH = 1000
+
+
+@dataclass
+class TableResult:
+    name: str
+    rows_copied: int = 0
+    batches: int = 0
+    resumed_from: int = 0
+    seconds: float = 0.0
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def connect_source(sqlite_path):
+    """เปิดไฟล์ต้นทางแบบอ่านอย่างเดียว (ใช้หนึ่ง connection ต่อ thread แต่ปิดจาก thread หลัก)"""
+    return sqlite3.connect(f"file:{Path(sqlite_path).resolve()}?mode=ro", uri=True, check_same_thread=False)
+
+
+def turso_connector(turso_url, turso_token):
+    """คืนฟังก์ชันสร้าง connection ไป Turso (sqlite3 และ libsql ใช้ DB-API แบบเดียวกัน)"""
+    import libsql_experimental as libsql
+
+    def connect():
+        return libsql.connect(database=turso_url, auth_token=turso_token)
+
+    return connect
+
+
+def list_tables(source):
+    rows = source.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+        "AND name != ? ORDER BY name", (STATE_TABLE,)
+    ).fetchall()
+    return dict(rows)
+
+
+def table_columns(source, table):
+    return [col[1] for col in source.execute(f"PRAGMA table_info({_quote(table)})")]
+
+
+def dependency_levels(source, tables):
+    """
+    แบ่งตารางเป็นชั้นตาม foreign key: ตารางในชั้นเดียวกันไม่อ้างอิงกัน จึง migrate พร้อมกันได้
+    ชั้นถัดไปเริ่มหลังชั้นก่อนหน้าเสร็จ (เช่น palms ก่อน harvest_details)
+    """
+    deps = {}
+    for table in tables:
+        refs = {row[2] for row in source.execute(f"PRAGMA foreign_key_list({_quote(table)})")}
+        deps[table] = {r for r in refs if r in tables and r != table}
+
+    levels = []
+    done = set()
+    while len(done) < len(tables):
+        level = sorted(t for t in tables if t not in done and deps[t] <= done)
+        if not level:
+            # วนอ้างอิงกัน: ทำที่เหลือพร้อมกันในชั้นสุดท้าย
+            level = sorted(t for t in tables if t not in done)
+        levels.append(level)
+        done.update(level)
+    return levels
+
+
+def _if_not_exists(sql, kind):
+    """CREATE TABLE/INDEX ... -> CREATE ... IF NOT EXISTS ... ให้รันซ้ำได้"""
+    head, sep, rest = sql.partition(kind)
+    if rest.lstrip().upper().startswith("IF NOT EXISTS"):
+        return sql
+    return f"{head}{sep} IF NOT EXISTS{rest}"
+
+
+def create_schema(source, target, tables):
+    """สร้างตารางปลายทางจาก DDL ต้นฉบับ (รวม constraint/default ครบ) และตาราง checkpoint"""
+    for sql in tables.values():
+        target.execute(_if_not_exists(sql, "TABLE"))
+    target.execute(
+        f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ("
+        "table_name TEXT PRIMARY KEY, last_rowid INTEGER NOT NULL, rows_copied INTEGER NOT NULL)"
+    )
+    target.commit()
+
+
+def create_indexes(source, target):
+    """สร้าง index หลังข้อมูลเข้าครบ จะได้ไม่ต้องปรับ index ทุก batch"""
+    for (sql,) in source.execute("SELECT sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"):
+        target.execute(_if_not_exists(sql, "INDEX"))
+    target.commit()
+
+
+def load_checkpoint(target, table):
+    row = target.execute(
+        f"SELECT last_rowid, rows_copied FROM {STATE_TABLE} WHERE table_name = ?", (table,)
+    ).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def copy_table(source, target, table, batch_size=INITIAL_BATCH, target_seconds=TARGET_SECONDS, log=print):
+    """
+    คัดลอกตารางเดียวต่อจาก checkpoint ทีละ batch
+    แต่ละ batch กับ checkpoint ถูก commit พร้อมกัน ถ้าล้มกลางทางข้อมูลกับ checkpoint จึงไม่คลาดกัน
+    batch ที่เขียนไม่สำเร็จถูกแบ่งครึ่งแล้วลองใหม่ จนเหลือแถวเดียวจึงยอมแพ้
+    """
+    columns = table_columns(source, table)
+    column_list = ", ".join(_quote(c) for c in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    insert_sql = f"INSERT OR REPLACE INTO {_quote(table)} ({column_list}) VALUES ({placeholders})"
+    checkpoint_sql = (
+        f"INSERT OR REPLACE INTO {STATE_TABLE} (table_name, last_rowid, rows_copied) VALUES (?, ?, ?)"
+    )
+
+    last_rowid, copied = load_checkpoint(target, table)
+    result = TableResult(table, rows_copied=copied, resumed_from=last_rowid)
+    started = time.perf_counter()
+
+    cursor = source.execute(
+        f"SELECT rowid, {column_list} FROM {_quote(table)} WHERE rowid > ? ORDER BY rowid", (last_rowid,)
+    )
+    pending = []
+    while True:
+        if len(pending) < batch_size:
+            pending.extend(cursor.fetchmany(batch_size - len(pending)))
+        if not pending:
+            break
+
+        batch = pending[:batch_size]
+        t0 = time.perf_counter()
+        try:
+            target.executemany(insert_sql, [row[1:] for row in batch])
+            target.execute(checkpoint_sql, (table, batch[-1][0], result.rows_copied + len(batch)))
+            target.commit()
+        except Exception as e:
+            target.rollback()
+            if batch_size <= MIN_BATCH:
+                raise RuntimeError(f"{table}: insert failed at rowid {batch[0][0]}: {e}") from e
+            batch_size = max(MIN_BATCH, batch_size // 2)
+            continue
+        elapsed = time.perf_counter() - t0
+
+        del pending[:len(batch)]
+        result.rows_copied += len(batch)
+        result.batches += 1
+        # เร็วกว่าเป้าก็ขยาย batch ช้ากว่าเป้ามากก็ลด
+        if elapsed < target_seconds / 2:
+            batch_size = min(MAX_BATCH, batch_size * 2)
+        elif elapsed > target_seconds * 2:
+            batch_size = max(MIN_BATCH, batch_size // 2)
+
+    result.seconds = time.perf_counter() - started
+    log(f"✅ {table}: {result.rows_copied:,} rows ({result.batches} batches, {result.seconds:.1f}s)")
+    return result
+
+
+def migrate_database(sqlite_path, connect_target, workers=DEFAULT_WORKERS, batch_size=INITIAL_BATCH, log=print):
+    """
+    Migrate ทุกตารางจาก sqlite_path ไปยังฐานข้อมูลที่ได้จาก connect_target()
+    connect_target ถูกเรียกหนึ่งครั้งต่อ thread คืน dict ชื่อตาราง -> TableResult
+    """
+    source = connect_source(sqlite_path)
+    target = connect_target()
+    try:
+        tables = list_tables(source)
+        log(f"📋 Found {len(tables)} tables to migrate: {', '.join(tables)}")
+        create_schema(source, target, tables)
+        levels = dependency_levels(source, tables)
+    finally:
+        target.close()
+
+    local = threading.local()
+    connections = []
+    connections_lock = threading.Lock()
+
+    def worker_connections():
+        if not hasattr(local, "source"):
+            local.source = connect_source(sqlite_path)
+            local.target = connect_target()
+            with connections_lock:
+                connections.extend([local.source, local.target])
+        return local.source, local.target
+
+    def run(table):
+        src, dst = worker_connections()
+        return copy_table(src, dst, table, batch_size=batch_size, log=log)
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="migrate") as pool:
+            for level in levels:
+                for result in pool.map(run, level):
+                    results[result.name] = result
+    finally:
+        for conn in connections:
+            conn.close()
+
+    target = connect_target()
+    try:
+        create_indexes(source, target)
+    finally:
+        target.close()
+        source.close()
+    return results
+
+
+def table_fingerprint(conn, table, columns):
+    """(จำนวนแถว, sha256) ของตาราง เรียงตาม primary key เพื่อให้สองฝั่งเทียบกันได้"""
+    pk = [col[1] for col in sorted(conn.execute(f"PRAGMA table_info({_quote(table)})").fetchall(), key=lambda c: c[5]) if col[5]]
+    order = ", ".join(_quote(c) for c in (pk or columns))
+    column_list = ", ".join(_quote(c) for c in columns)
+    cursor = conn.execute(f"SELECT {column_list} FROM {_quote(table)} ORDER BY {order}")
+    digest = hashlib.sha256()
+    count = 0
+    while True:
+        rows = cursor.fetchmany(VERIFY_FETCH)
+        if not rows:
+            break
+        for row in rows:
+            digest.update(repr(tuple(row)).encode("utf-8"))
+            digest.update(b"\n")
+        count += len(rows)
+    return count, digest.hexdigest()
+
+
+def verify_migration(sqlite_path, connect_target, log=print):
+    """เทียบจำนวนแถวและ checksum ทุกตาราง คืน list ของตารางที่ไม่ตรง"""
+    source = connect_source(sqlite_path)
+    target = connect_target()
+    mismatched = []
+    try:
+        for table in list_tables(source):
+            columns = table_columns(source, table)
+            expected = table_fingerprint(source, table, columns)
+            actual = table_fingerprint(target, table, columns)
+            if expected == actual:
+                log(f"✅ {table}: {expected[0]:,} rows, checksum OK")
+            else:
+                log(f"❌ {table}: source {expected[0]:,} rows / target {actual[0]:,} rows, checksum mismatch")
+                mismatched.append(table)
+    finally:
+        source.close()
+        target.close()
+    return mismatched
+
+
 def migrate_sqlite_to_turso(sqlite_path='palm_farm.db'):
     """Migrate ข้อมูลจาก SQLite ไป Turso"""
 
@@ -39,93 +300,27 @@ def migrate_sqlite_to_turso(sqlite_path='palm_farm.db'):
         return False
 
     try:
-        from libsql_experimental import create_client
-
-        # Connect to both databases
-        print("🔌 Connecting to databases...")
-        sqlite_conn = sqlite3.connect(sqlite_path)
-        turso_client = create_client(url=turso_url, auth_token=turso_token)
-
-        # Get all tables from SQLite
-        cursor = sqlite_conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
-        tables = cursor.fetchall()
-
-        print(f"📋 Found {len(tables)} tables to migrate:")
-        for table in tables:
-            print(f"  - {table[0]}")
-
-        # Migrate each table
-        for table_tuple in tables:
-            table_name = table_tuple[0]
-            print(f"\n🔄 Migrating table: {table_name}")
-
-            # Get table schema
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns = cursor.fetchall()
-
-            if not columns:
-                print(f"⚠️  Skipping empty table: {table_name}")
-                continue
-
-            # Create table in Turso
-            column_defs = []
-            for col in columns:
-                col_name = col[1]
-                col_type = col[2]
-                col_notnull = "NOT NULL" if col[3] else ""
-                col_default = f"DEFAULT {col[4]}" if col[4] else ""
-                column_defs.append(f"{col_name} {col_type} {col_notnull} {col_default}".strip())
-
-            create_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_defs)});"
-
-            try:
-                turso_client.execute(create_sql)
-                print(f"✅ Created table: {table_name}")
-            except Exception as e:
-                print(f"⚠️  Table creation failed: {e}")
-                continue
-
-            # Get all data from SQLite
-            cursor.execute(f"SELECT * FROM {table_name};")
-            rows = cursor.fetchall()
-
-            if not rows:
-                print(f"📭 No data in table: {table_name}")
-                continue
-
-            # Prepare insert statement
-            placeholders = ', '.join(['?' for _ in columns])
-            insert_sql = f"INSERT OR REPLACE INTO {table_name} VALUES ({placeholders});"
-
-            # Insert data in batches
-            batch_size = 100
-            for i in range(0, len(rows), batch_size):
-                batch = rows[i:i + batch_size]
-                try:
-                    # Convert to list of tuples for Turso
-                    turso_batch = [tuple(row) for row in batch]
-                    turso_client.execute(insert_sql, turso_batch)
-                    print(f"✅ Inserted {len(batch)} rows into {table_name}")
-                except Exception as e:
-                    print(f"❌ Batch insert failed: {e}")
-                    # Try individual inserts
-                    for row in batch:
-                        try:
-                            turso_client.execute(insert_sql, [tuple(row)])
-                        except Exception as e2:
-                            print(f"❌ Row insert failed: {e2}")
-
-        sqlite_conn.close()
-        print("\n🎉 Migration completed!")
-        return True
-
+        connect_target = turso_connector(turso_url, turso_token)
     except ImportError:
-        print("❌ libsql-client not installed!")
+        print("❌ libsql-experimental not installed!")
         return False
+
+    workers = int(os.getenv('MIGRATE_WORKERS', DEFAULT_WORKERS))
+    try:
+        print("🔌 Connecting to databases...")
+        migrate_database(sqlite_path, connect_target, workers=workers)
+        print("\n🔍 Verifying...")
+        mismatched = verify_migration(sqlite_path, connect_target)
     except Exception as e:
         print(f"❌ Migration failed: {e}")
+        print("   Run the script again to resume from the last checkpoint.")
+        return False
+
+    if mismatched:
+        print(f"❌ Verification failed for: {', '.join(mismatched)}")
         return False
+    print("\n🎉 Migration completed!")
+    return True
 
 def backup_sqlite(sqlite_path='palm_farm.db'):
     """สร้าง backup ของ SQLite database"""
@@ -187,4 +382,4 @@ def main():
     return 0 if success else 1
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
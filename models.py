@@ -2,7 +2,7 @@ from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import Integer, String, Date, DateTime, ForeignKey, Float, Text
+from sqlalchemy import Integer, String, Date, DateTime, ForeignKey, Float, Text, Index
 
 from flask_sqlalchemy import SQLAlchemy
 
@@ -29,6 +29,7 @@ class Palm(db.Model):
 
 class HarvestIncome(db.Model):
     __tablename__ = "harvest_income"
+    __table_args__ = (Index("ix_harvest_income_date_id", "date", "id"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     date: Mapped[datetime] = mapped_column(Date, nullable=False)
     total_weight_kg: Mapped[float] = mapped_column(Float, nullable=False)
@@ -41,6 +42,7 @@ class HarvestIncome(db.Model):
 
 class FertilizerRecord(db.Model):
     __tablename__ = "fertilizer_records"
+    __table_args__ = (Index("ix_fertilizer_records_date_id", "date", "id"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     date: Mapped[datetime] = mapped_column(Date, nullable=False)
     item: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -53,6 +55,10 @@ class FertilizerRecord(db.Model):
 
 class HarvestDetail(db.Model):
     __tablename__ = "harvest_details"
+    __table_args__ = (
+        Index("ix_harvest_details_date_id", "date", "id"),
+        Index("ix_harvest_details_palm_id_date", "palm_id", "date"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     date: Mapped[datetime] = mapped_column(Date, nullable=False)
     palm_id: Mapped[int] = mapped_column(Integer, ForeignKey("palms.id"), nullable=False)
@@ -64,8 +70,83 @@ class HarvestDetail(db.Model):
 
 class Note(db.Model):
     __tablename__ = "notes"
+    __table_args__ = (Index("ix_notes_date_id", "date", "id"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     date: Mapped[datetime] = mapped_column(Date, nullable=False)
     title: Mapped[str] = mapped_column(String(255), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class FarmTotal(db.Model):
+    """ยอดรวมสะสมของสวน: period = 'all' (ทั้งหมด) หรือ 'YYYY-MM' (รายเดือน)"""
+    __tablename__ = "farm_totals"
+    period: Mapped[str] = mapped_column(String(7), primary_key=True)
+    total_weight_kg: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    gross_amount: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    harvesting_wage: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    net_amount: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    fertilizer_cost: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    bunch_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+class PalmStat(db.Model):
+    """สถิติการตัดสะสมรายต้น: month = 0 (ทั้งหมด) หรือ 1-12 (ตามเดือนของปี ใช้ประมาณผลผลิตตามฤดู)"""
+    __tablename__ = "palm_stats"
+    palm_id: Mapped[int] = mapped_column(Integer, ForeignKey("palms.id"), primary_key=True)
+    month: Mapped[int] = mapped_column(Integer, primary_key=True)
+    harvests: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # ครั้งที่ได้ทะลาย (> 0)
+    bunches: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    first_date: Mapped[datetime] = mapped_column(Date, nullable=True)  # เฉพาะ month = 0
+    last_date: Mapped[datetime] = mapped_column(Date, nullable=True)
+
+class AnomalyStat(db.Model):
+    """ค่าเฉลี่ย/ความแปรปรวนแบบ Welford ของค่าที่ผ่านการตรวจ: series + group_key (เช่น bunches + palm_id, price + เดือน 1-12)"""
+    __tablename__ = "anomaly_stats"
+    series: Mapped[str] = mapped_column(String(20), primary_key=True)
+    group_key: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    mean: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    m2: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)  # ผลรวมกำลังสองของส่วนต่างจากค่าเฉลี่ย
+
+class Anomaly(db.Model):
+    """ค่าที่ผิดปกติรอตรวจ (record_id เป็น NULL สำหรับแถวที่บันทึกทั้งรอบหรือนำเข้าจาก CSV)"""
+    __tablename__ = "anomalies"
+    __table_args__ = (Index("ix_anomalies_status_date_id", "status", "date", "id"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)  # harvest | income
+    record_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    date: Mapped[datetime] = mapped_column(Date, nullable=False)
+    palm_id: Mapped[int] = mapped_column(Integer, ForeignKey("palms.id"), nullable=True)
+    field: Mapped[str] = mapped_column(String(30), nullable=False)
+    value: Mapped[float] = mapped_column(Float, nullable=False)
+    expected: Mapped[float] = mapped_column(Float, nullable=False)  # ค่าปกติตอนตรวจ
+    low: Mapped[float] = mapped_column(Float, nullable=False)  # ช่วงที่ไม่ถือว่าผิดปกติ
+    high: Mapped[float] = mapped_column(Float, nullable=False)
+    score: Mapped[float] = mapped_column(Float, nullable=False)  # z-score
+    source: Mapped[str] = mapped_column(String(20), nullable=False, default="form")  # form | batch | import
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending")  # pending | accepted | dismissed
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    reviewed_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+class ImportJob(db.Model):
+    """งานนำเข้า CSV ที่รันเบื้องหลัง"""
+    __tablename__ = "jobs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)  # income | fertilizer | harvest | notes
+    filename: Mapped[str] = mapped_column(String(255), nullable=True)
+    path: Mapped[str] = mapped_column(String(500), nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="queued")  # queued | running | done | failed
+    rows_processed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    rows_imported: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    rows_rejected: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    errors: Mapped[str] = mapped_column(Text, nullable=True)  # JSON list ของข้อผิดพลาดรายแถว
+    message: Mapped[str] = mapped_column(Text, nullable=True)
+    owner: Mapped[str] = mapped_column(String(100), nullable=True)  # process ที่รัน job (host:pid)
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)  # process เจ้าของยังทำงานอยู่ล่าสุดเมื่อไร
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+class AppMeta(db.Model):
+    """ค่าระดับฐานข้อมูล เช่น schema_version ที่ใช้ข้ามการตรวจ schema ตอนเริ่มแอป"""
+    __tablename__ = "app_meta"
+    key: Mapped[str] = mapped_column(String(50), primary_key=True)
+    value: Mapped[str] = mapped_column(Text, nullable=True)
@@ -0,0 +1,103 @@
+"""
+Keyset pagination
+แบ่งหน้ารายการที่เรียงตาม (date DESC, id DESC) ด้วย cursor แทน OFFSET
+ทุกหน้าอ่านแค่ per_page + 1 แถวผ่าน index (date, id) ไม่ว่าข้อมูลจะมีกี่ปี
+"""
+
+from dataclasses import dataclass, field
+from datetime import date
+from typing import List, Optional, Tuple
+
+from flask import current_app, request
+from sqlalchemy import tuple_
+
+from models import db
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+@dataclass
+class KeysetPage:
+    rows: List
+    per_page: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    link_args: dict = field(default_factory=dict)
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+
+def encode_cursor(d: date, row_id: int) -> str:
+    return f"{d.isoformat()}.{row_id}"
+
+
+def decode_cursor(value: Optional[str]) -> Optional[Tuple[date, int]]:
+    """แปลง cursor จาก URL กลับเป็น (date, id) ถ้ารูปแบบผิดถือว่าไม่มี cursor"""
+    if not value:
+        return None
+    try:
+        d, row_id = value.split(".", 1)
+        return date.fromisoformat(d), int(row_id)
+    except ValueError:
+        return None
+
+
+def _key(row):
+    return encode_cursor(row.date, row.id)
+
+
+def paginate(stmt, date_col, id_col, after=None, before=None, per_page=DEFAULT_PAGE_SIZE, session=None) -> KeysetPage:
+    """
+    ดึงหนึ่งหน้าจาก select ที่ยังไม่ได้ order
+    after  = cursor ของแถวสุดท้ายหน้าก่อน (ไปหน้าถัดไป = ข้อมูลเก่ากว่า)
+    before = cursor ของแถวแรกหน้าปัจจุบัน (ย้อนกลับ = ข้อมูลใหม่กว่า)
+    """
+    session = session or db.session
+    key = tuple_(date_col, id_col)
+    after_key, before_key = decode_cursor(after), decode_cursor(before)
+
+    if before_key:
+        stmt = stmt.where(key > tuple_(*before_key)).order_by(date_col.asc(), id_col.asc())
+    else:
+        if after_key:
+            stmt = stmt.where(key < tuple_(*after_key))
+        stmt = stmt.order_by(date_col.desc(), id_col.desc())
+
+    result = session.execute(stmt.limit(per_page + 1))
+    rows = result.scalars().all() if len(stmt.column_descriptions) == 1 else result.all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    page = KeysetPage(rows=rows, per_page=per_page)
+    if before_key:
+        rows.reverse()
+        page.prev_cursor = _key(rows[0]) if has_more else None
+        page.next_cursor = _key(rows[-1]) if rows else None
+    else:
+        page.next_cursor = _key(rows[-1]) if has_more else None
+        page.prev_cursor = _key(rows[0]) if after_key and rows else None
+    return page
+
+
+def paginate_request(stmt, date_col, id_col) -> KeysetPage:
+    """อ่าน after/before/per_page จาก query string แล้วแบ่งหน้า"""
+    default_size = current_app.config.get("LIST_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+    per_page = request.args.get("per_page", type=int) or default_size
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+
+    page = paginate(
+        stmt, date_col, id_col,
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        per_page=per_page,
+    )
+    if per_page != default_size:
+        page.link_args["per_page"] = per_page
+    return page
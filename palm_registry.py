@@ -0,0 +1,121 @@
+"""
+Palm registry
+ตาราง palms มี 312 แถวที่แทบไม่เปลี่ยน จึงโหลดครั้งเดียวเก็บไว้ในหน่วยความจำของ process
+(รหัส -> id, id -> รหัส, แถว/หมายเลข และลำดับตามธรรมชาติ A1..A26..L26)
+โหลดใหม่เมื่อมีการเพิ่ม/แก้/ลบ Palm ผ่าน ORM หรือเมื่อแอปชี้ไปฐานข้อมูลอื่น
+"""
+
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from models import db, Palm
+
+_CODE = re.compile(r"^\s*([A-Za-z])\s*0*(\d{1,3})\s*$")
+
+
+@dataclass(frozen=True)
+class PalmInfo:
+    id: int
+    code: str
+    row: str      # ตัวอักษรแถว A-L
+    number: int   # หมายเลขในแถว 1-26
+
+
+def split_code(code: str) -> Optional[Tuple[str, int]]:
+    """'b07' -> ('B', 7); รหัสที่ไม่อยู่ในรูปแบบ แถว+หมายเลข คืน None"""
+    m = _CODE.match(code or "")
+    if not m:
+        return None
+    return m.group(1).upper(), int(m.group(2))
+
+
+def normalize_code(code: str) -> str:
+    """รหัสที่ผู้ใช้พิมพ์ (ตัวเล็ก, มีช่องว่าง, เลขนำหน้าด้วย 0) -> รูปแบบในฐานข้อมูล"""
+    parts = split_code(code)
+    return f"{parts[0]}{parts[1]}" if parts else (code or "").strip()
+
+
+def natural_key(code: str):
+    parts = split_code(code)
+    return (0, parts[0], parts[1]) if parts else (1, code, 0)
+
+
+class PalmRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._palms: List[PalmInfo] = []
+        self._by_code: Dict[str, PalmInfo] = {}
+        self._by_id: Dict[int, PalmInfo] = {}
+        self._ids: Dict[str, int] = {}
+        self.loads = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._source = None
+
+    def _ensure(self, session=None):
+        session = session or db.session
+        source = str(session.get_bind().url)
+        if self._source == source:
+            return
+        with self._lock:
+            if self._source == source:
+                return
+            rows = session.execute(db.select(Palm.id, Palm.code)).all()
+            palms = []
+            for palm_id, code in rows:
+                row, number = split_code(code) or (code, 0)
+                palms.append(PalmInfo(palm_id, code, row, number))
+            palms.sort(key=lambda p: natural_key(p.code))
+            self._palms = palms
+            self._by_code = {p.code: p for p in palms}
+            self._by_id = {p.id: p for p in palms}
+            self._ids = {p.code: p.id for p in palms}
+            self._source = source
+            self.loads += 1
+
+    def load(self, session=None):
+        """โหลดทันที (เรียกตอนเริ่มแอปเพื่อให้ request แรกไม่ต้องรอ)"""
+        self.invalidate()
+        self._ensure(session)
+
+    def all(self, session=None) -> List[PalmInfo]:
+        """ทุกต้นเรียง A1, A2, ..., A26, B1, ..."""
+        self._ensure(session)
+        return self._palms
+
+    def get(self, code, session=None) -> Optional[PalmInfo]:
+        self._ensure(session)
+        return self._by_code.get(normalize_code(code))
+
+    def by_id(self, palm_id, session=None) -> Optional[PalmInfo]:
+        self._ensure(session)
+        return self._by_id.get(palm_id)
+
+    def code_of(self, palm_id, session=None) -> Optional[str]:
+        palm = self.by_id(palm_id, session)
+        return palm.code if palm else None
+
+    def ids(self, session=None) -> Dict[str, int]:
+        """รหัส -> id (dict ที่ใช้ร่วมกัน ห้ามแก้ไข)"""
+        self._ensure(session)
+        return self._ids
+
+    def __len__(self):
+        self._ensure()
+        return len(self._palms)
+
+
+PALMS = PalmRegistry()
+
+
+@event.listens_for(Palm, "after_insert")
+@event.listens_for(Palm, "after_update")
+@event.listens_for(Palm, "after_delete")
+def _palms_changed(mapper, connection, target):
+    PALMS.invalidate()
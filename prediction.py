@@ -0,0 +1,150 @@
+"""
+Next-harvest prediction
+ทำนายวันตัดครั้งต่อไปและจำนวนทะลายที่คาดว่าจะได้ของแต่ละต้นและทั้งสวน จากตาราง palm_stats
+(สถิติสะสมรายต้นที่ rollups ปรับทีละส่วนทุกครั้งที่บันทึก/แก้ไข/ลบ/นำเข้า จึงไม่ต้องคำนวณจากบันทึกทั้งหมดใหม่)
+
+- ระยะห่างการตัดของต้น = (วันตัดล่าสุด - วันตัดแรก) / (จำนวนครั้ง - 1)
+- ทะลายที่คาดว่าจะได้ = ค่าเฉลี่ยของเดือนเดียวกันในปีก่อนๆ (ถ้ามีข้อมูลพอ) ไม่เช่นนั้นใช้ค่าเฉลี่ยทั้งหมด
+- รอบถัดไปของสวน = วันครบกำหนดที่เป็นค่ากลางของทุกต้น; ต้นที่ครบกำหนดภายในครึ่งรอบหลังจากนั้นนับรวมในรอบ
+ถ้ายังไม่มีบันทึกรายต้น ใช้วันขายล่าสุด + 15 วันแทน
+"""
+
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from datacache import DataCache
+from intents import HARVEST_INTERVAL_DAYS
+from models import db
+from palm_registry import PALMS
+
+MIN_SEASON_HARVESTS = 2  # จำนวนครั้งขั้นต่ำในเดือนนั้นก่อนใช้ค่าเฉลี่ยตามฤดู
+
+# แถว palm = สถิติรายต้น (month 0 = ทั้งหมด, 1-12 = ตามเดือน), แถว sale = วันขายล่าสุด (ใช้เมื่อยังไม่มีสถิติ)
+FORECAST_SQL = """
+SELECT 'palm' AS kind, palm_id, month, harvests, bunches, first_date, last_date FROM palm_stats
+UNION ALL
+SELECT 'sale', NULL, NULL, NULL, NULL, NULL, MAX(date) FROM harvest_income
+"""
+
+# ผลทำนายเปลี่ยนเมื่อ palm_stats / วันขายล่าสุดเปลี่ยนหรือข้ามวัน (key ผูกกับวันที่)
+FORECAST_CACHE = DataCache(maxsize=8, ttl=3600)
+FORECAST_TABLES = {"harvest_details", "palm_stats", "harvest_income"}
+
+
+@dataclass
+class PalmForecast:
+    code: str
+    harvests: int
+    last_harvest: date
+    interval_days: float
+    next_due: date
+    expected_bunches: float
+    seasonal: bool  # expected_bunches มาจากค่าเฉลี่ยของเดือนเดียวกัน
+
+    def to_dict(self, today: Optional[date] = None) -> dict:
+        data = {
+            "code": self.code,
+            "harvests": self.harvests,
+            "last_harvest": self.last_harvest.isoformat(),
+            "interval_days": round(self.interval_days, 1),
+            "next_due": self.next_due.isoformat(),
+            "expected_bunches": round(self.expected_bunches, 1),
+            "seasonal": self.seasonal,
+        }
+        if today is not None:
+            data["overdue_days"] = max((today - self.next_due).days, 0)
+        return data
+
+
+@dataclass
+class FarmForecast:
+    today: date
+    next_date: Optional[date] = None
+    expected_bunches: float = 0.0
+    due_palms: int = 0
+    basis: Optional[str] = None  # "palms" | "sale" | None (ยังไม่มีข้อมูล)
+    last_sale: Optional[date] = None
+    palms: List[PalmForecast] = field(default_factory=list)
+
+    @property
+    def overdue(self) -> List[PalmForecast]:
+        return [p for p in self.palms if p.next_due < self.today]
+
+    def palm(self, code) -> Optional[PalmForecast]:
+        info = PALMS.get(code)
+        return next((p for p in self.palms if info and p.code == info.code), None)
+
+    def to_dict(self) -> dict:
+        return {
+            "today": self.today.isoformat(),
+            "next_date": self.next_date.isoformat() if self.next_date else None,
+            "expected_bunches": round(self.expected_bunches, 1),
+            "due_palms": self.due_palms,
+            "overdue_palms": len(self.overdue),
+            "basis": self.basis,
+            "last_sale": self.last_sale.isoformat() if self.last_sale else None,
+            "palms": [p.to_dict(self.today) for p in self.palms],
+        }
+
+
+def _as_date(value) -> Optional[date]:
+    return date.fromisoformat(str(value)[:10]) if value else None
+
+
+def forecast_from_rows(rows, today: Optional[date] = None) -> FarmForecast:
+    """คำนวณจากผลของ FORECAST_SQL (ใช้ร่วมกันทั้งแดชบอร์ด, API และ intent ของแชต)"""
+    today = today or date.today()
+    overall: Dict[int, tuple] = {}
+    seasonal: Dict[tuple, tuple] = {}
+    result = FarmForecast(today)
+    for kind, palm_id, month, harvests, bunches, first_date, last_date in rows:
+        if kind == "sale":
+            result.last_sale = _as_date(last_date)
+        elif month == 0:
+            overall[palm_id] = (harvests or 0, bunches or 0, _as_date(first_date), _as_date(last_date))
+        else:
+            seasonal[(palm_id, month)] = (harvests or 0, bunches or 0)
+
+    for palm_id, (harvests, bunches, first, last) in overall.items():
+        code = PALMS.code_of(palm_id)
+        if not harvests or last is None or code is None:
+            continue
+        span = (last - first).days if first else 0
+        interval = span / (harvests - 1) if harvests > 1 and span > 0 else float(HARVEST_INTERVAL_DAYS)
+        next_due = last + timedelta(days=round(interval))
+        month_harvests, month_bunches = seasonal.get((palm_id, next_due.month), (0, 0))
+        use_season = month_harvests >= MIN_SEASON_HARVESTS
+        expected = month_bunches / month_harvests if use_season else bunches / harvests
+        result.palms.append(PalmForecast(code, harvests, last, interval, next_due, expected, use_season))
+
+    result.palms.sort(key=lambda p: (p.next_due, p.code))
+    if result.palms:
+        dues = [p.next_due for p in result.palms]
+        # รอบที่ยังไม่ถึง (หรือเลยมาแล้ว) ของสวน: ค่ากลางของวันครบกำหนดทุกต้น แต่ไม่ก่อนวันนี้
+        result.next_date = max(dues[len(dues) // 2], today)
+        window_end = result.next_date + timedelta(days=HARVEST_INTERVAL_DAYS // 2)
+        due = [p for p in result.palms if p.next_due <= window_end]
+        result.due_palms = len(due)
+        result.expected_bunches = sum(p.expected_bunches for p in due)
+        result.basis = "palms"
+    elif result.last_sale:
+        result.next_date = result.last_sale + timedelta(days=HARVEST_INTERVAL_DAYS)
+        result.basis = "sale"
+    return result
+
+
+def farm_forecast(today: Optional[date] = None, session=None) -> FarmForecast:
+    session = session or db.session
+    return forecast_from_rows(session.execute(db.text(FORECAST_SQL)).fetchall(), today)
+
+
+def cached_farm_forecast(today: Optional[date] = None, session=None) -> FarmForecast:
+    """ผลทำนายของวันนี้ ใช้ซ้ำจนกว่าจะมีการแก้ไข harvest_details / harvest_income"""
+    today = today or date.today()
+    key = ("forecast", today)
+    forecast = FORECAST_CACHE.get(key)
+    if forecast is None:
+        forecast = farm_forecast(today, session)
+        FORECAST_CACHE.put(key, forecast, FORECAST_TABLES)
+    return forecast
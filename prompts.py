@@ -0,0 +1,129 @@
+"""
+ตัวสร้าง prompt สำหรับให้ Gemini เขียน SQL
+- คำอธิบาย schema สร้างจาก metadata ของ models.py จึงตรงกับตารางจริงเสมอ
+- ใส่เฉพาะตารางและกติกาที่เกี่ยวกับคำถาม แทนการส่ง prompt ยาวชุดเดียวทุกครั้ง
+- ประมาณจำนวน token ของ prompt เพื่อนับเข้า /metrics
+"""
+
+from datetime import date
+from typing import Iterable, Optional, Tuple
+
+from models import db
+from intents import thai_date
+
+# ตารางที่โมเดลเขียน SQL อ่านได้ (users และ jobs ไม่เกี่ยวกับคำถามเรื่องสวน)
+PROMPT_TABLES = (
+    "harvest_income", "fertilizer_records", "harvest_details", "palms", "notes", "farm_totals", "palm_stats",
+)
+# คอลัมน์ที่ไม่ช่วยตอบคำถาม
+SKIP_COLUMNS = {"created_at"}
+
+# ความหมายของตาราง (ชื่อคอลัมน์และชนิดมาจาก metadata)
+TABLE_NOTES = {
+    "harvest_income": "การขายปาล์มแต่ละครั้ง net_amount = gross_amount - harvesting_wage",
+    "fertilizer_records": "การซื้อ/ใส่ปุ๋ย total_amount = sacks*unit_price + spreading_wage",
+    "harvest_details": "จำนวนทะลายที่ตัดรายต้น",
+    "palms": "ต้นปาล์ม code A1-L26 (312 ต้น)",
+    "notes": "บันทึกเหตุการณ์",
+    "farm_totals": "ยอดรวมที่คำนวณไว้แล้ว period = 'all' หรือ 'YYYY-MM' ใช้แทน SUM รายเดือนได้",
+    "palm_stats": "สถิติการตัดรายต้น month = 0 (ทั้งหมด) หรือ 1-12 (ตามเดือน) harvests = ครั้งที่ได้ทะลาย",
+}
+
+# คำในคำถาม -> ตารางที่น่าจะต้องใช้
+TABLE_KEYWORDS = {
+    "harvest_income": ("รายได้", "ขาย", "ราคา", "น้ำหนัก", "กิโล", "กก", "เงิน", "บาท", "ค่าแรงตัด", "กำไร"),
+    "fertilizer_records": ("ปุ๋ย", "ค่าใช้จ่าย", "กระสอบ", "ทุน", "กำไร"),
+    "harvest_details": ("ทะลาย", "ต้น", "ตัด"),
+    "palms": ("ต้น",),
+    "notes": ("บันทึก", "โน้ต", "เหตุการณ์", "หมายเหตุ"),
+    "farm_totals": ("ยอดรวม", "สรุป", "รายเดือน", "กำไร"),
+    "palm_stats": ("ครั้งต่อไป", "ครั้งหน้า", "รอบหน้า", "รอบต่อไป", "ฤดู", "คาด"),
+}
+
+_TYPE_NAMES = {"INTEGER": "int", "FLOAT": "real", "REAL": "real", "DATE": "date", "DATETIME": "datetime", "TEXT": "text"}
+
+_DATE_RULES = (
+    "วันที่เก็บเป็น 'YYYY-MM-DD' ใช้ strftime: ระบุวัน→'%d', เดือน→'%m' (ทุกปี), วัน+เดือน→'%m-%d', ปี→'%Y', "
+    "ครบวันเดือนปี→date = 'YYYY-MM-DD'; ปี พ.ศ. ลบ 543; เดือนไทย มกราคม=01 ... ธันวาคม=12"
+)
+_TABLE_RULES = {
+    "harvest_details": "ทะลายรวมใช้ COALESCE(SUM(bunch_count), 0); ชื่อต้นใช้ JOIN palms p ON hd.palm_id = p.id",
+    "farm_totals": "ยอดรายเดือนอ่านจาก farm_totals ได้เลย ไม่ต้อง SUM จากตารางรายการ",
+}
+_NEXT_HARVEST_RULE = (
+    "ตัดครั้งต่อไปของต้น = last_date + (julianday(last_date) - julianday(first_date)) / (harvests - 1) วัน "
+    "จาก palm_stats WHERE month = 0 AND harvests > 1; ถ้ายังไม่มีสถิติใช้วันขายล่าสุด + 15 วัน: "
+    "SELECT DATE(MAX(date), '+15 days') AS next_harvest FROM harvest_income"
+)
+_NEXT_WORDS = ("ครั้งต่อไป", "ครั้งหน้า", "รอบหน้า", "รอบต่อไป")
+
+
+def _type_name(column) -> str:
+    name = type(column.type).__name__.upper()
+    return _TYPE_NAMES.get(name, "text")
+
+
+def describe_table(name: str) -> str:
+    """หนึ่งบรรทัดต่อตาราง: ชื่อ(คอลัมน์ ชนิด, ...) -- ความหมาย"""
+    table = db.metadata.tables[name]
+    columns = []
+    for column in table.columns:
+        if column.name in SKIP_COLUMNS:
+            continue
+        text = f"{column.name} {_type_name(column)}"
+        for fk in column.foreign_keys:
+            text += f"→{fk.target_fullname}"
+        columns.append(text)
+    line = f"{name}({', '.join(columns)})"
+    note = TABLE_NOTES.get(name)
+    return f"{line} -- {note}" if note else line
+
+
+def describe_schema(tables: Iterable[str] = PROMPT_TABLES) -> str:
+    return "\n".join(describe_table(t) for t in tables)
+
+
+def _asks_next_harvest(message: str) -> bool:
+    return "ตัด" in message and any(w in message for w in _NEXT_WORDS)
+
+
+def relevant_tables(message: str) -> Tuple[str, ...]:
+    """ตารางที่คำถามน่าจะต้องใช้ ถ้าเดาไม่ได้ให้ใส่ทุกตาราง"""
+    text = message.replace("ต้นทุน", "ทุน")  # "ต้น" ในคำนี้ไม่ได้หมายถึงต้นปาล์ม
+    picked = {t for t, words in TABLE_KEYWORDS.items() if any(w in text for w in words)}
+    if "harvest_details" in picked:
+        picked.add("palms")  # ต้องใช้แปลง palm_id เป็นรหัสต้น
+    if _asks_next_harvest(text):
+        picked.update(("palm_stats", "harvest_income"))  # ระยะการตัดรายต้น หรือวันขายล่าสุด + 15 วัน
+    if not picked:
+        return PROMPT_TABLES
+    return tuple(t for t in PROMPT_TABLES if t in picked)
+
+
+def build_sql_prompt(message: str, today: Optional[date] = None) -> Tuple[str, Tuple[str, ...]]:
+    """prompt ขอ SQL หนึ่งคำสั่ง คืน (prompt, ตารางที่ใส่ไว้)"""
+    tables = relevant_tables(message)
+    rules = [_DATE_RULES]
+    rules += [_TABLE_RULES[t] for t in tables if t in _TABLE_RULES]
+    if _asks_next_harvest(message):
+        rules.append(_NEXT_HARVEST_RULE)
+    rules.append("SELECT คำสั่งเดียวเท่านั้น; SUM/COUNT ที่อาจเป็น NULL ใช้ COALESCE(..., 0)")
+
+    prompt = (
+        f"ผู้ช่วยสวนปาล์มน้ำมัน วันนี้ {thai_date(today or date.today())} ฐานข้อมูล SQLite:\n"
+        f"{describe_schema(tables)}\n"
+        "กติกา:\n" + "\n".join(f"- {r}" for r in rules) + "\n"
+        f"คำถาม: {message}\n"
+        'ตอบเป็น JSON เท่านั้น: {"sql": "SELECT ... (ว่างถ้าไม่ต้องใช้ข้อมูล)", '
+        '"summary_hint": "แนวทางสรุปเป็นภาษาไทย หรือคำตอบเองถ้าไม่ต้องใช้ SQL"}'
+    )
+    return prompt, tables
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    ประมาณจำนวน token โดยไม่ต้องเรียก API: ตัวอักษร ASCII ~4 ตัวต่อ token, ตัวอักษรไทย ~2 ตัวต่อ token
+    ใช้เปรียบเทียบขนาด prompt ไม่ใช่ค่าที่ Google คิดเงินจริง
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return round(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
@@ -0,0 +1,153 @@
+"""
+Slow-query log และตัวตรวจ N+1 (สำหรับ dev/test)
+เมื่อเปิด QUERY_LOG จะเก็บทุก SQL ของแต่ละ request แล้วเตือนเมื่อ
+- statement เดียวกันถูกส่งซ้ำหลายครั้งด้วย parameter ต่างกัน (N+1)
+- statement ใช้เวลาเกิน SLOW_QUERY_MS (แนบ EXPLAIN QUERY PLAN มาด้วย)
+ชุดทดสอบใช้ query_budget() เพื่อให้ test ล้มเมื่อ route ใช้ query เกินที่กำหนด
+"""
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from flask import current_app, g, has_app_context, request
+
+from metrics import add_query_listener
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """จำนวน query เกินงบที่กำหนด (ข้อความมีรายการ SQL ที่ส่งไป)"""
+
+
+@dataclass
+class QueryRecord:
+    statement: str
+    parameters: object
+    seconds: float
+    executemany: bool = False
+    plan: Optional[List[str]] = None
+
+
+@dataclass
+class QueryRecorder:
+    queries: List[QueryRecord] = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+        """statement -> จำนวนครั้ง ของ statement ที่ถูกส่งซ้ำด้วย parameter ต่างกันตั้งแต่ threshold ครั้งขึ้นไป"""
+        params = defaultdict(list)
+        for q in self.queries:
+            if not q.executemany:
+                params[q.statement].append(repr(q.parameters))
+        return {
+            stmt: len(values) for stmt, values in params.items()
+            if len(values) >= threshold and len(set(values)) > 1
+        }
+
+    def slow(self, threshold_ms=DEFAULT_SLOW_QUERY_MS):
+        return [q for q in self.queries if q.seconds * 1000 >= threshold_ms]
+
+    def describe(self):
+        return "\n".join(f"  {i}. {q.statement}  {q.parameters!r}" for i, q in enumerate(self.queries, 1))
+
+
+def _active_recorders():
+    recorders = list(getattr(_local, "budgets", ()))
+    if has_app_context():
+        recorder = g.get("query_log")
+        if recorder is not None:
+            recorders.append(recorder)
+    return recorders
+
+
+def _explain(cursor_connection, statement, parameters):
+    """EXPLAIN QUERY PLAN ผ่าน cursor ใหม่ของ DBAPI โดยตรง (ไม่ผ่าน event จึงไม่ถูกบันทึกซ้ำ)"""
+    try:
+        cursor = cursor_connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+            return [row[-1] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except Exception as e:
+        return [f"(EXPLAIN ไม่สำเร็จ: {e})"]
+
+
+def _record_query(conn, statement, parameters, executemany, elapsed):
+    recorders = _active_recorders()
+    if not recorders:
+        return
+
+    record = QueryRecord(statement, parameters, elapsed, executemany)
+    if has_app_context() and g.get("query_log") is not None and not executemany:
+        slow_ms = current_app.config.get("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)
+        if elapsed * 1000 >= slow_ms and statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            record.plan = _explain(conn.connection, statement, parameters)
+    for recorder in recorders:
+        recorder.queries.append(record)
+
+
+# ใช้ตัวจับเวลา SQL เดียวกับ metrics (ไม่ผูก event ของ Engine ซ้ำ)
+add_query_listener(_record_query)
+
+
+@contextmanager
+def query_budget(max_queries):
+    """
+    นับ SQL ทุกคำสั่งใน block นี้ (รวม request ของ test client) และ raise QueryBudgetExceeded ถ้าเกิน
+        with query_budget(3):
+            client.get("/income")
+    """
+    recorder = QueryRecorder()
+    budgets = getattr(_local, "budgets", None)
+    if budgets is None:
+        budgets = _local.budgets = []
+    budgets.append(recorder)
+    try:
+        yield recorder
+    finally:
+        budgets.remove(recorder)
+    if len(recorder) > max_queries:
+        raise QueryBudgetExceeded(
+            f"ใช้ {len(recorder)} queries เกินงบ {max_queries}:\n{recorder.describe()}"
+        )
+
+
+def report(recorder: QueryRecorder, endpoint, logger, slow_ms, n_plus_one_threshold):
+    """เขียน warning สำหรับ N+1 และ query ช้าของ request หนึ่ง"""
+    for statement, count in recorder.repeated(n_plus_one_threshold).items():
+        logger.warning("N+1 ที่ %s: statement เดียวกันถูกส่ง %d ครั้ง: %s", endpoint, count, statement)
+    for q in recorder.slow(slow_ms):
+        plan = "\n    ".join(q.plan or [])
+        logger.warning("query ช้า %.1f ms ที่ %s: %s %r\n    %s", q.seconds * 1000, endpoint, q.statement, q.parameters, plan)
+
+
+def init_query_log(app):
+    """เปิดใช้เมื่อ QUERY_LOG เป็นจริง (อ่านค่าทุก request จึงเปิด/ปิดระหว่างรันได้)"""
+
+    @app.before_request
+    def _start_query_log():
+        if app.config.get("QUERY_LOG"):
+            g.query_log = QueryRecorder()
+
+    @app.after_request
+    def _report_query_log(response):
+        recorder = g.pop("query_log", None)
+        if recorder is not None:
+            report(
+                recorder,
+                request.endpoint or request.path,
+                app.logger,
+                app.config.get("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS),
+                app.config.get("N_PLUS_ONE_THRESHOLD", DEFAULT_N_PLUS_ONE_THRESHOLD),
+            )
+        return response
@@ -0,0 +1,212 @@
+"""
+Reports API
+กำไร/ขาดทุนรายเดือนและรายปี: รายได้รวม, ค่าแรงตัด, รายได้สุทธิ, ค่าปุ๋ย, ต้นทุนต่อกิโลที่ขาย และอัตรากำไร
+อ่านจาก farm_totals (แถวละเดือน) ด้วย query เดียว ตารางนี้ถูกปรับเฉพาะเดือนที่มีการแก้ไข
+เดือนที่ปิดแล้วจึงไม่ต้องรวมจาก harvest_income / fertilizer_records ใหม่ทุกครั้งที่เปิดรายงาน
+ผลผลิตรายต้นและ heatmap ของแปลง (แถว A-L x หมายเลข 1-26) คำนวณใน analytics.py
+การทำนายวันตัดครั้งต่อไปอยู่ใน prediction.py
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import List, Optional, Tuple
+
+from flask import Blueprint, jsonify, render_template, request
+from flask_login import login_required
+
+from intents import to_gregorian
+from models import db
+from palm_registry import PALMS
+from rollups import ALL_PERIOD
+
+reports_bp = Blueprint("reports", __name__)
+
+PNL_COLUMNS = ("total_weight_kg", "gross_amount", "harvesting_wage", "net_amount", "fertilizer_cost")
+
+_MONTH = re.compile(r"^(\d{4})-(\d{2})$")
+
+MONTHS_SQL = (
+    "SELECT period, " + ", ".join(PNL_COLUMNS) + " FROM farm_totals "
+    "WHERE period != :all AND period >= :start AND period <= :end ORDER BY period"
+)
+# ยอดรวมของช่วงเดือน (ใช้กับคำถามในแชต)
+SUM_SQL = (
+    "SELECT " + ", ".join(f"COALESCE(SUM({col}), 0) AS {col}" for col in PNL_COLUMNS) + " FROM farm_totals "
+    "WHERE period != :all AND period >= :start AND period <= :end"
+)
+
+
+@dataclass
+class PnlLine:
+    period: str
+    total_weight_kg: float = 0.0
+    gross_amount: float = 0.0
+    harvesting_wage: float = 0.0
+    net_amount: float = 0.0
+    fertilizer_cost: float = 0.0
+
+    @property
+    def profit(self) -> float:
+        return self.net_amount - self.fertilizer_cost
+
+    @property
+    def cost(self) -> float:
+        return self.harvesting_wage + self.fertilizer_cost
+
+    @property
+    def cost_per_kg(self) -> Optional[float]:
+        """(ค่าแรงตัด + ค่าปุ๋ย) / น้ำหนักที่ขาย; เดือนที่ไม่มีการขายคืน None"""
+        return self.cost / self.total_weight_kg if self.total_weight_kg else None
+
+    @property
+    def margin(self) -> Optional[float]:
+        """กำไร / รายได้รวม (สัดส่วน 0-1); เดือนที่ไม่มีรายได้คืน None"""
+        return self.profit / self.gross_amount if self.gross_amount else None
+
+    @property
+    def empty(self) -> bool:
+        return not any(getattr(self, col) for col in PNL_COLUMNS)
+
+    def add(self, other: "PnlLine"):
+        for col in PNL_COLUMNS:
+            setattr(self, col, getattr(self, col) + getattr(other, col))
+
+    def to_dict(self) -> dict:
+        data = {"period": self.period}
+        data.update({col: round(getattr(self, col), 2) for col in PNL_COLUMNS})
+        data["profit"] = round(self.profit, 2)
+        data["cost_per_kg"] = None if self.cost_per_kg is None else round(self.cost_per_kg, 4)
+        data["margin"] = None if self.margin is None else round(self.margin, 4)
+        return data
+
+
+def period_bounds(year: int, month: Optional[int] = None) -> Tuple[str, str]:
+    """ช่วง period ของทั้งปีหรือเดือนเดียว เช่น (2025, None) -> ('2025-01', '2025-12')"""
+    if month is None:
+        return f"{year:04d}-01", f"{year:04d}-12"
+    return f"{year:04d}-{month:02d}", f"{year:04d}-{month:02d}"
+
+
+def parse_month(value: str) -> str:
+    """'2025-09' -> '2025-09' (ปี พ.ศ. แปลงเป็น ค.ศ.); รูปแบบผิดยก ValueError"""
+    m = _MONTH.match((value or "").strip())
+    if not m or not 1 <= int(m.group(2)) <= 12:
+        raise ValueError(value)
+    return f"{to_gregorian(int(m.group(1))):04d}-{m.group(2)}"
+
+
+def monthly_pnl(start: str = "0000-01", end: str = "9999-12", session=None) -> List[PnlLine]:
+    """แถว P&L รายเดือนในช่วง start..end (รวมปลาย) ข้ามเดือนที่ยอดเป็นศูนย์ทั้งหมด"""
+    session = session or db.session
+    rows = session.execute(db.text(MONTHS_SQL), {"all": ALL_PERIOD, "start": start, "end": end})
+    lines = [PnlLine(*row) for row in rows]
+    return [line for line in lines if not line.empty]
+
+
+def yearly_pnl(months: List[PnlLine]) -> List[PnlLine]:
+    years = {}
+    for line in months:
+        year = line.period[:4]
+        years.setdefault(year, PnlLine(year)).add(line)
+    return [years[y] for y in sorted(years)]
+
+
+def pnl_report(start: str = "0000-01", end: str = "9999-12", session=None) -> dict:
+    months = monthly_pnl(start, end, session)
+    total = PnlLine(ALL_PERIOD)
+    for line in months:
+        total.add(line)
+    return {
+        "months": [line.to_dict() for line in months],
+        "years": [line.to_dict() for line in yearly_pnl(months)],
+        "total": total.to_dict(),
+    }
+
+
+@reports_bp.route("/api/reports/pnl")
+@login_required
+def pnl_api():
+    """?year=2568 หรือ ?from=2025-01&to=2025-06 (ไม่ระบุ = ทุกเดือน)"""
+    start, end = "0000-01", "9999-12"
+    try:
+        if request.args.get("year"):
+            start, end = period_bounds(to_gregorian(int(request.args["year"])))
+        if request.args.get("from"):
+            start = parse_month(request.args["from"])
+        if request.args.get("to"):
+            end = parse_month(request.args["to"])
+    except ValueError:
+        return jsonify({"error": "รูปแบบช่วงเวลาไม่ถูกต้อง (year=2568 หรือ from/to=YYYY-MM)"}), 400
+    if start > end:
+        return jsonify({"error": "เดือนเริ่มต้องไม่เกินเดือนสิ้นสุด"}), 400
+    return jsonify(pnl_report(start, end))
+
+
+@reports_bp.route("/api/reports/palms")
+@login_required
+def palms_api():
+    """ผลผลิตรายต้น/รายแถว: ?since=2025-01-01&until=2025-12-31&window=6"""
+    # NumPy โหลดเมื่อเรียกรายงานนี้ครั้งแรก ไม่ให้การเริ่มแอปช้าลง
+    from analytics import DEFAULT_WINDOW, yield_report
+
+    try:
+        since = date.fromisoformat(request.args["since"]) if request.args.get("since") else None
+        until = date.fromisoformat(request.args["until"]) if request.args.get("until") else None
+        window = int(request.args.get("window") or DEFAULT_WINDOW)
+    except ValueError:
+        return jsonify({"error": "รูปแบบพารามิเตอร์ไม่ถูกต้อง (since/until=YYYY-MM-DD, window=จำนวนครั้ง)"}), 400
+    if window < 1:
+        return jsonify({"error": "window ต้องมากกว่า 0"}), 400
+    return jsonify(yield_report(since, until, window))
+
+
+def _heatmap_args():
+    start = date.fromisoformat(request.args["start"]) if request.args.get("start") else None
+    end = date.fromisoformat(request.args["end"]) if request.args.get("end") else None
+    mode = request.args.get("mode") or "count"
+    return start, end, mode
+
+
+@reports_bp.route("/api/reports/heatmap")
+@login_required
+def heatmap_api():
+    """?start=YYYY-MM-DD&end=YYYY-MM-DD&mode=count|delta (ไม่ระบุช่วง = รอบล่าสุด)"""
+    from analytics import cached_heatmap
+
+    try:
+        data = cached_heatmap(*_heatmap_args())
+    except ValueError:
+        return jsonify({"error": "รูปแบบพารามิเตอร์ไม่ถูกต้อง (start/end=YYYY-MM-DD, start ไม่หลัง end, mode=count|delta)"}), 400
+    return jsonify(data)
+
+
+@reports_bp.route("/harvest/heatmap")
+@login_required
+def heatmap():
+    from analytics import cached_heatmap
+
+    try:
+        data = cached_heatmap(*_heatmap_args())
+    except ValueError:
+        data = cached_heatmap()
+    return render_template(
+        "heatmap.html",
+        data=data,
+        start=date.fromisoformat(data["start"]),
+        end=date.fromisoformat(data["end"]),
+        scale=max(abs(data["min"]), abs(data["max"]), 1),
+    )
+
+
+@reports_bp.route("/api/reports/forecast")
+@login_required
+def forecast_api():
+    """วันตัดครั้งต่อไปและทะลายที่คาดว่าจะได้ของสวนและรายต้น (?palm=A1 เฉพาะต้นเดียว)"""
+    from prediction import cached_farm_forecast
+
+    data = cached_farm_forecast().to_dict()
+    if request.args.get("palm"):
+        palm = PALMS.get(request.args["palm"])
+        data["palms"] = [p for p in data["palms"] if palm and p["code"] == palm.code]
+    return jsonify(data)
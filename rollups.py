@@ -0,0 +1,235 @@
+"""
+Farm totals rollup
+ดูแลตาราง farm_totals (ยอดรวมทั้งหมด + รายเดือน) และ palm_stats (สถิติการตัดรายต้น)
+ให้ตรงกับ ledger แบบเพิ่มทีละส่วน
+ทุกฟังก์ชันทำงานใน session ปัจจุบัน จึง commit พร้อมกับรายการที่แก้ไข (transaction เดียวกัน)
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, FarmTotal, PalmStat
+
+ALL_PERIOD = "all"
+ALL_MONTHS = 0
+
+TOTAL_COLUMNS = (
+    "total_weight_kg", "gross_amount", "harvesting_wage",
+    "net_amount", "fertilizer_cost", "bunch_count",
+)
+
+
+def period_of(d) -> str:
+    return d.strftime("%Y-%m")
+
+
+def income_amounts(row) -> dict:
+    return {
+        "total_weight_kg": row.total_weight_kg or 0,
+        "gross_amount": row.gross_amount or 0,
+        "harvesting_wage": row.harvesting_wage or 0,
+        "net_amount": row.net_amount or 0,
+    }
+
+
+def fertilizer_amounts(row) -> dict:
+    return {"fertilizer_cost": row.total_amount or 0}
+
+
+def harvest_amounts(row) -> dict:
+    return {"bunch_count": row.bunch_count or 0}
+
+
+class TotalsBatch:
+    """รวม delta ของหลายรายการตามเดือน แล้วเขียนลง farm_totals ครั้งเดียว"""
+
+    def __init__(self):
+        self._deltas = defaultdict(lambda: dict.fromkeys(TOTAL_COLUMNS, 0))
+
+    def add(self, d, amounts: dict, sign: int = 1):
+        for period in (ALL_PERIOD, period_of(d)):
+            bucket = self._deltas[period]
+            for col, value in amounts.items():
+                bucket[col] += sign * value
+
+    def __bool__(self):
+        return bool(self._deltas)
+
+    def apply(self, session=None):
+        if not self._deltas:
+            return
+        session = session or db.session
+        rows = [{"period": period, **amounts} for period, amounts in self._deltas.items()]
+        stmt = insert(FarmTotal)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FarmTotal.period],
+            set_={col: getattr(FarmTotal, col) + getattr(stmt.excluded, col) for col in TOTAL_COLUMNS},
+        )
+        # executemany: 1 แถวต่อ period (ยอดรวมทั้งหมด + แต่ละเดือนที่ถูกแก้ไข)
+        session.execute(stmt, rows)
+        self._deltas.clear()
+
+
+class PalmStatsBatch:
+    """รวม delta ของบันทึกการตัดตาม (ต้น, เดือน) แล้วเขียนลง palm_stats ครั้งเดียว"""
+
+    def __init__(self):
+        self._deltas = {}  # (palm_id, month) -> [harvests, bunches, first_date, last_date]
+
+    def add(self, palm_id, d, bunch_count, sign: int = 1):
+        count = bunch_count or 0
+        hit = 1 if count > 0 else 0
+        for month in (ALL_MONTHS, d.month):
+            delta = self._deltas.setdefault((palm_id, month), [0, 0, None, None])
+            delta[0] += sign * hit
+            delta[1] += sign * count
+            # วันแรก/วันล่าสุดเก็บเฉพาะ month = 0 และขยายได้อย่างเดียว (การลบต้องอ่านใหม่: refresh_palm_dates)
+            if month == ALL_MONTHS and hit and sign > 0:
+                delta[2] = d if delta[2] is None else min(delta[2], d)
+                delta[3] = d if delta[3] is None else max(delta[3], d)
+
+    def __bool__(self):
+        return bool(self._deltas)
+
+    def apply(self, session=None):
+        if not self._deltas:
+            return
+        session = session or db.session
+        rows = [
+            {"palm_id": palm_id, "month": month, "harvests": harvests, "bunches": bunches,
+             "first_date": first, "last_date": last}
+            for (palm_id, month), (harvests, bunches, first, last) in self._deltas.items()
+        ]
+        # ใช้ Table ตรงๆ: bulk insert ของ ORM แยก statement ตามคอลัมน์ที่เป็น NULL (first_date/last_date)
+        stmt = insert(PalmStat.__table__)
+        new = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PalmStat.palm_id, PalmStat.month],
+            set_={
+                "harvests": PalmStat.harvests + new.harvests,
+                "bunches": PalmStat.bunches + new.bunches,
+                # min()/max() แบบ 2 อาร์กิวเมนต์ของ SQLite คืน NULL ถ้ามีฝั่งหนึ่งเป็น NULL
+                "first_date": func.coalesce(func.min(PalmStat.first_date, new.first_date),
+                                            PalmStat.first_date, new.first_date),
+                "last_date": func.coalesce(func.max(PalmStat.last_date, new.last_date),
+                                           PalmStat.last_date, new.last_date),
+            },
+        )
+        session.execute(stmt, rows)
+        self._deltas.clear()
+
+
+REFRESH_DATES_SQL = """
+UPDATE palm_stats SET
+    first_date = (SELECT MIN(date) FROM harvest_details
+                  WHERE palm_id = :palm_id AND bunch_count > 0 AND id != :exclude_id),
+    last_date = (SELECT MAX(date) FROM harvest_details
+                 WHERE palm_id = :palm_id AND bunch_count > 0 AND id != :exclude_id)
+WHERE palm_id = :palm_id AND month = 0
+"""
+
+
+def refresh_palm_dates(palm_id, exclude_id, session=None):
+    """อ่านวันแรก/วันล่าสุดของต้นเดียวใหม่ (index palm_id, date) โดยไม่นับแถวที่กำลังลบหรือแก้ไข"""
+    session = session or db.session
+    session.execute(db.text(REFRESH_DATES_SQL), {"palm_id": palm_id, "exclude_id": exclude_id})
+
+
+def _track(d, amounts, sign, session):
+    batch = TotalsBatch()
+    batch.add(d, amounts, sign)
+    batch.apply(session)
+
+
+def track_income(row, sign=1, session=None):
+    _track(row.date, income_amounts(row), sign, session)
+
+
+def track_fertilizer(row, sign=1, session=None):
+    _track(row.date, fertilizer_amounts(row), sign, session)
+
+
+def track_harvest(row, sign=1, session=None):
+    _track(row.date, harvest_amounts(row), sign, session)
+    palm_stats = PalmStatsBatch()
+    palm_stats.add(row.palm_id, row.date, row.bunch_count, sign)
+    palm_stats.apply(session)
+    if sign < 0 and row.id is not None:
+        refresh_palm_dates(row.palm_id, row.id, session)
+
+
+REBUILD_SQL = """
+INSERT INTO farm_totals (period, total_weight_kg, gross_amount, harvesting_wage,
+                         net_amount, fertilizer_cost, bunch_count)
+SELECT period, SUM(w), SUM(g), SUM(hw), SUM(n), SUM(f), SUM(b) FROM (
+    SELECT strftime('%Y-%m', date) AS period, total_weight_kg AS w, gross_amount AS g,
+           harvesting_wage AS hw, net_amount AS n, 0 AS f, 0 AS b
+    FROM harvest_income
+    UNION ALL
+    SELECT strftime('%Y-%m', date), 0, 0, 0, 0, total_amount, 0 FROM fertilizer_records
+    UNION ALL
+    SELECT strftime('%Y-%m', date), 0, 0, 0, 0, 0, bunch_count FROM harvest_details
+)
+GROUP BY period
+"""
+
+REBUILD_ALL_SQL = """
+INSERT INTO farm_totals (period, total_weight_kg, gross_amount, harvesting_wage,
+                         net_amount, fertilizer_cost, bunch_count)
+SELECT :all_period, COALESCE(SUM(total_weight_kg), 0), COALESCE(SUM(gross_amount), 0),
+       COALESCE(SUM(harvesting_wage), 0), COALESCE(SUM(net_amount), 0),
+       COALESCE(SUM(fertilizer_cost), 0), COALESCE(SUM(bunch_count), 0)
+FROM farm_totals
+"""
+
+
+def rebuild_farm_totals(session=None) -> int:
+    """คำนวณ farm_totals ใหม่ทั้งหมดจาก ledger (ใช้ซ่อมเมื่อข้อมูลไม่ตรง) คืนจำนวนเดือน"""
+    session = session or db.session
+    session.execute(db.delete(FarmTotal))
+    session.execute(db.text(REBUILD_SQL))
+    months = session.query(FarmTotal).count()
+    session.execute(db.text(REBUILD_ALL_SQL), {"all_period": ALL_PERIOD})
+    session.commit()
+    return months
+
+
+def ensure_farm_totals(session=None):
+    """สร้าง farm_totals ครั้งแรกสำหรับฐานข้อมูลเดิมที่ยังไม่มี rollup"""
+    session = session or db.session
+    if session.get(FarmTotal, ALL_PERIOD) is None:
+        rebuild_farm_totals(session)
+
+
+REBUILD_PALM_STATS_SQL = """
+INSERT INTO palm_stats (palm_id, month, harvests, bunches, first_date, last_date)
+SELECT palm_id, 0, SUM(bunch_count > 0), COALESCE(SUM(bunch_count), 0),
+       MIN(CASE WHEN bunch_count > 0 THEN date END), MAX(CASE WHEN bunch_count > 0 THEN date END)
+FROM harvest_details GROUP BY palm_id
+UNION ALL
+SELECT palm_id, CAST(strftime('%m', date) AS INTEGER), SUM(bunch_count > 0), COALESCE(SUM(bunch_count), 0),
+       NULL, NULL
+FROM harvest_details GROUP BY palm_id, strftime('%m', date)
+"""
+
+
+def rebuild_palm_stats(session=None) -> int:
+    """คำนวณ palm_stats ใหม่ทั้งหมดจาก harvest_details คืนจำนวนต้นที่มีบันทึก"""
+    session = session or db.session
+    session.execute(db.delete(PalmStat))
+    session.execute(db.text(REBUILD_PALM_STATS_SQL))
+    palms = session.query(PalmStat).filter(PalmStat.month == ALL_MONTHS).count()
+    session.commit()
+    return palms
+
+
+def ensure_palm_stats(session=None):
+    """สร้าง palm_stats ครั้งแรกสำหรับฐานข้อมูลเดิมที่มีบันทึกการตัดแล้ว"""
+    session = session or db.session
+    missing = session.execute(db.text(
+        "SELECT EXISTS (SELECT 1 FROM harvest_details) AND NOT EXISTS (SELECT 1 FROM palm_stats)"
+    )).scalar()
+    if missing:
+        rebuild_palm_stats(session)
@@ -0,0 +1,142 @@
+"""
+Schema migration
+เพิ่ม index และคอลัมน์ที่ประกาศใน models.py ให้ฐานข้อมูลเดิม (SQLite/Turso) แบบรันซ้ำได้
+และเตรียมฐานข้อมูล (ตาราง, index, ต้นปาล์ม, farm_totals) ครั้งเดียวต่อ schema version
+ตอนเริ่มแอปจึงเหลือแค่ SELECT เดียวเพื่อเทียบ version แทน create_all ทุกครั้ง
+"""
+
+import hashlib
+import threading
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+from models import db, AppMeta, Palm
+
+SCHEMA_VERSION_KEY = "schema_version"
+PALM_ROWS = "ABCDEFGHIJKL"
+PALMS_PER_ROW = 26
+
+# ฐานข้อมูลที่ตรวจแล้วใน process นี้ (url -> version)
+_checked = {}
+_checked_lock = threading.Lock()
+
+
+def declared_indexes():
+    """index ทั้งหมดที่ประกาศไว้ใน models.py"""
+    for table in db.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            yield index
+
+
+def ensure_indexes(engine=None) -> list:
+    """สร้าง index ที่ยังไม่มีด้วย CREATE INDEX IF NOT EXISTS คืนชื่อ index ที่ตรวจสอบแล้ว"""
+    engine = engine or db.engine
+    names = []
+    with engine.begin() as conn:
+        for index in declared_indexes():
+            conn.execute(CreateIndex(index, if_not_exists=True))
+            names.append(index.name)
+    return names
+
+
+def ensure_columns(engine=None) -> list:
+    """
+    เพิ่มคอลัมน์ที่ประกาศใน models.py แต่ยังไม่มีในตารางเดิม (ALTER TABLE ... ADD COLUMN)
+    ใช้ได้กับคอลัมน์ที่เป็น NULL ได้เท่านั้น คืนชื่อ "ตาราง.คอลัมน์" ที่เพิ่ม
+    """
+    engine = engine or db.engine
+    added = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def schema_version() -> str:
+    """ลายนิ้วมือของ models.py: ตาราง, คอลัมน์, ชนิด และ index (เปลี่ยนเมื่อแก้ models)"""
+    parts = []
+    for table in db.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f"{c.name}:{c.type}:{c.nullable}" for c in table.columns)
+        parts.extend(sorted(ix.name for ix in table.indexes))
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:12]
+
+
+def stored_schema_version(engine=None):
+    """version ที่บันทึกไว้ในฐานข้อมูล หรือ None (ยังไม่เคย init หรือยังไม่มีตาราง app_meta)"""
+    engine = engine or db.engine
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                db.select(AppMeta.value).where(AppMeta.key == SCHEMA_VERSION_KEY)
+            ).scalar()
+    except DBAPIError:
+        return None
+
+
+def seed_palms(session=None) -> int:
+    """สร้างต้นปาล์ม A1-L26 ด้วย INSERT เดียวถ้ายังไม่มี คืนจำนวนที่สร้าง"""
+    from palm_registry import PALMS
+
+    session = session or db.session
+    if session.execute(db.select(Palm.id).limit(1)).first() is not None:
+        return 0
+    rows = [{"code": f"{row}{n}"} for row in PALM_ROWS for n in range(1, PALMS_PER_ROW + 1)]
+    session.execute(db.insert(Palm.__table__).values(rows))
+    PALMS.invalidate()
+    return len(rows)
+
+
+def init_database(session=None) -> dict:
+    """
+    เตรียมฐานข้อมูลทั้งหมดแบบรันซ้ำได้ แล้วบันทึก schema version
+    ใช้ผ่าน `flask --app app:create_app init-db` หรือเรียกอัตโนมัติเมื่อ version ไม่ตรง
+    """
+    from anomaly import ensure_anomaly_stats
+    from rollups import ensure_farm_totals, ensure_palm_stats
+
+    session = session or db.session
+    db.create_all()
+    # create_all ไม่เพิ่มคอลัมน์/index ให้ตารางที่มีอยู่แล้ว
+    ensure_columns()
+    indexes = ensure_indexes()
+    palms = seed_palms(session)
+    # สร้าง farm_totals / palm_stats / anomaly_stats สำหรับฐานข้อมูลเดิมที่ยังไม่มี rollup
+    ensure_farm_totals(session)
+    ensure_palm_stats(session)
+    ensure_anomaly_stats(session)
+    version = schema_version()
+    session.merge(AppMeta(key=SCHEMA_VERSION_KEY, value=version))
+    session.commit()
+    with _checked_lock:
+        _checked[str(db.engine.url)] = version
+    return {"version": version, "indexes": len(indexes), "palms_created": palms}
+
+
+def ensure_schema() -> bool:
+    """
+    ตรวจ schema ครั้งเดียวต่อ process ต่อฐานข้อมูล: version ตรงแล้วไม่ทำอะไร (SELECT เดียว)
+    คืน True ถ้าต้อง init ฐานข้อมูล
+    """
+    url = str(db.engine.url)
+    version = schema_version()
+    if _checked.get(url) == version:
+        return False
+    if stored_schema_version() == version:
+        with _checked_lock:
+            _checked[url] = version
+        return False
+    init_database()
+    return True
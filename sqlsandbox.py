@@ -0,0 +1,247 @@
+"""
+Sandbox สำหรับรัน SQL ที่โมเดลสร้าง
+- ตรวจด้วย tokenizer ของ SQLite: ต้องเป็น SELECT/WITH คำสั่งเดียว ไม่มีคำสั่งเขียนหรือคำสั่งจัดการฐานข้อมูล
+- ห้ามอ้างถึงตารางที่มีคอลัมน์ลับ (users) ตั้งแต่ตรวจ SQL เพราะ libsql (Turso) ไม่มี authorizer
+- รันบน connection แบบอ่านอย่างเดียว (mode=ro หรือ PRAGMA query_only) พร้อม authorizer ของ SQLite
+- จำกัดเวลาด้วย progress handler; driver ที่ไม่มี (libsql) รันใน thread แยกแล้วรอไม่เกินเวลาที่กำหนด
+- จำกัดจำนวนแถวด้วย LIMIT ครอบ query เดิม
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+DEFAULT_TIMEOUT_MS = 2000
+DEFAULT_MAX_ROWS = 500
+# progress handler ถูกเรียกทุกกี่ VM instruction
+PROGRESS_STEPS = 10_000
+
+# keyword ที่ห้ามปรากฏเป็น token (ไม่นับในสตริงหรือชื่อที่อยู่ในเครื่องหมายคำพูด)
+FORBIDDEN_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "ATTACH", "DETACH", "PRAGMA",
+    "VACUUM", "REINDEX", "ANALYZE", "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE",
+    "TRANSACTION", "UPSERT",
+}
+FORBIDDEN_FUNCTIONS = {"load_extension", "readfile", "writefile", "fts3_tokenizer"}
+# คอลัมน์ที่ไม่ให้โมเดลอ่าน (authorizer คืน NULL แทน) และตารางของคอลัมน์เหล่านี้ที่ check_sql ไม่ยอมให้อ้างถึงเลย
+HIDDEN_COLUMNS = {("users", "password_hash")}
+HIDDEN_TABLES = {table for table, _ in HIDDEN_COLUMNS}
+# driver ที่มี set_authorizer / set_progress_handler
+HOOK_DRIVERS = {"pysqlite"}
+# query ที่เกินเวลาบน driver ที่ไม่มี progress handler หยุดไม่ได้: จำกัดจำนวนที่ค้างรันอยู่พร้อมกัน
+MAX_DETACHED_QUERIES = 2
+_detached_slots = threading.BoundedSemaphore(MAX_DETACHED_QUERIES)
+
+
+class UnsafeSQL(ValueError):
+    """SQL ไม่ผ่านการตรวจ (ข้อความแสดงให้ผู้ใช้เห็น)"""
+
+
+class QueryTimeout(RuntimeError):
+    """SQL ใช้เวลานานเกินกำหนด"""
+
+
+@dataclass
+class Token:
+    kind: str   # word, string, quoted, number, op, semicolon
+    text: str
+
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<line_comment>--[^\n]*)
+  | (?P<block_comment>/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:[^']|'')*'?)
+  | (?P<quoted>"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|0[xX][0-9a-fA-F]+)
+  | (?P<word>[A-Za-z_\u0080-\uffff][A-Za-z0-9_$\u0080-\uffff]*)
+  | (?P<param>[?:@$][A-Za-z0-9_]*)
+  | (?P<semicolon>;)
+  | (?P<op>\|\||<<|>>|<=|>=|==|!=|<>|->>|->|[-+*/%<>=~&|(),.])
+""", re.VERBOSE | re.DOTALL)
+
+
+def tokenize(sql: str) -> List[Token]:
+    """แยก token ตามกติกาของ SQLite โดยตัดช่องว่างและ comment ทิ้ง"""
+    tokens = []
+    pos = 0
+    while pos < len(sql):
+        m = _TOKEN.match(sql, pos)
+        if not m:
+            raise UnsafeSQL(f"SQL มีอักขระที่อ่านไม่ได้: {sql[pos:pos + 10]!r}")
+        kind = m.lastgroup
+        text = m.group()
+        pos = m.end()
+        if kind in ("space", "line_comment", "block_comment"):
+            continue
+        if kind in ("string", "quoted") and (len(text) < 2 or text[-1] not in "'\"`]"):
+            raise UnsafeSQL("SQL มีสตริงที่ไม่ได้ปิดเครื่องหมายคำพูด")
+        tokens.append(Token(kind, text))
+    return tokens
+
+
+def check_sql(sql: str) -> str:
+    """
+    ตรวจว่าเป็น SELECT (หรือ WITH ... SELECT) คำสั่งเดียว คืน SQL ที่ตัด ; ท้ายแล้ว
+    raise UnsafeSQL ถ้าไม่ผ่าน
+    """
+    tokens = tokenize(sql)
+    while tokens and tokens[-1].kind == "semicolon":
+        tokens.pop()
+    if not tokens:
+        raise UnsafeSQL("SQL ว่าง")
+    if any(t.kind == "semicolon" for t in tokens):
+        raise UnsafeSQL("อนุญาตให้รัน SQL ได้ครั้งละคำสั่งเดียว")
+    if tokens[0].kind != "word" or tokens[0].text.upper() not in ("SELECT", "WITH"):
+        raise UnsafeSQL("SQL ต้องเริ่มต้นด้วย SELECT")
+    if any(t.kind == "param" for t in tokens):
+        raise UnsafeSQL("SQL ต้องไม่มี parameter")
+
+    for i, token in enumerate(tokens):
+        if token.kind == "quoted" and token.text[1:-1].lower() in HIDDEN_TABLES:
+            raise UnsafeSQL(f"SQL อ่านตาราง {token.text[1:-1]} ซึ่งไม่อนุญาต")
+        if token.kind != "word":
+            continue
+        if token.text.lower() in HIDDEN_TABLES:
+            raise UnsafeSQL(f"SQL อ่านตาราง {token.text} ซึ่งไม่อนุญาต")
+        upper = token.text.upper()
+        if upper in FORBIDDEN_KEYWORDS:
+            raise UnsafeSQL(f"SQL มีคำสั่ง {upper} ซึ่งไม่อนุญาต")
+        followed_by_paren = i + 1 < len(tokens) and tokens[i + 1].text == "("
+        if upper == "REPLACE" and not followed_by_paren:
+            # REPLACE INTO ...; replace(x, y, z) ที่เป็นฟังก์ชันใช้ได้
+            raise UnsafeSQL("SQL มีคำสั่ง REPLACE ซึ่งไม่อนุญาต")
+        if token.text.lower() in FORBIDDEN_FUNCTIONS and followed_by_paren:
+            raise UnsafeSQL(f"SQL เรียกฟังก์ชัน {token.text} ซึ่งไม่อนุญาต")
+
+    return sql.strip().rstrip(";").rstrip()
+
+
+def _authorizer(action, arg1, arg2, db_name, source):
+    """ด่านสุดท้ายใน SQLite เอง: อนุญาตเฉพาะการอ่าน"""
+    if action == sqlite3.SQLITE_READ:
+        return sqlite3.SQLITE_IGNORE if (arg1, arg2) in HIDDEN_COLUMNS else sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_FUNCTION:
+        return sqlite3.SQLITE_DENY if (arg2 or "").lower() in FORBIDDEN_FUNCTIONS else sqlite3.SQLITE_OK
+    if action in (sqlite3.SQLITE_SELECT, getattr(sqlite3, "SQLITE_RECURSIVE", -1)):
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def open_readonly(engine):
+    """
+    คืน (connection, release) แบบอ่านอย่างเดียว
+    ไฟล์ SQLite ในเครื่องเปิดใหม่ด้วย mode=ro; แบบอื่น (เช่น Turso) ยืม connection จาก pool แล้วเปิด query_only
+    """
+    url = engine.url
+    if url.drivername in ("sqlite", "sqlite+pysqlite") and url.database and url.database != ":memory:":
+        conn = sqlite3.connect(f"{Path(url.database).resolve().as_uri()}?mode=ro", uri=True)
+        return conn, conn.close
+
+    raw = engine.raw_connection()
+    conn = raw.driver_connection
+    conn.execute("PRAGMA query_only = ON")
+
+    def release():
+        try:
+            conn.execute("PRAGMA query_only = OFF")
+        finally:
+            raw.close()
+
+    return conn, release
+
+
+@dataclass
+class SandboxResult:
+    columns: List[str]
+    rows: List[list]
+    truncated: bool = False
+
+
+def _timeout_error(timeout_ms):
+    return QueryTimeout(f"คำสั่ง SQL ใช้เวลานานเกิน {timeout_ms / 1000:g} วินาที")
+
+
+def _fetch(conn, sql):
+    cursor = conn.execute(sql)
+    return [d[0] for d in cursor.description], [list(r) for r in cursor.fetchall()]
+
+
+def _run_with_hooks(engine, sql, timeout_ms):
+    """SQLite ของ Python: authorizer + progress handler หยุดคำสั่งที่เกินเวลาได้ทันที"""
+    conn, release = open_readonly(engine)
+    deadline = time.monotonic() + timeout_ms / 1000
+    timed_out = []
+
+    def progress():
+        if time.monotonic() > deadline:
+            timed_out.append(True)
+            return 1  # ให้ SQLite หยุดคำสั่ง
+        return 0
+
+    try:
+        conn.set_authorizer(_authorizer)
+        conn.set_progress_handler(progress, PROGRESS_STEPS)
+        try:
+            return _fetch(conn, sql)
+        except sqlite3.DatabaseError as e:
+            if timed_out:
+                raise _timeout_error(timeout_ms) from e
+            if "not authorized" in str(e):
+                raise UnsafeSQL("SQL พยายามทำสิ่งที่ไม่ใช่การอ่านข้อมูล") from e
+            raise
+    finally:
+        conn.set_progress_handler(None, 0)
+        conn.set_authorizer(None)
+        release()
+
+
+def _run_with_deadline(engine, sql, timeout_ms):
+    """
+    driver ที่ไม่มี progress handler (libsql): เปิด connection และรันใน thread แยก แล้วรอไม่เกิน timeout_ms
+    ถ้าเกินเวลาจะตอบ QueryTimeout ทันที ส่วน thread ปล่อย connection เองเมื่อคำสั่งจบ
+    """
+    if not _detached_slots.acquire(timeout=timeout_ms / 1000):
+        # query ที่เกินเวลาก่อนหน้ายังรันค้างอยู่เต็มจำนวน
+        raise _timeout_error(timeout_ms)
+    outcome = {}
+    done = threading.Event()
+
+    def work():
+        try:
+            conn, release = open_readonly(engine)
+            try:
+                outcome["value"] = _fetch(conn, sql)
+            finally:
+                release()
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+            _detached_slots.release()
+
+    threading.Thread(target=work, name="sqlsandbox", daemon=True).start()
+    if not done.wait(timeout_ms / 1000):
+        raise _timeout_error(timeout_ms)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+def run_readonly(engine, sql, max_rows=DEFAULT_MAX_ROWS, timeout_ms=DEFAULT_TIMEOUT_MS) -> SandboxResult:
+    """รัน SQL ที่ผ่าน check_sql บน connection อ่านอย่างเดียว ได้ไม่เกิน max_rows แถวภายใน timeout_ms"""
+    sql = check_sql(sql)
+    # ดึงเกินหนึ่งแถวเพื่อรู้ว่าถูกตัดหรือไม่
+    wrapped = f"SELECT * FROM ({sql}\n) LIMIT {int(max_rows) + 1}"
+
+    if engine.url.get_driver_name() in HOOK_DRIVERS:
+        columns, rows = _run_with_hooks(engine, wrapped, timeout_ms)
+    else:
+        columns, rows = _run_with_deadline(engine, wrapped, timeout_ms)
+
+    truncated = len(rows) > max_rows
+    return SandboxResult(columns, rows[:max_rows], truncated)
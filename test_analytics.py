@@ -0,0 +1,152 @@
+"""
+ทดสอบ analytics ผลผลิตรายต้นแบบ vectorized, heatmap ของแปลง และ /api/reports/palms, /api/reports/heatmap
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from ai import bump_data_version
+from analytics import (
+    HEATMAP_CACHE, cached_heatmap, compute_yield_stats, heatmap_range, load_harvests, rolling_mean,
+    yield_heatmap, yield_report,
+)
+from models import db, HarvestDetail
+from palm_registry import PALMS
+
+START = date(2025, 1, 1)
+
+
+def _add(code, round_no, bunches):
+    db.session.add(HarvestDetail(date=START + timedelta(days=15 * round_no),
+                                 palm_id=PALMS.get(code).id, bunch_count=bunches))
+
+
+@pytest.fixture(autouse=True)
+def clear_heatmap_cache():
+    HEATMAP_CACHE.clear()
+    yield
+    HEATMAP_CACHE.clear()
+
+
+@pytest.fixture
+def harvests(app):
+    # 5 รอบ: A1 ได้ทุกรอบ, A2 ได้รอบแรกแล้วหยุด (บันทึก 0 รอบ 1-2, ไม่บันทึกรอบ 3-4),
+    # B1 เริ่มรอบ 2 และเว้นรอบ 3, A3 ไม่เคยได้ทะลาย
+    for r, n in enumerate([2, 4, 3, 5, 6]):
+        _add("A1", r, n)
+    _add("A2", 0, 3)
+    _add("A2", 1, 0)
+    _add("A2", 2, 0)
+    _add("B1", 2, 1)
+    _add("B1", 4, 5)
+    _add("A3", 3, 0)
+    db.session.commit()
+
+
+def test_rolling_mean_restarts_per_group():
+    values = np.array([2, 4, 6, 10, 20])
+    groups = np.array([0, 0, 0, 1, 1])
+    assert rolling_mean(values, groups, 2).tolist() == [2, 3, 5, 10, 15]
+
+
+def test_per_palm_stats(harvests):
+    stats = compute_yield_stats(load_harvests(), window=3)
+    i = {p.code: n for n, p in enumerate(stats.palms)}
+
+    assert stats.round_totals.tolist() == [5, 4, 4, 5, 11]
+    assert stats.totals[i["A1"]] == 20 and stats.harvests[i["A1"]] == 5
+    assert stats.recent_average[i["A1"]] == pytest.approx((3 + 5 + 6) / 3)
+    assert stats.mean_interval[i["A1"]] == 15
+    assert stats.mean_interval[i["B1"]] == 30
+    assert np.isnan(stats.mean_interval[i["A2"]])
+
+    assert stats.current_zero_streak[i["A1"]] == 0
+    assert stats.current_zero_streak[i["A2"]] == 4
+    assert stats.current_zero_streak[i["B1"]] == 0
+    assert stats.longest_zero_streak[i["B1"]] == 1
+    assert stats.current_zero_streak[i["A3"]] == 2        # นับตั้งแต่บันทึกแรก
+    assert stats.current_zero_streak[i["C1"]] == 5        # ไม่มีบันทึกเลย
+    assert sorted(stats.intervals.tolist()) == [15, 15, 15, 15, 30]
+
+
+def test_report_rows_and_intervals(harvests, statements):
+    PALMS.all()
+    statements.clear()
+    report = yield_report(window=3)
+    assert len(statements) == 1
+
+    rows = {r["row"]: r for r in report["rows"]}
+    assert len(rows) == 12
+    assert rows["A"]["total_bunches"] == 23 and rows["A"]["palms"] == 26
+    assert rows["B"]["total_bunches"] == 6
+
+    a1 = report["palms"][0]
+    assert a1["code"] == "A1" and a1["last_harvest"] == "2025-03-02"
+    assert report["intervals"]["median"] == 15
+    assert {"days": "13-17", "count": 4} in report["intervals"]["histogram"]
+    assert report["rounds"][-1] == {"date": "2025-03-02", "bunches": 11, "rolling": pytest.approx(20 / 3, abs=0.01)}
+
+
+def test_palms_api(client, harvests):
+    data = client.get("/api/reports/palms?since=2025-01-31").get_json()
+    assert [r["date"] for r in data["rounds"]] == ["2025-01-31", "2025-02-15", "2025-03-02"]
+    assert client.get("/api/reports/palms?window=0").status_code == 400
+    assert client.get("/api/reports/palms?since=31/01/2025").status_code == 400
+
+
+def test_empty_history(app):
+    report = yield_report()
+    assert report["rounds"] == [] and report["intervals"]["median"] is None
+    assert len(report["palms"]) == 312
+
+
+def test_heatmap_grid_and_delta(harvests, statements):
+    # รอบสุดท้าย (2025-03-02) เทียบกับรอบก่อน (2025-02-15)
+    start, end = heatmap_range()
+    assert (start, end) == (date(2025, 2, 16), date(2025, 3, 2))
+
+    statements.clear()
+    grid = yield_heatmap(start, end)
+    assert len(statements) == 1
+    assert grid["rows"] == list("ABCDEFGHIJKL") and grid["columns"] == 26
+    assert len(grid["values"]) == 12 and all(len(line) == 26 for line in grid["values"])
+    assert grid["values"][0][0] == 6 and grid["values"][1][0] == 5
+    assert grid["total"] == 11 and grid["previous_total"] == 5
+    assert grid["weakest"][0]["value"] == 0
+
+    delta = yield_heatmap(start, end, mode="delta")
+    assert delta["values"][0][0] == 6 - 5      # A1
+    assert delta["values"][1][0] == 5          # B1 (รอบก่อนไม่ได้)
+    assert delta["values"][0][2] == 0          # A3 (บันทึก 0 ทะลาย)
+    assert delta["max"] == 5
+
+
+def test_heatmap_is_cached_per_range_until_harvests_change(harvests, statements):
+    first = cached_heatmap(date(2025, 1, 1), date(2025, 1, 31))
+    # ได้สำเนาทั้งก้อน: แก้ไขแล้วไม่กระทบค่าใน cache
+    first["values"][0][0] = -1
+    first["weakest"].clear()
+    first.pop("total")
+    statements.clear()
+    again = cached_heatmap(date(2025, 1, 1), date(2025, 1, 31))
+    assert again["values"][0][0] != -1 and again["weakest"] and "total" in again
+    assert statements == []
+
+    _add("C5", 1, 4)
+    db.session.commit()
+    bump_data_version("harvest_details")
+    assert cached_heatmap(date(2025, 1, 1), date(2025, 1, 31))["values"][2][4] == 4
+
+
+def test_heatmap_api_and_page(client, harvests):
+    data = client.get("/api/reports/heatmap?start=2025-01-01&end=2025-03-02").get_json()
+    assert data["values"][0][0] == 20 and "sql" not in data
+    assert client.get("/api/reports/heatmap?mode=ratio").status_code == 400
+    assert client.get("/api/reports/heatmap?start=2025-03-01&end=2025-01-01").status_code == 400
+    # end ค่าเริ่มต้นคือวันที่มีบันทึกล่าสุด (2025-03-02): start หลังจากนั้นเป็นช่วงติดลบ
+    assert client.get("/api/reports/heatmap?start=2025-04-01").status_code == 400
+
+    page = client.get("/harvest/heatmap?mode=delta").get_data(as_text=True)
+    assert "Heatmap" in page and 'title="A1: +1 ทะลาย"' in page
@@ -0,0 +1,199 @@
+"""
+ทดสอบการตรวจค่าผิดปกติแบบ Welford ตอนบันทึก/บันทึกทั้งรอบ/นำเข้า CSV และหน้าตรวจสอบ
+"""
+
+import csv
+import io
+import statistics
+from datetime import date, timedelta
+
+import pytest
+
+from anomaly import RunningStats, rebuild_anomaly_stats
+from imports import HARVEST_IMPORT, INCOME_IMPORT, run_import
+from models import db, Anomaly, AnomalyStat, HarvestDetail, HarvestIncome
+from palm_registry import PALMS
+
+START = date(2025, 1, 1)
+# /income/new บันทึกเป็นวันนี้เสมอ: ประวัติราคาจึงอยู่ในเดือนเดียวกับวันนี้ของปีก่อนๆ
+MONTH = date.today().month
+
+
+def _stat(series, key):
+    db.session.expire_all()
+    return db.session.get(AnomalyStat, (series, key))
+
+
+@pytest.fixture
+def history(app):
+    # A1 ได้ 7-9 ทะลายทุก 15 วัน, เดือนนี้ของปีก่อนๆ ขายได้ราคา 5.8-6.2 บาท/กก. น้ำหนัก 1,400-1,600 กก.
+    a1 = PALMS.get("A1").id
+    for i in range(10):
+        db.session.add(HarvestDetail(date=START + timedelta(days=15 * i), palm_id=a1, bunch_count=7 + i % 3))
+    for i, (price, weight) in enumerate([(5.8, 1400), (6.0, 1500), (6.2, 1600), (6.0, 1450), (5.9, 1550), (6.1, 1500)]):
+        db.session.add(HarvestIncome(date=date(2024 - i // 2, MONTH, 1 + 15 * (i % 2)), total_weight_kg=weight,
+                                     price_per_kg=price, gross_amount=price * weight, harvesting_wage=0,
+                                     net_amount=price * weight))
+    db.session.commit()
+    rebuild_anomaly_stats()
+
+
+def test_running_stats_matches_statistics():
+    values = [7, 8, 9, 7, 8, 9, 12]
+    stats = RunningStats()
+    for v in values:
+        stats.add(v)
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.std == pytest.approx(statistics.stdev(values))
+
+
+def test_harvest_typo_is_flagged_and_not_learned(client, history):
+    before = _stat("bunches", PALMS.get("A1").id).count
+    resp = client.post("/harvest/new", data={"date": "2025-06-01", "palm_code": "A1", "bunch_count": 80},
+                       follow_redirects=True)
+    assert "A1: จำนวนทะลาย 80 ผิดปกติ" in resp.get_data(as_text=True)
+
+    anomaly = Anomaly.query.one()
+    row = HarvestDetail.query.filter_by(bunch_count=80).one()
+    assert anomaly.record_id == row.id and anomaly.status == "pending" and anomaly.score > 4
+    assert _stat("bunches", PALMS.get("A1").id).count == before
+
+    client.post("/harvest/new", data={"date": "2025-06-16", "palm_code": "A1", "bunch_count": 9})
+    assert Anomaly.query.count() == 1
+    assert _stat("bunches", PALMS.get("A1").id).count == before + 1
+
+
+def test_price_off_by_ten_either_way(client, history):
+    def sell(price):
+        return client.post("/income/new", data={"total_weight_kg": 1500, "price_per_kg": price,
+                                                "gross_amount": 1500 * price, "harvesting_wage": 1})
+
+    sell(60)
+    sell(0.6)
+    sell(6.3)
+    flagged = [(a.field, a.value) for a in Anomaly.query.order_by(Anomaly.id)]
+    assert flagged == [("price_per_kg", 60), ("price_per_kg", 0.6)]
+    assert _stat("price", MONTH).count == 7
+
+
+def test_edit_resolves_pending_and_learns_fixed_value(client, history):
+    client.post("/harvest/new", data={"date": "2025-06-01", "palm_code": "A1", "bunch_count": 80})
+    row = HarvestDetail.query.filter_by(bunch_count=80).one()
+    before = _stat("bunches", PALMS.get("A1").id).count
+
+    client.post(f"/harvest/edit/{row.id}", data={"date": "2025-06-01", "palm_code": "A1", "bunch_count": 8})
+    assert Anomaly.query.count() == 0
+    assert _stat("bunches", PALMS.get("A1").id).count == before + 1
+
+    # แก้รายการที่รวมในสถิติแล้ว: ไม่นับซ้ำ
+    client.post(f"/harvest/edit/{row.id}", data={"date": "2025-06-01", "palm_code": "A1", "bunch_count": 9})
+    assert _stat("bunches", PALMS.get("A1").id).count == before + 1
+
+    client.post(f"/harvest/edit/{row.id}", data={"date": "2025-06-01", "palm_code": "A1", "bunch_count": 90})
+    assert Anomaly.query.count() == 1
+    client.post(f"/harvest/delete/{row.id}")
+    assert Anomaly.query.count() == 0
+
+
+def test_edit_learns_only_fields_that_were_pending(client, history):
+    # ราคาผิดปกติแต่น้ำหนักปกติ: น้ำหนักถูกรวมในสถิติตั้งแต่ตอนบันทึก
+    client.post("/income/new", data={"total_weight_kg": 1500, "price_per_kg": 60,
+                                     "gross_amount": 90000, "harvesting_wage": 1})
+    row = HarvestIncome.query.filter_by(price_per_kg=60).one()
+    price, weight = _stat("price", MONTH).count, _stat("weight", MONTH).count
+
+    client.post(f"/income/edit/{row.id}", data={"date": row.date.isoformat(), "total_weight_kg": 1520,
+                                                "price_per_kg": 6, "gross_amount": 9120, "harvesting_wage": 1})
+    assert Anomaly.query.count() == 0
+    assert _stat("price", MONTH).count == price + 1
+    assert _stat("weight", MONTH).count == weight
+
+
+def test_edit_learns_value_that_was_skipped(client, history):
+    # 0 ทะลาย (รอบพักจากการบันทึกทั้งรอบ/นำเข้า) ไม่ถูกรวมในสถิติ: แก้เป็นค่าจริงแล้วต้องรวม
+    row = HarvestDetail(date=date(2025, 6, 1), palm_id=PALMS.get("A1").id, bunch_count=0)
+    db.session.add(row)
+    db.session.commit()
+    before = _stat("bunches", PALMS.get("A1").id).count
+
+    client.post(f"/harvest/edit/{row.id}", data={"date": "2025-06-01", "palm_code": "A1", "bunch_count": 8})
+    assert _stat("bunches", PALMS.get("A1").id).count == before + 1
+
+
+def test_batch_round_flags_per_palm(client, history):
+    resp = client.post("/harvest/batch", data={"date": "2025-06-01", "bunch_A1": "85", "bunch_A2": "40"},
+                       follow_redirects=True)
+    assert "A1: จำนวนทะลาย 85 ผิดปกติ" in resp.get_data(as_text=True)
+    # A2 ยังไม่มีประวัติพอ: ไม่ตรวจ แต่เริ่มเก็บสถิติ
+    anomaly = Anomaly.query.one()
+    assert anomaly.source == "batch" and anomaly.record_id is None
+    assert _stat("bunches", PALMS.get("A2").id).count == 1
+
+    client.post(f"/harvest/delete/{HarvestDetail.query.filter_by(bunch_count=85).one().id}")
+    assert Anomaly.query.count() == 0
+
+
+def test_import_is_constant_work_per_row(app, history, statements):
+    lines = ["date,palm_code,bunch_count"]
+    lines += [f"2025-0{m}-0{d},{code},8" for m in range(6, 10) for d in range(1, 4) for code in ("A1", "B1", "C1")]
+    lines.append("2025-09-20,A1,88")
+    statements.clear()
+    result = run_import(HARVEST_IMPORT, csv.DictReader(io.StringIO("\n".join(lines))))
+    db.session.commit()
+
+    assert result.count == 37 and result.flagged == 1
+    touching = [s for s in statements if "anomaly_stats" in s]
+    assert len(touching) == 2  # SELECT ครั้งเดียว + upsert ครั้งเดียว ไม่ว่ามีกี่แถว
+    assert Anomaly.query.one().source == "import"
+    assert _stat("bunches", PALMS.get("B1").id).count == 12
+
+
+def test_unlinked_income_rows_on_same_date_are_matched_by_value(client, history):
+    day = date(2025, MONTH, 10).isoformat()
+    lines = ["date,total_weight_kg,price_per_kg,gross_amount,harvesting_wage",
+             f"{day},1500,60,90000,0", f"{day},1500,6,9000,0"]
+    run_import(INCOME_IMPORT, csv.DictReader(io.StringIO("\n".join(lines))))
+    db.session.commit()
+    typo, normal = HarvestIncome.query.filter_by(date=date(2025, MONTH, 10)).order_by(HarvestIncome.price_per_kg.desc())
+    assert Anomaly.query.one().record_id is None
+    before = _stat("price", MONTH).count
+
+    # แก้/ลบแถวปกติที่วันเดียวกัน: ไม่ลบค่าผิดปกติของอีกแถว และไม่นับค่าซ้ำในสถิติ
+    client.post(f"/income/edit/{normal.id}", data={"date": day, "total_weight_kg": 1500, "price_per_kg": 6.1,
+                                                   "gross_amount": 9150, "harvesting_wage": 0})
+    assert Anomaly.query.count() == 1
+    assert _stat("price", MONTH).count == before
+    client.post(f"/income/delete/{normal.id}")
+    assert Anomaly.query.count() == 1
+
+    client.post(f"/income/delete/{typo.id}")
+    assert Anomaly.query.count() == 0
+
+
+def test_review_queue_accept_and_dismiss(client, history):
+    client.post("/income/new", data={"total_weight_kg": 1500, "price_per_kg": 60,
+                                     "gross_amount": 90000, "harvesting_wage": 1})
+    client.post("/harvest/new", data={"date": "2025-06-01", "palm_code": "A1", "bunch_count": 80})
+    page = client.get("/anomalies").get_data(as_text=True)
+    assert "ต้น A1: จำนวนทะลาย" in page and "ราคาต่อกก." in page
+
+    price, bunches = Anomaly.query.order_by(Anomaly.id).all()
+    client.post(f"/anomalies/{price.id}/accept")
+    client.post(f"/anomalies/{bunches.id}/dismiss")
+    db.session.expire_all()
+    assert (price.status, bunches.status) == ("accepted", "dismissed")
+    assert _stat("price", MONTH).count == 7
+    assert "ไม่มีรายการ" in client.get("/anomalies").get_data(as_text=True)
+    assert "ต้น A1" in client.get("/anomalies?status=dismissed").get_data(as_text=True)
+
+
+def test_rebuild_skips_pending_values(client, history):
+    client.post("/harvest/new", data={"date": "2025-06-01", "palm_code": "A1", "bunch_count": 80})
+    client.post("/harvest/new", data={"date": "2025-06-16", "palm_code": "A1", "bunch_count": 9})
+    incremental = _stat("bunches", PALMS.get("A1").id)
+    expected = (incremental.count, incremental.mean, incremental.m2)
+
+    rebuild_anomaly_stats()
+    rebuilt = _stat("bunches", PALMS.get("A1").id)
+    assert rebuilt.count == expected[0]
+    assert (rebuilt.mean, rebuilt.m2) == pytest.approx(expected[1:])
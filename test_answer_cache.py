@@ -0,0 +1,98 @@
+"""
+ทดสอบ cache คำตอบของ AI chat
+"""
+
+from datetime import date
+
+import pytest
+
+import datacache
+from ai import ANSWER_CACHE, AnswerCache, bump_data_version, normalize_question, tables_in_sql
+
+QUESTION = "ราคาปาล์มเฉลี่ยเดือนนี้เท่าไหร่"
+PAYLOAD = {
+    "sql": "SELECT AVG(price_per_kg) FROM harvest_income WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now')",
+    "columns": ["avg"],
+    "rows": [[8.5]],
+    "answer": "ราคาเฉลี่ย 8.50 บาท/กก.",
+}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    ANSWER_CACHE.clear()
+    yield
+    ANSWER_CACHE.clear()
+
+
+def test_normalize_question():
+    assert normalize_question("  ราคาปาล์มเฉลี่ย   เดือนนี้เท่าไหร่ครับ?? ") == "ราคาปาล์มเฉลี่ย เดือนนี้เท่าไหร่"
+    assert normalize_question("Income THIS month?") == normalize_question("income this month")
+    assert normalize_question("ครับ") == "ครับ"
+
+
+def test_tables_in_sql():
+    sql = "SELECT p.code FROM harvest_details hd JOIN palms p ON hd.palm_id = p.id"
+    assert tables_in_sql(sql) == ("harvest_details", "palms")
+    assert tables_in_sql("") == ()
+
+
+def test_entry_expires_when_a_read_table_changes():
+    cache = AnswerCache()
+    key = AnswerCache.key(QUESTION)
+    cache.put(key, PAYLOAD)
+    assert cache.get(key) == PAYLOAD
+
+    bump_data_version("notes")  # ตารางที่ไม่เกี่ยวข้อง
+    assert cache.get(key) == PAYLOAD
+
+    bump_data_version("harvest_income")
+    assert cache.get(key) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_data_cache_uses_explicit_tables():
+    cache = datacache.DataCache()
+    cache.put("heatmap", {"total": 1}, {"harvest_details"})
+    bump_data_version("harvest_income")
+    assert cache.get("heatmap") == {"total": 1}
+    bump_data_version("harvest_details")
+    assert cache.get("heatmap") is None
+
+
+def test_ttl_and_lru(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(datacache.time, "monotonic", lambda: clock[0])
+    cache = AnswerCache(maxsize=2, ttl=60)
+    a, b, c = (AnswerCache.key(q) for q in ("ก", "ข", "ค"))
+    cache.put(a, {"answer": "1"})
+    cache.put(b, {"answer": "2"})
+    cache.get(a)                    # a ถูกใช้ล่าสุด
+    cache.put(c, {"answer": "3"})   # b ถูกไล่ออก
+    assert cache.get(b) is None
+    assert cache.get(a) == {"answer": "1"}
+
+    clock[0] += 61
+    assert cache.get(a) is None
+    # รายการที่หมด TTL ยังใช้เป็นคำตอบสำรองได้เมื่อ Gemini ถูกจำกัดการเรียก
+    assert cache.get(a, allow_stale=True) == {"answer": "1"}
+    assert len(cache) == 2
+
+
+def test_key_changes_with_the_day():
+    assert AnswerCache.key(QUESTION, date(2025, 9, 30)) != AnswerCache.key(QUESTION, date(2025, 10, 1))
+
+
+def test_chat_serves_cached_answer_until_a_write(client, app):
+    app.config["GOOGLE_API_KEY"] = ""
+    ANSWER_CACHE.put(AnswerCache.key(QUESTION), PAYLOAD)
+
+    data = client.post("/api/chat", json={"message": QUESTION + "ครับ"}).get_json()
+    assert data["cached"] is True
+    assert data["answer"] == PAYLOAD["answer"]
+
+    client.post("/income/new", data={"date": "2025-09-01", "total_weight_kg": 1000, "price_per_kg": 9,
+                                     "gross_amount": 9000, "harvesting_wage": 500})
+    data = client.post("/api/chat", json={"message": QUESTION}).get_json()
+    assert "cached" not in data
+    assert "ยังไม่ได้ตั้งค่า Google API Key" in data["answer"]
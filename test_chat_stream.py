@@ -0,0 +1,111 @@
+"""
+ทดสอบ /api/chat/stream (server-sent events)
+"""
+
+import json
+from datetime import date
+
+import google.generativeai as genai
+import pytest
+
+from ai import ANSWER_CACHE
+from gemini_client import reset_client
+from models import db, HarvestIncome
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    ANSWER_CACHE.clear()
+    yield
+    ANSWER_CACHE.clear()
+
+
+def _events(resp):
+    events = []
+    for block in resp.get_data(as_text=True).strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class FakeModel:
+    """แทน GenerativeModel: คำตอบแรกเป็น JSON ที่มี SQL คำตอบที่สองส่งทีละส่วน"""
+
+    def __init__(self, name):
+        pass
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        if "summary_hint" in prompt:
+            return type("Resp", (), {"text": json.dumps({
+                "sql": "SELECT date, net_amount FROM harvest_income ORDER BY date",
+                "summary_hint": "สรุปรายได้",
+            })})()
+        pieces = ["รายได้สุทธิ ", "7,500 ", "บาท"]
+        chunks = [type("Chunk", (), {"text": p})() for p in pieces]
+        return iter(chunks) if stream else type("Resp", (), {"text": "".join(pieces)})()
+
+
+@pytest.fixture
+def gemini(app, monkeypatch):
+    app.config["GOOGLE_API_KEY"] = "test-key"
+    monkeypatch.setattr(genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(genai, "GenerativeModel", FakeModel)
+    db.session.add(HarvestIncome(date=date(2025, 9, 1), total_weight_kg=1000, price_per_kg=8,
+                                 gross_amount=8000, harvesting_wage=500, net_amount=7500))
+    db.session.commit()
+
+
+def test_stream_emits_phases_in_order(client, gemini):
+    resp = client.post("/api/chat/stream", json={"message": "สรุปรายได้ให้หน่อย"})
+    assert resp.mimetype == "text/event-stream"
+    events = _events(resp)
+
+    assert [e for e, _ in events] == ["sql", "table", "token", "token", "token", "answer"]
+    assert events[1][1] == {"columns": ["date", "net_amount"], "rows": [["2025-09-01", 7500.0]], "truncated": False}
+    assert "".join(d["text"] for e, d in events if e == "token") == "รายได้สุทธิ 7,500 บาท"
+    assert events[-1][1]["answer"] == "รายได้สุทธิ 7,500 บาท"
+
+
+def test_stream_and_json_endpoints_agree(client, gemini):
+    streamed = _events(client.post("/api/chat/stream", json={"message": "สรุปรายได้"}))[-1][1]
+    ANSWER_CACHE.clear()
+    plain = client.post("/api/chat", json={"message": "สรุปรายได้"}).get_json()
+    assert plain == streamed
+
+
+def test_local_intent_streams_without_tokens(client):
+    events = _events(client.post("/api/chat/stream", json={"message": "ตัดทะลายไปทั้งหมดกี่ทะลาย"}))
+    assert [e for e, _ in events] == ["sql", "table", "answer"]
+    assert events[-1][1]["intent"] == "total_bunches"
+
+
+def test_empty_message_is_rejected(client):
+    resp = client.post("/api/chat/stream", json={"message": " "})
+    assert resp.status_code == 400
+
+
+class CutOffModel(FakeModel):
+    """สรุปแบบ stream ขาดกลางทางหลังส่งไปแล้วหนึ่งส่วน"""
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        if "summary_hint" in prompt or not stream:
+            return super().generate_content(prompt, stream, request_options)
+
+        def pieces():
+            yield type("Chunk", (), {"text": "รายได้สุทธิ "})()
+            raise ConnectionError("stream reset")
+        return pieces()
+
+
+def test_failed_summary_is_not_cached(client, gemini, monkeypatch):
+    monkeypatch.setattr(genai, "GenerativeModel", CutOffModel)
+    events = _events(client.post("/api/chat/stream", json={"message": "สรุปรายได้"}))
+    assert events[-1][1]["answer"].startswith("สรุปรายได้")
+    assert "ไม่สามารถสร้างสรุปอัตโนมัติได้" in events[-1][1]["answer"]
+    assert len(ANSWER_CACHE) == 0
+
+    monkeypatch.setattr(genai, "GenerativeModel", FakeModel)
+    reset_client()
+    events = _events(client.post("/api/chat/stream", json={"message": "สรุปรายได้"}))
+    assert events[-1][1]["answer"] == "รายได้สุทธิ 7,500 บาท"
+    assert len(ANSWER_CACHE) == 1
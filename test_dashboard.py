@@ -0,0 +1,54 @@
+"""
+ทดสอบ dashboard summary service
+"""
+
+from datetime import date
+
+from dashboard import load_dashboard_summary
+from models import db, HarvestIncome, FertilizerRecord, HarvestDetail, Note, Palm
+from rollups import rebuild_farm_totals
+
+
+def _seed():
+    palm = Palm.query.filter_by(code="A1").first()
+    for day in range(1, 6):
+        db.session.add(HarvestIncome(date=date(2025, 9, day), total_weight_kg=100, price_per_kg=8,
+                                     gross_amount=800, harvesting_wage=100, net_amount=700))
+        db.session.add(FertilizerRecord(date=date(2025, 9, day), item=f"ปุ๋ย {day}", sacks=1,
+                                        unit_price=500, spreading_wage=0, total_amount=500))
+        db.session.add(HarvestDetail(date=date(2025, 9, day), palm_id=palm.id, bunch_count=2))
+        db.session.add(Note(date=date(2025, 9, day), title=f"โน้ต {day}", content="-"))
+    db.session.commit()
+    rebuild_farm_totals()
+
+
+def test_summary_totals_and_recent(app):
+    _seed()
+    summary = load_dashboard_summary()
+
+    assert summary.total_income == 3500
+    assert summary.total_fertilizer_cost == 2500
+    assert summary.total_harvest_count == 10
+    assert summary.total_palms == 312
+    assert [r.date.day for r in summary.recent_income] == [5, 4, 3]
+    assert summary.recent_fertilizer[0].label == "ปุ๋ย 5"
+    assert summary.recent_harvest[0].label == "A1"
+    assert summary.recent_notes[0].label == "โน้ต 5"
+
+
+def test_summary_is_single_round_trip(app, statements):
+    _seed()
+    db.session.commit()
+    statements.clear()
+
+    load_dashboard_summary()
+
+    assert len(statements) == 1
+
+
+def test_summary_on_empty_database(app):
+    summary = load_dashboard_summary()
+
+    assert summary.total_income == 0
+    assert summary.total_harvest_count == 0
+    assert summary.recent_income == []
@@ -0,0 +1,54 @@
+"""
+ทดสอบ streaming CSV export
+"""
+
+import codecs
+import csv
+import io
+from datetime import date
+
+from exports import content_disposition, iter_csv
+from models import db, HarvestIncome, HarvestDetail, Palm
+
+
+def test_iter_csv_emits_bom_once_in_small_chunks():
+    rows = ({"n": i, "t": "ทดสอบ"} for i in range(2000))
+    chunks = list(iter_csv(["n", "t"], rows, lambda r: [r["n"], r["t"]], chunk_size=1024))
+
+    body = b"".join(chunks)
+    assert chunks[0] == codecs.BOM_UTF8
+    assert body.count(codecs.BOM_UTF8) == 1
+    # chunk_size นับเป็นตัวอักษร (ภาษาไทย 3 bytes ต่อตัว) จึงต้องมีหลายก้อนและแต่ละก้อนมีขนาดจำกัด
+    assert len(chunks) > 10
+    assert max(len(c) for c in chunks) < 4 * 1024
+    parsed = list(csv.reader(io.StringIO(body.decode("utf-8-sig"))))
+    assert parsed[0] == ["n", "t"]
+    assert parsed[-1] == ["1999", "ทดสอบ"]
+
+
+def test_export_routes_stream_all_rows(client):
+    palm = Palm.query.filter_by(code="B2").first()
+    db.session.add(HarvestIncome(date=date(2025, 9, 1), total_weight_kg=1000, price_per_kg=8,
+                                 gross_amount=8000, harvesting_wage=500, net_amount=7500, note="ขายรอบแรก"))
+    db.session.add(HarvestDetail(date=date(2025, 9, 1), palm_id=palm.id, bunch_count=3))
+    db.session.commit()
+
+    resp = client.get("/income/export")
+    assert resp.is_streamed
+    assert resp.headers["Content-Disposition"] == 'attachment; filename="harvest_income.csv"'
+    text = resp.get_data().decode("utf-8-sig")
+    assert "2025-09-01,1000.0,8.0,8000.0,500.0,7500.0,ขายรอบแรก" in text
+
+    text = client.get("/harvest/export").get_data().decode("utf-8-sig")
+    assert text.splitlines()[1].endswith("2025-09-01,B2,3,")
+
+    for path in ("/fertilizer/export", "/notes/export"):
+        assert client.get(path).status_code == 200
+
+
+def test_content_disposition_quotes_and_encodes_filenames():
+    assert content_disposition('a"b.csv') == 'attachment; filename="a\\"b.csv"'
+    assert content_disposition("รายได้ 2568.csv") == (
+        'attachment; filename="2568.csv"; '
+        "filename*=UTF-8''%E0%B8%A3%E0%B8%B2%E0%B8%A2%E0%B9%84%E0%B8%94%E0%B9%89%202568.csv"
+    )
@@ -0,0 +1,222 @@
+"""
+ทดสอบ gemini_client กับเซิร์ฟเวอร์ Gemini ปลอมในเครื่อง (REST transport)
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import google.generativeai as genai
+import pytest
+
+from ai import ANSWER_CACHE, AnswerCache
+from gemini_client import CircuitBreaker, GeminiAuthError, GeminiClient, GeminiError, GeminiThrottled
+
+
+def _reply(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}]}
+
+
+class FakeGemini:
+    """ตอบตามลำดับใน script: int = HTTP error, str = ข้อความ; หมด script แล้วตอบ default"""
+
+    def __init__(self):
+        self.script = []
+        self.default = "สวัสดี"
+        self.paths = []
+        self.lock = threading.Lock()
+
+    def next(self, path):
+        with self.lock:
+            self.paths.append(path)
+            return self.script.pop(0) if self.script else self.default
+
+
+@pytest.fixture
+def fake_gemini():
+    fake = FakeGemini()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            step = fake.next(self.path)
+            code = step if isinstance(step, int) else 200
+            if isinstance(step, int):
+                status = {400: "INVALID_ARGUMENT", 429: "RESOURCE_EXHAUSTED", 503: "UNAVAILABLE"}[step]
+                message = "API key not valid. Please pass a valid API key." if step == 400 else status
+                body = {"error": {"code": step, "message": message, "status": status}}
+            elif "streamGenerateContent" in self.path:
+                body = [_reply(piece) for piece in step.split("|")]
+            else:
+                body = _reply(step)
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    fake.endpoint = f"http://127.0.0.1:{server.server_port}"
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _client(fake, **kwargs):
+    kwargs.setdefault("sleep", lambda seconds: None)
+    return GeminiClient("test-key", api_endpoint=fake.endpoint, transport="rest", **kwargs)
+
+
+def test_generate_and_stream(fake_gemini):
+    client = _client(fake_gemini)
+    assert client.generate("สวัสดี") == "สวัสดี"
+
+    fake_gemini.script = ["รายได้ |7,500 |บาท"]
+    assert list(client.generate("สรุป", stream=True)) == ["รายได้ ", "7,500 ", "บาท"]
+    assert "streamGenerateContent" in fake_gemini.paths[-1]
+
+
+def test_retries_transient_errors_with_backoff(fake_gemini):
+    delays = []
+    client = _client(fake_gemini, sleep=delays.append, base_delay=1.0)
+    fake_gemini.script = [503, 503, "ได้แล้ว"]
+
+    assert client.generate("x") == "ได้แล้ว"
+    assert len(fake_gemini.paths) == 3
+    # backoff เพิ่มเป็นเท่าตัว (มี jitter 50-100%)
+    assert 0.5 <= delays[0] <= 1.0 and 1.0 <= delays[1] <= 2.0
+    assert client.breaker.state == "closed"
+
+
+def test_gives_up_after_max_retries(fake_gemini):
+    client = _client(fake_gemini, max_retries=1, breaker=CircuitBreaker(threshold=10))
+    fake_gemini.script = [503, 503, 503]
+    with pytest.raises(GeminiError):
+        client.generate("x")
+    assert len(fake_gemini.paths) == 2
+
+
+def test_quota_error_opens_breaker_and_fails_fast(fake_gemini):
+    clock = FakeClock()
+    client = _client(fake_gemini, clock=clock, breaker=CircuitBreaker(cooldown=30, clock=clock))
+    fake_gemini.script = [429]
+
+    with pytest.raises(GeminiThrottled):
+        client.generate("x")
+    with pytest.raises(GeminiThrottled) as excinfo:
+        client.generate("x")
+    assert len(fake_gemini.paths) == 1  # ครั้งที่สองไม่ถึงเซิร์ฟเวอร์
+    assert excinfo.value.retry_after == pytest.approx(30)
+
+    clock.now += 31
+    assert client.breaker.state == "half-open"
+    assert client.generate("x") == "สวัสดี"
+    assert client.breaker.state == "closed"
+
+
+def test_half_open_breaker_allows_one_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker(cooldown=30, clock=clock)
+    breaker.failure(open_now=True)
+    clock.now += 31
+
+    assert breaker.check() is True
+    # คำขออื่นระหว่าง probe ยังถูกปฏิเสธ
+    with pytest.raises(GeminiThrottled):
+        breaker.check()
+
+    breaker.failure()
+    assert breaker.state == "open"
+    clock.now += 31
+    assert breaker.check() is True
+    breaker.success()
+    assert breaker.state == "closed" and breaker.check() is False
+
+
+def test_stream_failure_after_first_chunk_reaches_breaker(fake_gemini):
+    client = _client(fake_gemini, breaker=CircuitBreaker(threshold=1))
+
+    class Chunk:
+        text = "รายได้ "
+
+    def broken():
+        yield Chunk()
+        raise ConnectionError("stream reset")
+
+    stream = client._iter_text(Chunk(), broken())
+    with pytest.raises(ConnectionError):
+        list(stream)
+    assert client.breaker.state == "open"
+
+
+def test_token_bucket_limits_rate(fake_gemini):
+    clock = FakeClock()
+    waits = []
+    client = _client(fake_gemini, rate_per_minute=2, max_wait=10, clock=clock, sleep=waits.append)
+
+    client.generate("1")
+    client.generate("2")
+    with pytest.raises(GeminiThrottled):
+        client.generate("3")  # ต้องรอ 30 วินาที เกิน max_wait
+    assert len(fake_gemini.paths) == 2
+
+    clock.now += 25  # เหลือรออีก 5 วินาที อยู่ใน max_wait
+    client.generate("4")
+    assert waits == [pytest.approx(5)]
+
+
+def test_invalid_key_is_not_retried(fake_gemini):
+    client = _client(fake_gemini)
+    fake_gemini.script = [400]
+    with pytest.raises(GeminiAuthError):
+        client.generate("x")
+    assert len(fake_gemini.paths) == 1
+
+
+def test_chat_reuses_one_client(app, client, fake_gemini, monkeypatch):
+    configured = []
+    real_configure = genai.configure
+    monkeypatch.setattr(genai, "configure",
+                        lambda **kwargs: configured.append(kwargs) or real_configure(**kwargs))
+    app.config.update(GOOGLE_API_KEY="test-key", GEMINI_API_ENDPOINT=fake_gemini.endpoint, GEMINI_TRANSPORT="rest")
+    fake_gemini.default = json.dumps({"sql": "", "summary_hint": "ไม่เกี่ยวกับฐานข้อมูล"})
+    ANSWER_CACHE.clear()
+
+    for question in ("อากาศวันนี้เป็นอย่างไร", "ปาล์มต้องการน้ำเท่าไร"):
+        assert client.post("/api/chat", json={"message": question}).get_json()["answer"] == "ไม่เกี่ยวกับฐานข้อมูล"
+    assert len(configured) == 1
+    assert len(fake_gemini.paths) == 2
+
+
+def test_chat_serves_stale_answer_while_throttled(app, client, fake_gemini):
+    app.config.update(GOOGLE_API_KEY="test-key", GEMINI_API_ENDPOINT=fake_gemini.endpoint, GEMINI_TRANSPORT="rest")
+    ANSWER_CACHE.clear()
+    ANSWER_CACHE.configure(ttl=-1)  # ทุกรายการหมดอายุทันที
+    try:
+        question = "ปาล์มต้องการน้ำเท่าไร"
+        ANSWER_CACHE.put(AnswerCache.key(question), {"sql": "", "columns": [], "rows": [], "answer": "คำตอบเดิม"})
+        fake_gemini.script = [429]
+
+        data = client.post("/api/chat", json={"message": question}).get_json()
+        assert data["answer"] == "คำตอบเดิม" and data["stale"] is True
+
+        # คำถามที่ไม่มีใน cache ได้ข้อความแจ้งโควต้าทันที โดยไม่เรียก API อีก
+        data = client.post("/api/chat", json={"message": "คำถามใหม่"}).get_json()
+        assert data["answer"].startswith("⏰")
+        assert len(fake_gemini.paths) == 1
+    finally:
+        ANSWER_CACHE.configure(ttl=app.config["CHAT_CACHE_TTL"])
+        ANSWER_CACHE.clear()
@@ -0,0 +1,52 @@
+"""
+ทดสอบการบันทึกการเก็บเกี่ยวทั้งรอบ (/harvest/batch)
+"""
+
+from datetime import date
+
+from models import db, FarmTotal, HarvestDetail, Palm
+from querylog import query_budget
+
+
+def _full_round():
+    codes = [f"{row}{num}" for row in "ABCDEFGHIJKL" for num in range(1, 27)]
+    return {f"bunch_{code}": str(i % 4) for i, code in enumerate(codes)}
+
+
+def test_full_round_in_one_request(client):
+    data = {"date": "2025-09-15", "remarks": "รอบกลางเดือน", **_full_round()}
+    with query_budget(8) as recorder:
+        resp = client.post("/harvest/batch", data=data)
+    assert resp.status_code == 302
+    inserts = [q for q in recorder.queries if q.statement.startswith("INSERT INTO harvest_details")]
+    assert len(inserts) == 1 and not inserts[0].executemany
+
+    rows = HarvestDetail.query.all()
+    assert len(rows) == 312
+    assert {r.date for r in rows} == {date(2025, 9, 15)}
+    assert {r.remarks for r in rows} == {"รอบกลางเดือน"}
+    assert all(r.created_at is not None for r in rows)
+    expected = sum(i % 4 for i in range(312))
+    assert db.session.get(FarmTotal, "2025-09").bunch_count == expected
+    assert db.session.get(FarmTotal, "all").bunch_count == expected
+
+
+def test_blank_cells_are_skipped(client):
+    resp = client.post("/harvest/batch", data={"date": "2025-09-15", "bunch_A1": "3", "bunch_A2": "", "bunch_B7": "0"})
+    assert resp.status_code == 302
+    saved = {db.session.get(Palm, r.palm_id).code: r.bunch_count for r in HarvestDetail.query.all()}
+    assert saved == {"A1": 3, "B7": 0}
+
+
+def test_invalid_cell_rejects_the_whole_round(client):
+    resp = client.post("/harvest/batch", data={"date": "2025-09-15", "bunch_A1": "3", "bunch_A2": "-1", "bunch_Z9": "2"})
+    assert resp.status_code == 200
+    page = resp.get_data(as_text=True)
+    assert "ไม่พบต้นปาล์มรหัส Z9" in page and "A2: จำนวนทะลาย" in page
+    assert 'name="bunch_A1" min="0" step="1" inputmode="numeric" value="3"' in page
+    assert HarvestDetail.query.count() == 0
+
+
+def test_grid_renders_every_palm(client):
+    page = client.get("/harvest/batch").get_data(as_text=True)
+    assert page.count('type="number" name="bunch_') == 312
@@ -0,0 +1,89 @@
+"""
+ทดสอบ CSV import pipeline ด้วยไฟล์ตัวอย่างใน repo
+"""
+
+import codecs
+import csv
+import io
+from pathlib import Path
+
+from jobs import wait_for
+from imports import HARVEST_IMPORT, FERTILIZER_IMPORT, HeaderMap, open_csv, run_import, sniff_encoding
+from models import db, FarmTotal, FertilizerRecord, HarvestDetail, HarvestIncome, Note
+
+HERE = Path(__file__).parent
+
+
+def _post_file(client, path, data, name):
+    """อัปโหลดแล้วรอ import job ที่ได้จนเสร็จ"""
+    resp = client.post(path, data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+    wait_for(int(resp.headers["Location"].rsplit("/", 1)[1]), timeout=30)
+    db.session.expire_all()
+    return resp
+
+
+def _upload(client, path, name):
+    return _post_file(client, path, (HERE / name).read_bytes(), name)
+
+
+def test_sample_files_import_through_routes(client):
+    _upload(client, "/income/import", "test_income.csv")
+    _upload(client, "/fertilizer/import", "test_fertilizer.csv")
+    _upload(client, "/harvest/import", "test_harvest.csv")
+    _upload(client, "/notes/import", "test_notes.csv")
+
+    assert HarvestIncome.query.count() == 2
+    assert FertilizerRecord.query.count() == 2
+    assert HarvestDetail.query.count() == 3
+    assert Note.query.count() == 2
+    assert db.session.get(FarmTotal, "2024-01").bunch_count == 9
+    assert db.session.get(FarmTotal, "2024-01").fertilizer_cost == 10 * 450 + 100 + 5 * 380 + 50
+
+
+def test_header_aliases_resolved_once_and_fall_through_empty_values():
+    header = HeaderMap(["Date", "date", "Type"], {"date": ("date", "Date"), "item": ("item", "Type")})
+    assert header.columns == {"date": ["date", "Date"], "item": ["Type"]}
+    assert header.get({"date": "", "Date": "2025-01-01"}, "date") == "2025-01-01"
+
+
+def test_row_errors_are_collected_and_valid_rows_kept(app):
+    text = "date,palm_code,bunch_count\n2025-09-01,A1,2\nbad-date,A2,1\n2025-09-01,Z99,1\n15/09/2025,A3,4\n"
+    result = run_import(HARVEST_IMPORT, csv.DictReader(io.StringIO(text)), chunk_size=1)
+    db.session.commit()
+
+    assert result.count == 2
+    assert result.errors == ["แถว 2: รูปแบบวันที่ไม่ถูกต้อง (bad-date)", "แถว 3: ไม่พบต้นปาล์มรหัส Z99"]
+    assert sorted(h.bunch_count for h in HarvestDetail.query) == [2, 4]
+
+
+def test_exported_fertilizer_cost_becomes_unit_price(app):
+    text = "ID,Date,Type,Amount,Cost,Notes\n1,2025-09-01,ปุ๋ย,4,2000,\n"
+    run_import(FERTILIZER_IMPORT, csv.DictReader(io.StringIO(text)))
+    row = FertilizerRecord.query.one()
+    assert (row.sacks, row.unit_price, row.total_amount) == (4, 500, 2000)
+
+
+def test_sniff_encoding_reads_only_a_prefix():
+    thai = "วันที่,หัวข้อ\n2025-09-01,ตรวจสวน\n"
+    assert sniff_encoding(io.BytesIO(codecs.BOM_UTF8 + thai.encode("utf-8"))) == "utf-8-sig"
+    assert sniff_encoding(io.BytesIO(thai.encode("utf-8"))) == "utf-8"
+    assert sniff_encoding(io.BytesIO(thai.encode("tis-620"))) == "tis-620"
+
+    # ตัดกลางตัวอักษรไทย (3 bytes) ตรงขอบ prefix ต้องยังเดาเป็น utf-8
+    data = ("ก" * 100).encode("utf-8")
+    stream = io.BytesIO(data)
+    assert sniff_encoding(stream, prefix_size=31) == "utf-8"
+    assert stream.tell() == 0
+
+
+def test_tis620_upload_is_decoded_in_one_pass(client):
+    text = "date,title,content\n2025-09-01,ตรวจสวน,ต้นปาล์มสภาพดี\n"
+    _post_file(client, "/notes/import", text.encode("tis-620"), "n.csv")
+    assert Note.query.one().content == "ต้นปาล์มสภาพดี"
+
+
+def test_open_csv_leaves_upload_stream_open():
+    stream = io.BytesIO("date,title\n2025-09-01,a\n".encode("utf-8"))
+    with open_csv(stream) as reader:
+        assert [r["title"] for r in reader] == ["a"]
+    assert not stream.closed
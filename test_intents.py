@@ -0,0 +1,107 @@
+"""
+ทดสอบ intent router ภาษาไทยที่ตอบคำถามพบบ่อยโดยไม่เรียก Gemini
+"""
+
+from datetime import date
+
+import pytest
+
+from intents import Period, answer_locally, match_intent, parse_period
+from models import db, FertilizerRecord, HarvestDetail, HarvestIncome, Palm
+
+TODAY = date(2025, 9, 20)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("รายได้เดือนกันยายน 2568", Period(2025, 9)),
+    ("รายได้เดือนกันยายน 2025", Period(2025, 9)),
+    ("ทะลาย 15 กันยายน", Period(None, 9, 15)),
+    ("ทะลายวันที่ 15 ก.ย. 2568", Period(2025, 9, 15)),
+    ("ค่าปุ๋ยปี 2567", Period(2024)),
+    ("ทะลายวันที่ 15", Period(None, None, 15)),
+    ("รายได้ 15/09/2568", Period(2025, 9, 15)),
+    ("รายได้ 2025-09-15", Period(2025, 9, 15)),
+    ("รายได้เดือนนี้", Period(2025, 9)),
+    ("รายได้เดือนที่แล้ว", Period(2025, 8)),
+    ("รายได้ปีที่แล้ว", Period(2024)),
+    ("ทะลายทั้งหมด", Period()),
+])
+def test_parse_period(text, expected):
+    assert parse_period(text, TODAY) == expected
+
+
+def test_invalid_dates_are_not_guessed():
+    assert parse_period("รายได้ 31 กุมภาพันธ์", TODAY) is None
+    assert match_intent("รายได้ 31/02/2568 เท่าไหร่", TODAY) is None
+
+
+def test_period_with_year_uses_date_range():
+    sql, params = Period(2025, 12).where()
+    assert sql == "date >= :start AND date < :end"
+    assert params == {"start": "2025-12-01", "end": "2026-01-01"}
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("ตัดทะลายไปทั้งหมดกี่ทะลาย", "total_bunches"),
+    ("รายได้เดือนกันยายน 2568 เท่าไหร่", "income"),
+    ("ค่าปุ๋ยปีนี้รวมเท่าไร", "fertilizer_cost"),
+    ("ตัดปาล์มครั้งต่อไปเมื่อไหร่", "next_harvest"),
+    ("เปรียบเทียบรายได้ปีนี้กับปีที่แล้ว", None),
+    ("ต้นปาล์มไหนให้ผลผลิตดีที่สุด", None),
+    ("สวัสดี", None),
+    ("test", None),
+])
+def test_match_intent(message, intent):
+    matched = match_intent(message, TODAY)
+    assert (matched.name if matched else None) == intent
+
+
+@pytest.fixture
+def ledger(app):
+    a1 = Palm.query.filter_by(code="A1").one()
+    b2 = Palm.query.filter_by(code="B2").one()
+    db.session.add_all([
+        HarvestIncome(date=date(2025, 9, 1), total_weight_kg=1000, price_per_kg=8, gross_amount=8000,
+                      harvesting_wage=500, net_amount=7500),
+        HarvestIncome(date=date(2025, 9, 16), total_weight_kg=1200, price_per_kg=8, gross_amount=9600,
+                      harvesting_wage=600, net_amount=9000),
+        HarvestIncome(date=date(2024, 9, 10), total_weight_kg=900, price_per_kg=7, gross_amount=6300,
+                      harvesting_wage=450, net_amount=5850),
+        FertilizerRecord(date=date(2025, 3, 1), item="ปุ๋ย", sacks=4, unit_price=700, spreading_wage=200,
+                         total_amount=3000),
+        HarvestDetail(date=date(2025, 9, 1), palm_id=a1.id, bunch_count=3),
+        HarvestDetail(date=date(2025, 9, 16), palm_id=a1.id, bunch_count=2),
+        HarvestDetail(date=date(2025, 9, 16), palm_id=b2.id, bunch_count=4),
+    ])
+    db.session.commit()
+
+
+def test_answers_from_database(ledger):
+    income = answer_locally("รายได้เดือนกันยายน 2568 เท่าไหร่", today=TODAY)
+    assert income["rows"] == [[16500.0, 17600.0, 2200.0, 2]]
+    assert "16,500.00 บาท" in income["answer"] and "ปี 2568" in income["answer"]
+
+    every_september = answer_locally("รายได้เดือนกันยายนรวมเท่าไหร่", today=TODAY)
+    assert every_september["rows"][0][0] == 22350.0
+
+    assert "9 ทะลาย" in answer_locally("ตัดทะลายไปทั้งหมดกี่ทะลาย", today=TODAY)["answer"]
+    assert "5 ทะลาย" in answer_locally("ต้น A1 ตัดไปกี่ทะลาย", today=TODAY)["answer"]
+    assert "3,000.00 บาท" in answer_locally("ค่าปุ๋ยปี 2568 เท่าไหร่", today=TODAY)["answer"]
+    assert "0 บาท" in answer_locally("ค่าปุ๋ยปี 2560 เท่าไหร่", today=TODAY)["answer"]
+
+    # ยังไม่มี palm_stats (เพิ่มผ่าน ORM ตรงๆ): ใช้วันขายล่าสุด + 15 วัน
+    nxt = answer_locally("ตัดปาล์มครั้งต่อไปเมื่อไหร่", today=TODAY)
+    assert nxt["intent"] == "next_harvest"
+    assert "ขายล่าสุดวันที่ 16 กันยายน 2568" in nxt["answer"]
+    assert "1 ตุลาคม 2568" in nxt["answer"]
+
+
+def test_chat_api_answers_without_gemini(client, ledger, app):
+    app.config["GOOGLE_API_KEY"] = ""  # ไม่มี key ก็ยังตอบคำถามที่รู้จักได้
+    resp = client.post("/api/chat", json={"message": "ตัดทะลายไปทั้งหมดกี่ทะลาย"})
+    data = resp.get_json()
+    assert data["intent"] == "total_bunches"
+    assert "9 ทะลาย" in data["answer"]
+
+    fallback = client.post("/api/chat", json={"message": "ต้นไหนควรให้ความสนใจพิเศษ"}).get_json()
+    assert "ยังไม่ได้ตั้งค่า Google API Key" in fallback["answer"]
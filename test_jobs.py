@@ -0,0 +1,90 @@
+"""
+ทดสอบ background import jobs
+"""
+
+import io
+from datetime import datetime, timedelta
+
+from app import create_app
+from jobs import INTERRUPTED_MESSAGE, _run_job, wait_for, worker_id
+from models import db, HarvestDetail, ImportJob
+
+
+def _submit(client, path, data, name="h.csv"):
+    resp = client.post(path, data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+    assert resp.status_code == 302
+    job_id = int(resp.headers["Location"].rsplit("/", 1)[1])
+    wait_for(job_id, timeout=30)
+    db.session.expire_all()
+    return job_id
+
+
+def test_import_runs_in_background_and_reports_row_errors(client):
+    data = "date,palm_code,bunch_count\n2025-09-01,A1,2\n2025-09-01,Z9,1\nxx,A2,1\n".encode("utf-8")
+    job_id = _submit(client, "/harvest/import", data)
+
+    state = client.get(f"/api/jobs/{job_id}").get_json()
+    assert state["status"] == "done"
+    assert (state["rows_processed"], state["rows_imported"], state["rows_rejected"]) == (3, 1, 2)
+    assert state["errors"] == ["แถว 2: ไม่พบต้นปาล์มรหัส Z9", "แถว 3: รูปแบบวันที่ไม่ถูกต้อง (xx)"]
+    assert HarvestDetail.query.count() == 1
+    job = db.session.get(ImportJob, job_id)
+    assert job.owner == worker_id() and job.heartbeat_at is not None
+
+    page = client.get(f"/jobs/{job_id}").get_data(as_text=True)
+    assert "ไม่พบต้นปาล์มรหัส Z9" in page
+
+
+def test_unreadable_file_fails_the_job(client):
+    job_id = _submit(client, "/notes/import", bytes(range(128, 256)) * 10)
+
+    job = db.session.get(ImportJob, job_id)
+    assert job.status == "failed"
+    assert job.message == "ไม่สามารถอ่านไฟล์ได้ กรุณาตรวจสอบรูปแบบไฟล์"
+
+
+
+def _job(path, owner, heartbeat_at, status="running", **progress):
+    job = ImportJob(kind="harvest", filename="h.csv", path=str(path), status=status,
+                    owner=owner, heartbeat_at=heartbeat_at, **progress)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def test_job_running_in_another_instance_is_left_alone(app, client, tmp_path):
+    upload = tmp_path / "uploads" / "import-other.csv"
+    upload.write_text("date,palm_code,bunch_count\n", encoding="utf-8")
+    job_id = _job(upload, "other-host:4242", datetime.utcnow(), rows_processed=500, rows_imported=480)
+
+    # instance ใหม่กับฐานข้อมูลเดิม (worker ที่สอง / deploy ที่รัน init-db) ไม่ปิด job ที่ยังส่ง heartbeat
+    other = create_app({"SQLALCHEMY_DATABASE_URI": app.config["SQLALCHEMY_DATABASE_URI"],
+                        "UPLOAD_FOLDER": app.config["UPLOAD_FOLDER"]})
+    assert other.test_cli_runner().invoke(args=["init-db"]).exit_code == 0
+
+    # ความคืบหน้าอ่านจากตาราง jobs ได้จาก instance ไหนก็ได้
+    state = client.get(f"/api/jobs/{job_id}").get_json()
+    assert (state["status"], state["rows_processed"], state["rows_imported"]) == ("running", 500, 480)
+    assert upload.exists()
+
+
+def test_job_without_heartbeat_is_failed_when_polled(app, client, tmp_path):
+    upload = tmp_path / "uploads" / "import-stale.csv"
+    upload.write_text("date,palm_code,bunch_count\n", encoding="utf-8")
+    stale = datetime.utcnow() - timedelta(seconds=app.config["JOB_HEARTBEAT_TIMEOUT"] + 60)
+    job_id = _job(upload, "gone-host:1", stale)
+
+    state = client.get(f"/api/jobs/{job_id}").get_json()
+    assert (state["status"], state["message"]) == ("failed", INTERRUPTED_MESSAGE)
+    assert not upload.exists()
+
+
+def test_job_failed_elsewhere_is_not_run(app, tmp_path):
+    upload = tmp_path / "uploads" / "import-late.csv"
+    upload.write_text("date,palm_code,bunch_count\n2025-09-01,A1,2\n", encoding="utf-8")
+    job_id = _job(upload, worker_id(), datetime.utcnow(), status="failed", message=INTERRUPTED_MESSAGE)
+
+    _run_job(app, job_id)
+    job = db.session.get(ImportJob, job_id)
+    assert (job.status, job.message) == ("failed", INTERRUPTED_MESSAGE)
+    assert HarvestDetail.query.count() == 0
@@ -0,0 +1,90 @@
+"""
+ทดสอบ Server-Timing header และ /metrics
+"""
+
+import re
+
+import pytest
+
+from metrics import REGISTRY, measure_gemini
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    REGISTRY.reset()
+    yield
+    REGISTRY.reset()
+
+
+def _timing(resp):
+    return dict(re.findall(r"(\w+);dur=([\d.]+)", resp.headers["Server-Timing"]))
+
+
+def test_server_timing_reports_sql_and_template_time(client):
+    resp = client.get("/income")
+    assert resp.status_code == 200
+    header = resp.headers["Server-Timing"]
+    timing = _timing(resp)
+    assert set(timing) >= {"app", "sql", "tpl"}
+    assert float(timing["app"]) >= float(timing["tpl"]) > 0
+    queries = int(re.search(r'sql;dur=[\d.]+;desc="(\d+) queries"', header).group(1))
+    assert queries >= 1
+
+
+def test_metrics_endpoint_exposes_prometheus_text(client):
+    client.get("/income")
+    client.get("/income")
+    client.get("/health")
+
+    resp = client.get("/metrics")
+    assert resp.mimetype == "text/plain"
+    body = resp.get_data(as_text=True)
+    assert 'palm_http_requests_total{method="GET",endpoint="income_list",status="200"} 2' in body
+    assert 'palm_http_request_duration_seconds_count{endpoint="income_list"} 2' in body
+    assert 'palm_http_request_duration_seconds_bucket{endpoint="health_check",le="+Inf"} 1' in body
+    assert re.search(r'palm_sql_statements_total\{endpoint="income_list"\} \d+', body)
+    assert 'endpoint="metrics"' not in body
+
+
+def test_gemini_time_is_attributed_to_the_request(app):
+    with app.test_request_context("/api/chat"):
+        app.preprocess_request()
+        with measure_gemini(prompt_tokens=120):
+            pass
+        resp = app.process_response(app.response_class("ok"))
+    assert 'gemini;dur=' in resp.headers["Server-Timing"]
+    assert 'desc="1 calls"' in resp.headers["Server-Timing"]
+    assert re.search(r'palm_gemini_prompt_tokens_total\{endpoint="[^"]+"\} 120\n', REGISTRY.render())
+
+
+def test_sql_outside_requests_is_ignored(app):
+    from models import db
+    db.session.execute(db.text("SELECT 1"))
+    assert REGISTRY.render().count("palm_sql_statements_total{") == 0
+
+
+def test_streamed_response_is_recorded_when_the_body_finishes(client):
+    resp = client.get("/income/export")
+    assert 'desc="headers only, body streamed"' in resp.headers["Server-Timing"]
+    assert 'endpoint="income_export"' not in REGISTRY.render()
+
+    resp.get_data()
+    resp.close()
+    body = REGISTRY.render()
+    assert 'palm_http_request_duration_seconds_count{endpoint="income_export"} 1' in body
+    # SELECT ของ export รันระหว่างส่ง body จึงนับเข้ากับ request นี้ด้วย
+    assert 'palm_sql_statements_total{endpoint="income_export"} 1' in body
+
+
+def test_failed_statement_does_not_leave_a_start_time_on_the_connection(app):
+    from sqlalchemy.exc import OperationalError
+    from models import db
+
+    with db.engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.exec_driver_sql("SELECT * FROM no_such_table")
+        assert conn.info.get("query_started") == []
+        # เวลาของ statement ถัดไปไม่ถูกวัดจากเวลาเริ่มของ statement ที่ล้มเหลว
+        conn.exec_driver_sql("SELECT 1")
+        assert conn.info.get("query_started") == []
@@ -0,0 +1,112 @@
+"""
+ทดสอบ migrate_db กับฐานข้อมูลปลายทางที่เป็นไฟล์ในเครื่อง (sqlite3 และ libsql)
+"""
+
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import migrate_db
+from migrate_db import STATE_TABLE, dependency_levels, connect_source, migrate_database, verify_migration
+from models import db, HarvestDetail, HarvestIncome, Note, Palm
+
+
+@pytest.fixture
+def source_path(app, tmp_path):
+    """ฐานข้อมูลของแอปพร้อมข้อมูลหลายพันแถว"""
+    palm_ids = [p.id for p in Palm.query.all()]
+    start = date(2024, 1, 1)
+    db.session.execute(db.insert(HarvestDetail), [
+        {"date": start + timedelta(days=i // 50), "palm_id": palm_ids[i % len(palm_ids)], "bunch_count": i % 5,
+         "remarks": "ทดสอบ" if i % 7 == 0 else None}
+        for i in range(5000)
+    ])
+    db.session.execute(db.insert(HarvestIncome), [
+        {"date": start + timedelta(days=i), "total_weight_kg": 1000 + i, "price_per_kg": 8.5,
+         "gross_amount": (1000 + i) * 8.5, "harvesting_wage": 500, "net_amount": (1000 + i) * 8.5 - 500}
+        for i in range(300)
+    ])
+    db.session.add(Note(date=start, title="บันทึก", content="ต้นปาล์มสภาพดี"))
+    db.session.commit()
+    db.session.remove()
+    db.engine.dispose()
+    return tmp_path / "test.db"
+
+
+def _sqlite_target(path):
+    return lambda: sqlite3.connect(path, check_same_thread=False)
+
+
+class FailingTarget:
+    """connection ที่ commit ได้จำนวนครั้งจำกัด แล้วจำลองว่าการเชื่อมต่อหลุด"""
+
+    def __init__(self, conn, budget):
+        self._conn = conn
+        self._budget = budget
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        if self._budget[0] <= 0:
+            raise ConnectionError("connection lost")
+        self._budget[0] -= 1
+        self._conn.commit()
+
+
+def test_migrates_all_tables_and_verifies(source_path, tmp_path):
+    target = _sqlite_target(tmp_path / "target.db")
+    results = migrate_database(source_path, target, workers=3, batch_size=100, log=lambda *_: None)
+
+    assert results["harvest_details"].rows_copied == 5000
+    assert results["harvest_details"].batches < 50  # batch ถูกขยายเมื่อเขียนเร็ว
+    assert results["palms"].rows_copied == 312
+    assert verify_migration(source_path, target, log=lambda *_: None) == []
+
+    conn = target()
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert "ix_harvest_details_palm_id_date" in indexes
+
+
+def test_interrupted_migration_resumes_from_checkpoint(source_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(migrate_db, "MAX_BATCH", 100)
+    path = tmp_path / "target.db"
+    budget = [5]  # create_schema ใช้ไป 1 ครั้ง ที่เหลือเป็น batch ข้อมูล
+    flaky = lambda: FailingTarget(sqlite3.connect(path, check_same_thread=False), budget)
+
+    with pytest.raises(RuntimeError):
+        migrate_database(source_path, flaky, workers=1, batch_size=100, log=lambda *_: None)
+
+    target = _sqlite_target(path)
+    partial = dict(target().execute(f"SELECT table_name, rows_copied FROM {STATE_TABLE}").fetchall())
+    assert 0 < sum(partial.values()) <= 400
+
+    results = migrate_database(source_path, target, workers=2, batch_size=100, log=lambda *_: None)
+    resumed = [r for r in results.values() if r.resumed_from]
+    assert resumed
+    assert verify_migration(source_path, target, log=lambda *_: None) == []
+    assert target().execute("SELECT COUNT(*) FROM harvest_details").fetchone()[0] == 5000
+
+
+def test_checksum_detects_changed_row(source_path, tmp_path):
+    target = _sqlite_target(tmp_path / "target.db")
+    migrate_database(source_path, target, log=lambda *_: None)
+    conn = target()
+    conn.execute("UPDATE notes SET content = 'แก้ไข'")
+    conn.commit()
+    assert verify_migration(source_path, target, log=lambda *_: None) == ["notes"]
+
+
+def test_parents_are_migrated_before_children(source_path):
+    source = connect_source(source_path)
+    levels = dependency_levels(source, set(migrate_db.list_tables(source)))
+    level_of = {t: i for i, level in enumerate(levels) for t in level}
+    assert level_of["palms"] < level_of["harvest_details"]
+
+
+def test_migrates_into_local_libsql_file(source_path, tmp_path):
+    libsql = pytest.importorskip("libsql_experimental")
+    target = lambda: libsql.connect(str(tmp_path / "libsql.db"))
+    migrate_database(source_path, target, workers=2, log=lambda *_: None)
+    assert verify_migration(source_path, target, log=lambda *_: None) == []
@@ -0,0 +1,65 @@
+"""
+ทดสอบ keyset pagination ของหน้ารายการ
+"""
+
+import re
+from datetime import date, timedelta
+
+from models import db, Note, HarvestDetail, Palm
+from pagination import decode_cursor, paginate
+
+
+def _seed_notes(n=25):
+    start = date(2025, 1, 1)
+    for i in range(n):
+        # สองรายการต่อวัน เพื่อทดสอบการเรียงด้วย id เมื่อวันที่ซ้ำกัน
+        db.session.add(Note(date=start + timedelta(days=i // 2), title=f"n{i}", content="-"))
+    db.session.commit()
+
+
+def test_walk_forward_and_back(app):
+    _seed_notes()
+    stmt = db.select(Note)
+    expected = [n.title for n in Note.query.order_by(Note.date.desc(), Note.id.desc())]
+
+    seen, pages, cursor = [], [], None
+    while True:
+        page = paginate(stmt, Note.date, Note.id, after=cursor, per_page=10)
+        pages.append(page)
+        seen += [n.title for n in page.rows]
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+
+    assert seen == expected
+    assert [len(p.rows) for p in pages] == [10, 10, 5]
+    assert not pages[0].has_prev
+
+    # ย้อนกลับจากหน้าสุดท้ายต้องได้หน้าที่สองเหมือนเดิม
+    back = paginate(stmt, Note.date, Note.id, before=pages[2].prev_cursor, per_page=10)
+    assert [n.title for n in back.rows] == [n.title for n in pages[1].rows]
+    assert back.has_prev and back.has_next
+
+
+def test_invalid_cursor_falls_back_to_first_page(app):
+    _seed_notes(3)
+    assert decode_cursor("garbage") is None
+    page = paginate(db.select(Note), Note.date, Note.id, after="garbage", per_page=10)
+    assert len(page.rows) == 3
+
+
+def test_harvest_list_pages(client):
+    palm = Palm.query.filter_by(code="A1").first()
+    db.session.execute(db.insert(HarvestDetail), [
+        {"date": date(2025, 1, 1) + timedelta(days=i), "palm_id": palm.id, "bunch_count": i} for i in range(7)
+    ])
+    db.session.commit()
+
+    first = client.get("/harvest?per_page=3").get_data(as_text=True)
+    assert first.count("<td>A1</td>") == 3
+    next_url = re.search(r'href="([^"]*after=[^"]*)"', first).group(1).replace("&amp;", "&")
+    assert "per_page=3" in next_url
+
+    second = client.get(next_url).get_data(as_text=True)
+    assert second.count("<td>A1</td>") == 3
+    assert "before=" in second
@@ -0,0 +1,58 @@
+"""
+ทดสอบ palm registry และการใช้แทน query ตาราง palms ใน route
+"""
+
+from datetime import date
+
+from models import db, HarvestDetail, Palm
+from palm_registry import PALMS, natural_key, normalize_code, split_code
+
+
+def test_codes_are_parsed_and_normalized():
+    assert split_code("b07") == ("B", 7)
+    assert split_code("ต้นไหน") is None
+    assert normalize_code(" a 1 ") == "A1"
+    assert sorted(["A10", "B1", "A2"], key=natural_key) == ["A2", "A10", "B1"]
+
+
+def test_registry_maps_both_ways_in_natural_order(app):
+    palms = PALMS.all()
+    assert len(palms) == 312
+    assert [p.code for p in palms[:3]] == ["A1", "A2", "A3"]
+    assert palms[25].code == "A26" and palms[26].code == "B1"
+    a26 = PALMS.get("a26")
+    assert (a26.row, a26.number) == ("A", 26)
+    assert PALMS.code_of(a26.id) == "A26"
+    assert PALMS.ids()["L26"] == PALMS.get("L26").id
+    assert PALMS.get("Z1") is None
+
+
+def test_registry_reloads_when_palms_change(app):
+    PALMS.all()
+    loads = PALMS.loads
+    db.session.add(Palm(code="M1"))
+    db.session.commit()
+    assert PALMS.get("M1") is not None
+    assert PALMS.loads == loads + 1
+    PALMS.get("A1")
+    assert PALMS.loads == loads + 1
+
+
+def test_harvest_routes_do_not_query_palms(client, statements):
+    a1 = PALMS.get("A1")
+    db.session.add(HarvestDetail(date=date(2025, 9, 1), palm_id=a1.id, bunch_count=3))
+    db.session.commit()
+    row = HarvestDetail.query.one()
+    statements.clear()
+
+    assert client.get("/harvest/new").status_code == 200
+    assert client.get(f"/harvest/edit/{row.id}").status_code == 200
+    page = client.get("/harvest").get_data(as_text=True)
+    assert "<td>A1</td>" in page
+    export = client.get("/harvest/export").get_data().decode("utf-8-sig")
+    assert ",A1,3," in export
+    resp = client.post("/harvest/new", data={"date": "2025-09-02", "palm_code": "b5", "bunch_count": 2})
+    assert resp.status_code == 302
+
+    assert not [s for s in statements if "FROM palms" in s or "JOIN palms" in s]
+    assert PALMS.code_of(HarvestDetail.query.order_by(HarvestDetail.id.desc()).first().palm_id) == "B5"
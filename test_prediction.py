@@ -0,0 +1,113 @@
+"""
+ทดสอบการทำนายวันตัดครั้งต่อไปรายต้น/ทั้งสวนจาก palm_stats และการใช้ในแชต แดชบอร์ด และ API
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from ai import bump_data_version
+from intents import answer_locally
+from models import db, HarvestDetail, HarvestIncome
+from palm_registry import PALMS
+from prediction import FORECAST_CACHE, cached_farm_forecast, farm_forecast
+from rollups import rebuild_palm_stats
+
+TODAY = date(2025, 10, 5)
+
+
+@pytest.fixture(autouse=True)
+def clear_forecast_cache():
+    FORECAST_CACHE.clear()
+    yield
+    FORECAST_CACHE.clear()
+
+
+def _harvest(code, d, bunches):
+    db.session.add(HarvestDetail(date=d, palm_id=PALMS.get(code).id, bunch_count=bunches))
+
+
+@pytest.fixture
+def history(app):
+    # A1 ตัดทุก 15 วัน (ล่าสุด 29 ก.ย.), B1 ทุก 20 วัน (ล่าสุด 16 ก.ย.; ตุลาคมปีก่อนได้ 9 และ 7 ทะลาย)
+    # C1 ได้ 0 ทะลายเท่านั้น
+    for i in range(7):
+        _harvest("A1", date(2025, 7, 1) + timedelta(days=15 * i), 3)
+    for i in range(19):
+        d = date(2024, 9, 21) + timedelta(days=20 * i)
+        _harvest("B1", d, {date(2024, 10, 11): 9, date(2024, 10, 31): 7}.get(d, 4))
+    _harvest("C1", date(2025, 9, 1), 0)
+    db.session.add(HarvestIncome(date=date(2025, 9, 28), total_weight_kg=1000, price_per_kg=8,
+                                 gross_amount=8000, harvesting_wage=500, net_amount=7500))
+    db.session.commit()
+    rebuild_palm_stats()
+
+
+def test_per_palm_interval_and_seasonal_yield(history):
+    forecast = farm_forecast(TODAY)
+    a1, b1 = forecast.palm("A1"), forecast.palm("b1")
+
+    assert a1.interval_days == 15 and a1.next_due == date(2025, 10, 14)
+    assert a1.expected_bunches == 3 and not a1.seasonal
+
+    # B1 ครบกำหนดเดือนตุลาคม -> ใช้ค่าเฉลี่ยตุลาคมของปีก่อนแทนค่าเฉลี่ยทั้งหมด
+    assert b1.last_harvest == date(2025, 9, 16) and b1.interval_days == 20
+    assert b1.next_due == date(2025, 10, 6) and b1.seasonal and b1.expected_bunches == 8
+
+    assert forecast.palm("C1") is None
+    assert forecast.basis == "palms"
+
+
+def test_farm_round(history):
+    forecast = farm_forecast(TODAY)
+    assert forecast.next_date == date(2025, 10, 14)
+    assert forecast.due_palms == 2
+    assert forecast.expected_bunches == pytest.approx(3 + 8)
+
+
+def test_fallback_to_last_sale_without_palm_history(app):
+    db.session.add(HarvestIncome(date=date(2025, 9, 28), total_weight_kg=1, price_per_kg=1,
+                                 gross_amount=1, harvesting_wage=0, net_amount=1))
+    db.session.commit()
+    forecast = farm_forecast(TODAY)
+    assert forecast.basis == "sale" and forecast.next_date == date(2025, 10, 13)
+    assert farm_forecast(TODAY).palms == []
+
+
+def test_chat_answers_for_farm_and_palm(history):
+    farm = answer_locally("ตัดปาล์มครั้งต่อไปเมื่อไหร่", today=TODAY)
+    assert farm["intent"] == "next_harvest"
+    assert "คาดการณ์จากระยะการตัดของแต่ละต้น" in farm["answer"]
+    assert "ต้นที่ถึงรอบ 2 ต้น" in farm["answer"]
+
+    palm = answer_locally("ต้น A1 ตัดครั้งต่อไปเมื่อไหร่", today=TODAY)
+    assert "ต้น A1" in palm["answer"] and "14 ตุลาคม 2568" in palm["answer"]
+    assert "3.0 ทะลาย" in palm["answer"]
+    assert "ยังไม่มีบันทึก" in answer_locally("ต้น C1 ตัดครั้งต่อไปเมื่อไหร่", today=TODAY)["answer"]
+
+
+def test_forecast_is_cached_until_harvests_change(history, statements):
+    first = cached_farm_forecast(TODAY)
+    statements.clear()
+    assert cached_farm_forecast(TODAY) is first
+    assert statements == []
+
+    _harvest("A1", date(2025, 10, 4), 4)
+    db.session.commit()
+    rebuild_palm_stats()
+    bump_data_version("harvest_details")
+    assert cached_farm_forecast(TODAY).palm("A1").last_harvest == date(2025, 10, 4)
+
+    second = cached_farm_forecast(TODAY)
+    bump_data_version("harvest_income")
+    assert cached_farm_forecast(TODAY) is not second
+
+
+def test_dashboard_and_api(client, history):
+    page = client.get("/").get_data(as_text=True)
+    assert "ตัดครั้งต่อไป (คาดการณ์)" in page
+
+    data = client.get("/api/reports/forecast").get_json()
+    assert data["basis"] == "palms" and {p["code"] for p in data["palms"]} == {"A1", "B1"}
+    only = client.get("/api/reports/forecast?palm=a1").get_json()
+    assert [p["code"] for p in only["palms"]] == ["A1"]
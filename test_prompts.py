@@ -0,0 +1,44 @@
+"""
+ทดสอบตัวสร้าง prompt (schema จาก models.py และการเลือกตาราง)
+"""
+
+from datetime import date
+
+from models import db
+from prompts import PROMPT_TABLES, SKIP_COLUMNS, build_sql_prompt, describe_schema, estimate_tokens, relevant_tables
+
+
+def test_schema_lists_every_model_column():
+    schema = describe_schema()
+    for name in PROMPT_TABLES:
+        line = next(l for l in schema.splitlines() if l.startswith(f"{name}("))
+        for column in db.metadata.tables[name].columns:
+            if column.name not in SKIP_COLUMNS:
+                assert f"{column.name} " in line
+    assert "palm_id int→palms.id" in schema
+    assert "users" not in schema and "password_hash" not in schema
+
+
+def test_only_relevant_tables_are_included():
+    assert relevant_tables("ค่าปุ๋ยเดือนนี้เท่าไหร่") == ("fertilizer_records",)
+    assert relevant_tables("ต้นไหนให้ทะลายมากที่สุด") == ("harvest_details", "palms")
+    assert relevant_tables("ต้นทุนปุ๋ยปีนี้") == ("fertilizer_records",)
+    assert "harvest_income" in relevant_tables("ตัดปาล์มครั้งต่อไปเมื่อไหร่")
+    # เดาไม่ได้ ใส่ทุกตาราง
+    assert relevant_tables("ช่วยดูข้อมูลหน่อย") == PROMPT_TABLES
+
+
+def test_prompt_is_compact_and_dated():
+    prompt, tables = build_sql_prompt("ค่าปุ๋ยเดือนกันยายนเท่าไหร่", today=date(2025, 9, 15))
+    assert tables == ("fertilizer_records",)
+    assert "15 กันยายน 2568" in prompt
+    assert "harvest_details" not in prompt
+    full, _ = build_sql_prompt("ช่วยดูข้อมูลหน่อย", today=date(2025, 9, 15))
+    assert estimate_tokens(prompt) < estimate_tokens(full) < 600
+
+
+def test_next_harvest_rule_only_when_asked():
+    prompt, _ = build_sql_prompt("ตัดปาล์มครั้งต่อไปเมื่อไหร่")
+    assert "+15 days" in prompt
+    prompt, _ = build_sql_prompt("รายได้เดือนนี้")
+    assert "+15 days" not in prompt
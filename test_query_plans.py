@@ -0,0 +1,84 @@
+"""
+ทดสอบ EXPLAIN QUERY PLAN ของ query ที่ใช้บ่อย: ต้องใช้ index ไม่ใช่ full table scan
+"""
+
+import re
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from dashboard import DASHBOARD_SQL
+from models import db
+from schema import ensure_indexes
+
+LEDGERS = ("harvest_income", "fertilizer_records", "harvest_details", "notes")
+
+# (ชื่อ, SQL, ต้องเรียงลำดับด้วย index หรือไม่)
+HOT_QUERIES = [
+    *[(f"{t} list page", f"SELECT * FROM {t} ORDER BY date DESC, id DESC LIMIT 50", True) for t in LEDGERS],
+    *[(f"{t} next page", f"SELECT * FROM {t} WHERE (date, id) < ('2025-01-01', 100) "
+                         f"ORDER BY date DESC, id DESC LIMIT 50", True) for t in LEDGERS],
+    *[(f"{t} date range", f"SELECT * FROM {t} WHERE date BETWEEN '2025-09-01' AND '2025-09-30'", False)
+      for t in LEDGERS],
+    ("harvest list join", "SELECT hd.*, p.code FROM harvest_details hd JOIN palms p ON hd.palm_id = p.id "
+                          "ORDER BY hd.date DESC, hd.id DESC LIMIT 50", True),
+    ("harvest by palm", "SELECT date, bunch_count FROM harvest_details WHERE palm_id = 1 ORDER BY date", True),
+    ("dashboard summary", DASHBOARD_SQL, False),
+]
+
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+
+def _plan(sql):
+    return [row[3] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+def _problems(plan, ordered):
+    # subquery ที่ถูก MATERIALIZE (เช่น LIMIT 3 ก่อน join) ไม่ใช่การ scan ตารางจริง
+    materialized = {d.split()[1] for d in plan if d.startswith("MATERIALIZE ")}
+    problems = [
+        d for d in plan
+        if FULL_SCAN.match(d)
+        and FULL_SCAN.match(d).group(1) in LEDGERS + ("hd",)
+        and FULL_SCAN.match(d).group(1) not in materialized
+    ]
+    if ordered:
+        problems += [d for d in plan if "TEMP B-TREE FOR ORDER BY" in d]
+    return problems
+
+
+@pytest.mark.parametrize("name,sql,ordered", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(app, name, sql, ordered):
+    plan = _plan(sql)
+    assert not _problems(plan, ordered), f"{name}: {plan}"
+
+
+def test_ensure_indexes_upgrades_existing_database(tmp_path):
+    """ฐานข้อมูลเดิมที่ไม่มี index ต้องได้ index ครบ และรันซ้ำได้ไม่ error"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            table.create(conn)
+            for index in list(table.indexes):
+                index.drop(conn)
+
+    first = ensure_indexes(engine)
+    second = ensure_indexes(engine)
+
+    with engine.connect() as conn:
+        existing = {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    assert first == second
+    assert set(first) <= existing
+    assert "ix_harvest_details_palm_id_date" in existing
+
+
+def test_upgrade_db_command_adds_missing_index(app):
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_harvest_details_palm_id_date"))
+
+    result = app.test_cli_runner().invoke(args=["upgrade-db"])
+    assert result.exit_code == 0, result.output
+    assert "✅ ix_harvest_details_palm_id_date" in result.output
+    with db.engine.connect() as conn:
+        names = {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    assert "ix_harvest_details_palm_id_date" in names
@@ -0,0 +1,74 @@
+"""
+ทดสอบ slow-query log, ตัวตรวจ N+1 และงบจำนวน query ของ route หลัก
+"""
+
+import logging
+from datetime import date
+
+import pytest
+
+from models import db, HarvestDetail, HarvestIncome, Palm
+from querylog import QueryBudgetExceeded, query_budget
+
+
+@pytest.fixture
+def harvest_rows(app):
+    palms = Palm.query.limit(10).all()
+    db.session.add_all(HarvestDetail(date=date(2025, 9, 1), palm_id=p.id, bunch_count=2) for p in palms)
+    db.session.add(HarvestIncome(date=date(2025, 9, 1), total_weight_kg=1000, price_per_kg=8,
+                                 gross_amount=8000, harvesting_wage=500, net_amount=7500))
+    db.session.commit()
+    return HarvestDetail.query.all()
+
+
+@pytest.mark.parametrize("path, budget", [
+    ("/", 3),
+    ("/income", 3),
+    ("/fertilizer", 3),
+    ("/harvest", 3),
+    ("/notes", 3),
+])
+def test_list_routes_stay_within_query_budget(client, harvest_rows, path, budget):
+    db.session.expunge_all()
+    with query_budget(budget):
+        assert client.get(path).status_code == 200
+
+
+def test_harvest_edit_does_not_lazy_load_palms(client, harvest_rows):
+    row = harvest_rows[0]
+    db.session.expunge_all()
+    with query_budget(3):  # ผู้ใช้, แถวที่แก้ไข, รายการต้นปาล์ม
+        assert client.get(f"/harvest/edit/{row.id}").status_code == 200
+
+    resp = client.post(f"/harvest/edit/{row.id}", data={"date": "2025-09-02", "palm_code": "B5", "bunch_count": 4})
+    assert resp.status_code == 302
+    db.session.expire_all()
+    assert db.session.get(HarvestDetail, row.id).palm.code == "B5"
+
+
+def test_budget_failure_lists_statements(app):
+    with pytest.raises(QueryBudgetExceeded, match="palms"):
+        with query_budget(1):
+            Palm.query.count()
+            Palm.query.first()
+
+
+def test_n_plus_one_is_logged(app, harvest_rows, caplog):
+    app.config.update(QUERY_LOG=True, N_PLUS_ONE_THRESHOLD=5)
+    db.session.expunge_all()
+
+    with caplog.at_level(logging.WARNING, logger=app.logger.name), app.test_request_context("/harvest"):
+        app.preprocess_request()
+        for row in HarvestDetail.query.all():
+            row.palm.code  # lazy load ทีละแถว
+        app.process_response(app.response_class("ok"))
+
+    assert any("N+1" in r.getMessage() and "10 ครั้ง" in r.getMessage() for r in caplog.records)
+
+
+def test_slow_query_is_logged_with_plan(app, client, harvest_rows, caplog):
+    app.config.update(QUERY_LOG=True, SLOW_QUERY_MS=0)
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        client.get("/harvest")
+    messages = [r.getMessage() for r in caplog.records if "query ช้า" in r.getMessage()]
+    assert any("harvest_details" in m and "ix_harvest_details_date_id" in m for m in messages)
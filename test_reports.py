@@ -0,0 +1,88 @@
+"""
+ทดสอบรายงานกำไร/ขาดทุนรายเดือน-รายปี, /api/reports/pnl และคำถามกำไรในแชต
+"""
+
+from datetime import date
+
+import pytest
+
+from intents import answer_locally
+from models import db, FertilizerRecord, HarvestIncome
+from reports import monthly_pnl, parse_month, pnl_report
+from rollups import rebuild_farm_totals
+
+TODAY = date(2025, 9, 20)
+
+
+@pytest.fixture
+def ledger(app):
+    db.session.add_all([
+        HarvestIncome(date=date(2024, 12, 5), total_weight_kg=500, price_per_kg=6, gross_amount=3000,
+                      harvesting_wage=300, net_amount=2700),
+        HarvestIncome(date=date(2025, 8, 1), total_weight_kg=1000, price_per_kg=8, gross_amount=8000,
+                      harvesting_wage=500, net_amount=7500),
+        HarvestIncome(date=date(2025, 8, 16), total_weight_kg=1000, price_per_kg=9, gross_amount=9000,
+                      harvesting_wage=500, net_amount=8500),
+        FertilizerRecord(date=date(2025, 8, 20), item="ปุ๋ย", sacks=2, unit_price=700,
+                         spreading_wage=100, total_amount=1500),
+        FertilizerRecord(date=date(2025, 9, 3), item="ปุ๋ย", sacks=1, unit_price=800,
+                         spreading_wage=0, total_amount=800),
+    ])
+    db.session.commit()
+    rebuild_farm_totals()
+
+
+def test_monthly_and_yearly_pnl(ledger):
+    report = pnl_report()
+    months = {m["period"]: m for m in report["months"]}
+    assert list(months) == ["2024-12", "2025-08", "2025-09"]
+
+    aug = months["2025-08"]
+    assert aug["gross_amount"] == 17000 and aug["net_amount"] == 16000
+    assert aug["profit"] == 14500
+    assert aug["cost_per_kg"] == pytest.approx((1000 + 1500) / 2000)
+    assert aug["margin"] == pytest.approx(14500 / 17000, abs=1e-4)
+
+    # เดือนที่มีแต่ค่าปุ๋ย: ไม่มีต้นทุนต่อกิโลและอัตรากำไร
+    assert months["2025-09"]["profit"] == -800
+    assert months["2025-09"]["cost_per_kg"] is None and months["2025-09"]["margin"] is None
+
+    years = {y["period"]: y for y in report["years"]}
+    assert years["2025"]["profit"] == 13700
+    assert report["total"]["profit"] == 13700 + 2700
+
+
+def test_pnl_reads_farm_totals_in_one_query(ledger, statements):
+    statements.clear()
+    assert [line.period for line in monthly_pnl("2025-01", "2025-12")] == ["2025-08", "2025-09"]
+    assert len(statements) == 1
+    assert "farm_totals" in statements[0]
+
+
+def test_pnl_api(client, ledger):
+    data = client.get("/api/reports/pnl?year=2568").get_json()
+    assert [m["period"] for m in data["months"]] == ["2025-08", "2025-09"]
+
+    data = client.get("/api/reports/pnl?from=2024-12&to=2025-08").get_json()
+    assert data["total"]["profit"] == 2700 + 14500
+
+    assert client.get("/api/reports/pnl?from=2025-13").status_code == 400
+    assert client.get("/api/reports/pnl?from=2025-09&to=2025-01").status_code == 400
+
+
+def test_month_parameter_accepts_buddhist_year():
+    assert parse_month("2568-09") == "2025-09"
+    with pytest.raises(ValueError):
+        parse_month("09/2025")
+
+
+def test_profit_question_is_answered_locally(ledger):
+    result = answer_locally("กำไรเดือนสิงหาคม 2568 เท่าไหร่", today=TODAY)
+    assert result["intent"] == "profit"
+    assert "14,500.00 บาท" in result["answer"]
+    assert "85.3%" in result["answer"]
+
+    assert answer_locally("กำไรปีนี้เท่าไหร่", today=TODAY)["intent"] == "profit"
+    # ระบุวัน หรือถามเชิงวิเคราะห์ ให้โมเดลตอบ
+    assert answer_locally("กำไรวันที่ 5 สิงหาคม 2568 เท่าไหร่", today=TODAY) is None
+    assert answer_locally("เทียบกำไรปีนี้กับปีที่แล้ว", today=TODAY) is None
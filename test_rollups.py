@@ -0,0 +1,95 @@
+"""
+ทดสอบว่า farm_totals และ palm_stats ถูกปรับตามการเพิ่ม/แก้ไข/ลบ/นำเข้า และตรงกับการ rebuild
+"""
+
+import io
+from datetime import date
+
+from jobs import wait_for
+from models import db, FarmTotal, HarvestIncome, HarvestDetail, PalmStat
+from palm_registry import PALMS
+from rollups import ALL_PERIOD, TOTAL_COLUMNS, rebuild_farm_totals, rebuild_palm_stats
+
+
+def _snapshot():
+    db.session.expire_all()
+    return {
+        row.period: tuple(round(getattr(row, col), 6) for col in TOTAL_COLUMNS)
+        for row in FarmTotal.query.all()
+        if any(getattr(row, col) for col in TOTAL_COLUMNS) or row.period == ALL_PERIOD
+    }
+
+
+def test_routes_keep_totals_in_sync(client):
+    client.post("/income/new", data={"date": "2025-09-01", "total_weight_kg": 1000, "price_per_kg": 8,
+                                     "gross_amount": 8000, "harvesting_wage": 500})
+    client.post("/fertilizer/new", data={"date": "2025-08-20", "item": "ปุ๋ย", "sacks": 2,
+                                         "unit_price": 700, "spreading_wage": 100})
+    client.post("/harvest/new", data={"date": "2025-09-01", "palm_code": "A1", "bunch_count": 3})
+
+    totals = db.session.get(FarmTotal, ALL_PERIOD)
+    assert totals.net_amount == 7500
+    assert totals.fertilizer_cost == 1500
+    assert totals.bunch_count == 3
+    assert db.session.get(FarmTotal, "2025-08").fertilizer_cost == 1500
+
+    # แก้ไขย้ายเดือน แล้วลบ
+    income = HarvestIncome.query.first()
+    client.post(f"/income/edit/{income.id}", data={"date": "2025-10-05", "total_weight_kg": 1000, "price_per_kg": 9,
+                                                   "gross_amount": 9000, "harvesting_wage": 500})
+    assert db.session.get(FarmTotal, "2025-09").net_amount == 0
+    assert db.session.get(FarmTotal, "2025-10").net_amount == 8500
+
+    harvest = HarvestDetail.query.first()
+    client.post(f"/harvest/delete/{harvest.id}")
+    assert db.session.get(FarmTotal, ALL_PERIOD).bunch_count == 0
+
+    csv_data = "date,palm_code,bunch_count\n2025-09-15,A2,4\n2025-09-15,B3,5\n".encode("utf-8")
+    resp = client.post("/harvest/import", data={"file": (io.BytesIO(csv_data), "h.csv")},
+                       content_type="multipart/form-data")
+    wait_for(int(resp.headers["Location"].rsplit("/", 1)[1]), timeout=30)
+    db.session.expire_all()
+    assert db.session.get(FarmTotal, "2025-09").bunch_count == 9
+
+    incremental = _snapshot()
+    rebuild_farm_totals()
+    assert _snapshot() == incremental
+
+
+def _palm_stats():
+    db.session.expire_all()
+    return {
+        (PALMS.code_of(row.palm_id), row.month): (row.harvests, row.bunches, row.first_date, row.last_date)
+        for row in PalmStat.query.all()
+        if row.harvests or row.bunches
+    }
+
+
+def test_palm_stats_follow_every_write_path(client):
+    client.post("/harvest/new", data={"date": "2025-09-01", "palm_code": "A1", "bunch_count": 3})
+    client.post("/harvest/new", data={"date": "2025-09-16", "palm_code": "A1", "bunch_count": 5})
+    client.post("/harvest/batch", data={"date": "2025-10-01", "bunch_A1": "2", "bunch_A2": "0", "bunch_B3": "4"})
+    csv_data = "date,palm_code,bunch_count\n2025-08-15,A1,1\n2025-10-16,B3,6\n".encode("utf-8")
+    resp = client.post("/harvest/import", data={"file": (io.BytesIO(csv_data), "h.csv")},
+                       content_type="multipart/form-data")
+    wait_for(int(resp.headers["Location"].rsplit("/", 1)[1]), timeout=30)
+
+    stats = _palm_stats()
+    assert stats[("A1", 0)][:2] == (4, 11)
+    assert str(stats[("A1", 0)][2]) == "2025-08-15" and str(stats[("A1", 0)][3]) == "2025-10-01"
+    assert stats[("A1", 9)][:2] == (2, 8)
+    assert ("A2", 0) not in stats  # บันทึก 0 ทะลายไม่นับเป็นการตัด
+
+    # ลบวันตัดล่าสุด และแก้ไขวันตัดแรกให้ย้ายต้น: วันแรก/วันล่าสุดต้องอ่านใหม่
+    last = HarvestDetail.query.filter_by(date=date(2025, 10, 1), palm_id=PALMS.get("A1").id).one()
+    client.post(f"/harvest/delete/{last.id}")
+    first = HarvestDetail.query.filter_by(date=date(2025, 8, 15)).one()
+    client.post(f"/harvest/edit/{first.id}", data={"date": "2025-08-15", "palm_code": "C1", "bunch_count": 1})
+
+    stats = _palm_stats()
+    assert str(stats[("A1", 0)][2]) == "2025-09-01" and str(stats[("A1", 0)][3]) == "2025-09-16"
+    assert stats[("C1", 0)][:2] == (1, 1)
+
+    incremental = stats
+    rebuild_palm_stats()
+    assert _palm_stats() == incremental
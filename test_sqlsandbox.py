@@ -0,0 +1,108 @@
+"""
+ทดสอบ sandbox สำหรับ SQL ที่โมเดลสร้าง
+"""
+
+import pytest
+
+from models import db
+import sqlsandbox
+from sqlsandbox import QueryTimeout, UnsafeSQL, check_sql, run_readonly, tokenize
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COALESCE(SUM(bunch_count), 0) FROM harvest_details;",
+    "with m as (select strftime('%Y-%m', date) ym, sum(net_amount) n from harvest_income group by 1) select * from m",
+    "SELECT date, 'ลบข้อมูล; DROP TABLE notes' AS note FROM notes",
+    "SELECT replace(title, 'a', 'b') FROM notes",
+    "SELECT created_at, updated_note FROM notes -- delete me",
+    'SELECT "delete" FROM (SELECT 1 AS "delete")',
+])
+def test_accepts_read_only_select(sql):
+    check_sql(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM notes",
+    "SELECT 1; DROP TABLE notes",
+    "WITH x AS (SELECT 1) DELETE FROM notes",
+    "REPLACE INTO notes (id) VALUES (1)",
+    "SELECT load_extension('x')",
+    "PRAGMA table_info(notes)",
+    "SELECT * FROM notes WHERE id = ?",
+    "SELECT 'unterminated",
+    "ATTACH DATABASE 'x.db' AS x",
+    "SELECT username, password_hash FROM users",
+    'SELECT * FROM main."Users"',
+    "",
+])
+def test_rejects_everything_else(sql):
+    with pytest.raises(UnsafeSQL):
+        check_sql(sql)
+
+
+def test_tokenizer_skips_comments_and_keeps_strings():
+    tokens = tokenize("SELECT /* DROP */ 'a''b' -- x\n, \"q\"")
+    assert [(t.kind, t.text) for t in tokens] == [
+        ("word", "SELECT"), ("string", "'a''b'"), ("op", ","), ("quoted", '"q"'),
+    ]
+
+
+def test_rows_are_capped(app):
+    result = run_readonly(db.engine, "SELECT code FROM palms ORDER BY id", max_rows=10)
+    assert len(result.rows) == 10
+    assert result.truncated
+    assert result.columns == ["code"]
+    assert result.rows[0] == ["A1"]
+
+    small = run_readonly(db.engine, "SELECT COUNT(*) AS n FROM palms", max_rows=10)
+    assert small.rows == [[312]] and not small.truncated
+
+
+def test_runaway_query_times_out(app):
+    with pytest.raises(QueryTimeout):
+        run_readonly(db.engine, "SELECT COUNT(*) FROM palms a, palms b, palms c, palms d", timeout_ms=100)
+
+
+def test_driver_without_hooks_still_has_a_deadline(app, monkeypatch):
+    # บังคับใช้ทางเดียวกับ libsql (ไม่มี authorizer / progress handler)
+    monkeypatch.setattr(sqlsandbox, "HOOK_DRIVERS", set())
+    assert run_readonly(db.engine, "SELECT COUNT(*) FROM palms").rows == [[312]]
+    with pytest.raises(QueryTimeout):
+        run_readonly(db.engine, "SELECT COUNT(*) FROM palms a, palms b, palms c", timeout_ms=50)
+    with pytest.raises(UnsafeSQL):
+        run_readonly(db.engine, "SELECT password_hash FROM users")
+
+
+def test_connection_is_read_only_and_hides_password_hashes(app):
+    from models import User
+    user = User(username="owner")
+    user.set_password("secret")
+    db.session.add(user)
+    db.session.commit()
+
+    # ตาราง users ถูกปฏิเสธตั้งแต่ check_sql (ใช้ได้กับทุก driver)
+    with pytest.raises(UnsafeSQL):
+        run_readonly(db.engine, "SELECT username, password_hash FROM users")
+    # ผ่าน tokenizer แต่ authorizer ของ SQLite ไม่ยอม
+    with pytest.raises(UnsafeSQL):
+        run_readonly(db.engine, "SELECT * FROM pragma_table_info('users')")
+
+
+def test_chat_reports_unsafe_sql(client, app, monkeypatch):
+    import json
+    import ai
+    import google.generativeai as genai
+
+    class Model:
+        def __init__(self, name):
+            pass
+
+        def generate_content(self, prompt, stream=False, request_options=None):
+            return type("Resp", (), {"text": json.dumps({"sql": "SELECT 1; DELETE FROM notes", "summary_hint": ""})})()
+
+    app.config["GOOGLE_API_KEY"] = "test-key"
+    monkeypatch.setattr(genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(genai, "GenerativeModel", Model)
+    ai.ANSWER_CACHE.clear()
+    data = client.post("/api/chat", json={"message": "ลบบันทึกทั้งหมด"}).get_json()
+    assert data["answer"].startswith("SQL ไม่ปลอดภัย")
@@ -0,0 +1,71 @@
+"""
+ทดสอบการเริ่มแอปแบบ lazy: schema version, คำสั่ง init-db และการไม่ import SDK ที่หนักตอนเริ่ม
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+from sqlalchemy import inspect
+
+import schema
+from app import create_app
+from models import db, AppMeta, Palm
+from schema import SCHEMA_VERSION_KEY, ensure_schema, schema_version, stored_schema_version
+
+ROOT = Path(__file__).parent
+
+
+def test_import_does_not_build_app_or_load_gemini_sdk():
+    code = (
+        "import sys, app\n"
+        "assert 'app' not in vars(app), 'app built at import'\n"
+        "assert 'google.generativeai' not in sys.modules, 'gemini sdk imported at startup'\n"
+        "app.create_app({'AUTO_INIT_DB': False})\n"
+        "assert 'numpy' not in sys.modules, 'numpy imported at startup'\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_schema_version_is_stored_and_checked_once(app):
+    assert stored_schema_version() == schema_version()
+    assert Palm.query.count() == 312
+    # process นี้ตรวจแล้ว: ไม่แตะฐานข้อมูลอีก
+    assert ensure_schema() is False
+
+    # version ในฐานข้อมูลไม่ตรง (เช่นหลังแก้ models.py) -> init ใหม่โดยไม่สร้างต้นปาล์มซ้ำ
+    schema._checked.clear()
+    db.session.merge(AppMeta(key=SCHEMA_VERSION_KEY, value="old"))
+    db.session.commit()
+    assert ensure_schema() is True
+    assert stored_schema_version() == schema_version()
+    assert Palm.query.count() == 312
+
+
+def test_auto_init_can_be_disabled(tmp_path):
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'empty.db'}", "AUTO_INIT_DB": False})
+    with app.app_context():
+        assert inspect(db.engine).get_table_names() == []
+
+        result = app.test_cli_runner().invoke(args=["init-db"])
+        assert result.exit_code == 0
+        assert "สร้างต้นปาล์ม 312 ต้น" in result.output
+        assert stored_schema_version() == schema_version()
+
+        result = app.test_cli_runner().invoke(args=["init-db"])
+        assert "สร้างต้นปาล์ม 0 ต้น" in result.output
+
+
+def test_init_adds_new_nullable_columns_to_existing_tables(app):
+    # ฐานข้อมูลที่สร้างก่อนมีคอลัมน์ owner/heartbeat_at ของ jobs
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE jobs DROP COLUMN heartbeat_at")
+        conn.exec_driver_sql("ALTER TABLE jobs DROP COLUMN owner")
+    schema._checked.clear()
+    db.session.merge(AppMeta(key=SCHEMA_VERSION_KEY, value="old"))
+    db.session.commit()
+
+    assert ensure_schema() is True
+    columns = {c["name"] for c in inspect(db.engine).get_columns("jobs")}
+    assert {"owner", "heartbeat_at"} <= columns